@@ -12,6 +12,13 @@ class SpreadsAdmin(admin.ModelAdmin):
     list_filter = ('spread_type', 'status')
     search_fields = ('id', 'trader__username')
 
+    def save_model(self, request, obj, form, change):
+        # Only the edited columns: the exit lot counters are moved by exit writes
+        if change:
+            obj.save_changes()
+        else:
+            super().save_model(request, obj, form, change)
+
 @admin.register(SpreadsExit)
 class SpreadsExitAdmin(admin.ModelAdmin):
     list_display = ('id', 'spread', 'requested_exit_lots', 'exit_price', 'received_lots', 'exit_status', 'requested_at')
@@ -20,4 +20,12 @@ class SpreadsConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'spreads_exit_update',
             'exit': event['exit']
+        }))
+
+    # Every exit event a create_spread_exit request added, in one message
+    async def spreads_exits_created(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'spreads_exits_created',
+            'spread': event['spread'],
+            'exits': event['exits']
         }))
\ No newline at end of file
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flytrade', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leg',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='spreads',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -1,17 +1,43 @@
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
-from trade.models import Availability
+from trade.models import Availability, ExitLifecycleMixin, ExitQuerySet, TrackedFieldsMixin, VersionedMixin
+from trade.ticks import DEFAULT_SPEC, contract_spec
 from django.contrib.auth import get_user_model
 from decimal import Decimal
 
 User = get_user_model()  # corrected to use function call
 
-class Leg(models.Model):
+class LegQuerySet(models.QuerySet):
+    def for_listing(self):
+        """The availability LegSerializer describes, with its commodity and settlements, joined."""
+        return self.select_related("name__commodity", "name__start_month", "name__end_month")
+
+
+class SpreadsQuerySet(models.QuerySet):
+    """Querysets for the spread list endpoints: a page costs the same queries whatever its size."""
+
+    def for_listing(self):
+        """The trader and approver joined, the legs (see LegQuerySet) prefetched in one query."""
+        return self.select_related("trader", "approved_by").prefetch_related(
+            models.Prefetch("legs", queryset=Leg.objects.for_listing())
+        )
+
+    def with_exits(self):
+        """The spreads' exit events, newest first, with their initiators and approvers, in one query."""
+        return self.prefetch_related(
+            models.Prefetch("exit_events", queryset=SpreadsExit.objects.for_listing().order_by("-requested_at"))
+        )
+
+
+class Leg(VersionedMixin, models.Model):
     name = models.ForeignKey(Availability, on_delete=models.CASCADE, related_name="legname")
     lots_and_price = models.JSONField(default=list)
     trader = models.ForeignKey(User, on_delete=models.CASCADE, related_name="trader1")
     created_on = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = LegQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.name} by {self.trader}"
@@ -33,7 +59,7 @@ class Leg(models.Model):
             if not isinstance(entry["stop_loss"], (int, float)):
                 raise ValidationError("'stop_loss' must be numeric.")
 
-class Spreads(models.Model):
+class Spreads(VersionedMixin, TrackedFieldsMixin, models.Model):
     TRADE_OPTIONS = [('long', 'Long'), ('short', 'Short')]
     APPROVAL_STATUSES = [
         ('pending', 'Pending'), 
@@ -63,6 +89,17 @@ class Spreads(models.Model):
     avg_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_lots = models.IntegerField(default=0)
     trader = models.ForeignKey(User, on_delete=models.CASCADE, related_name="trader2")
+    # Lots held by exit events, moved with F() by their writes (see Trade)
+    exit_requested_lots = models.IntegerField(default=0, editable=False)
+    exit_received_lots = models.IntegerField(default=0, editable=False)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = SpreadsQuerySet.as_manager()
+
+    @property
+    def remaining_lots(self):
+        """Filled lots no exit event has requested yet: the cap on new exit requests."""
+        return self.total_lots - self.exit_requested_lots
 
     def clean(self):
         # Ensure all legs belong to the same trader as this spread.
@@ -112,7 +149,7 @@ class DFly(models.Model):
     def __str__(self):
         return f"DFly {self.id}"
 
-class SpreadsExit(models.Model):
+class SpreadsExit(ExitLifecycleMixin, models.Model):
     EXIT_STATUSES = [
         ('pending', 'Pending Approval'),
         ('approved', 'Approved'),
@@ -136,11 +173,21 @@ class SpreadsExit(models.Model):
     profit_loss = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Calculated Profit/Loss for the lots closed in this event.")
     is_closed = models.BooleanField(default=False, help_text="When all the lots are received.")
 
+    objects = ExitQuerySet.as_manager()
+    lots_field = "received_lots"
+    position_field = "spread"
+    commodity_path = "availability__legname__legs_of_spread"
+
     class Meta:
         verbose_name = "Spreads Exit"
         verbose_name_plural = "Spreads Exits"
         ordering = ['-requested_at']
 
+    def point_value(self):
+        # Every leg of a spread trades the same commodity
+        availability_id = self.spread.legs.values_list("name_id", flat=True).first()
+        return contract_spec(availability_id).point_value if availability_id else DEFAULT_SPEC.point_value
+
     def __str__(self):
         return f"Exit for Spread {self.spread.id} - {self.requested_exit_lots} lots requested at {self.exit_price or 'N/A'}"
 
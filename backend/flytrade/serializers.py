@@ -2,13 +2,17 @@ from decimal import Decimal
 from rest_framework import serializers
 from django.utils.timezone import now
 from .models import Leg, Spreads, SpreadsExit, Availability
+from trade.projection import SparseFieldsMixin
+from trade.serializers import AvailabilityField, StoredAvailabilityMixin
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-class LegSerializer(serializers.ModelSerializer):
+class LegSerializer(StoredAvailabilityMixin, serializers.ModelSerializer):
     """Serializer for Leg model with nested availability info"""
     
+    name = AvailabilityField(queryset=Availability.objects.all())
+
     # Read-only fields for display
     availability_display = serializers.SerializerMethodField()
     commodity_code = serializers.SerializerMethodField()
@@ -17,10 +21,10 @@ class LegSerializer(serializers.ModelSerializer):
     class Meta:
         model = Leg
         fields = [
-            'id', 'name', 'lots_and_price', 'trader', 'created_on',
+            'id', 'name', 'lots_and_price', 'trader', 'created_on', 'version',
             'availability_display', 'commodity_code', 'commodity_name'
         ]
-        read_only_fields = ['id', 'trader', 'created_on']
+        read_only_fields = ['id', 'trader', 'created_on', 'version']
     
     def get_availability_display(self, obj):
         if obj.name:
@@ -64,7 +68,7 @@ class LegSerializer(serializers.ModelSerializer):
         
         return value
 
-class SpreadsSerializer(serializers.ModelSerializer):
+class SpreadsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Spreads with nested legs"""
     
     legs = LegSerializer(many=True, read_only=True)
@@ -88,13 +92,13 @@ class SpreadsSerializer(serializers.ModelSerializer):
             'id', 'legs', 'leg_ids', 'spread_type', 'trade_type', 'status',
             'approved_by', 'created_at', 'approved_at', 'order_placed_at',
             'fills_received_at', 'close_requested_at', 'is_closed',
-            'close_accepted', 'ratio', 'avg_price', 'total_lots', 'trader',
+            'close_accepted', 'ratio', 'avg_price', 'total_lots', 'trader', 'version',
             'status_display', 'spread_type_display', 'trade_type_display',
             'approved_by_name', 'trader_name'
         ]
         read_only_fields = [
             'id', 'approved_by', 'created_at', 'approved_at', 'order_placed_at',
-            'fills_received_at', 'close_requested_at', 'trader'
+            'fills_received_at', 'close_requested_at', 'trader', 'version'
         ]
     
     def create(self, validated_data):
@@ -173,6 +177,29 @@ class SpreadsExitSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Exit price must be positive.")
         return value
 
+    def validate(self, data):
+        spread = data.get('spread') or getattr(self.instance, 'spread', None)
+        requested = data.get('requested_exit_lots')
+        # Cannot request more than the lots other exit events have not requested yet
+        if spread is not None and requested is not None:
+            available = spread.remaining_lots + (self.instance.held_lots(loaded=True)[0] if self.instance else 0)
+            if requested > available:
+                raise serializers.ValidationError(
+                    f"Requested exit lots cannot exceed the spread's remaining lots ({available})."
+                )
+        return data
+
+class SpreadsExitRequestSerializer(serializers.ModelSerializer):
+    """One item of a create_spread_exit request; the spread and the initiator come from the request itself."""
+
+    class Meta:
+        model = SpreadsExit
+        fields = ['requested_exit_lots', 'exit_price']
+
+    validate_requested_exit_lots = SpreadsExitSerializer.validate_requested_exit_lots
+    validate_exit_price = SpreadsExitSerializer.validate_exit_price
+
+
 class SpreadsWithExitsSerializer(serializers.ModelSerializer):
     """Serializer for Spreads with nested exit information"""
     
@@ -189,6 +216,6 @@ class SpreadsWithExitsSerializer(serializers.ModelSerializer):
         model = Spreads
         fields = [
             'id', 'legs', 'exit_events', 'spread_type', 'trade_type', 'status',
-            'created_at', 'ratio', 'avg_price', 'total_lots', 'is_closed',
+            'created_at', 'ratio', 'avg_price', 'total_lots', 'is_closed', 'version',
             'status_display', 'spread_type_display', 'trade_type_display', 'trader_name'
         ]
\ No newline at end of file
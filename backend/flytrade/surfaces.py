@@ -0,0 +1,71 @@
+"""
+Theoretical butterfly and double-fly prices derived from the settlement curve.
+
+A fly over contracts a < b < c is a - 2b + c; a double fly over a < b < c < d is
+fly(a, b, c) - fly(b, c, d) = a - 3b + 3c - d. Every valid month combination of a
+commodity's live contracts is priced at once with array operations over the curve, and the
+filtered result is memoized on the catalogue, so it is rebuilt after the next settlement update.
+"""
+import numpy as np
+
+from trade.curves import DFLY_WEIGHTS, FLY_WEIGHTS, from_cents, leg_combinations, structure_prices
+
+SURFACE_WEIGHTS = {"fly": FLY_WEIGHTS, "dfly": DFLY_WEIGHTS}
+
+# Upper bound on points in one response. It fits the full fly surface of a 72-contract curve
+# (59,640 triples); its unfiltered double-fly surface has over a million points
+MAX_SURFACE_POINTS = 100000
+
+
+class SurfaceTooLarge(ValueError):
+    pass
+
+
+def surface_mask(keys, legs, start_range, end_range, width_range, equal_wings):
+    """Boolean mask over `legs` rows for the tenor filters (inclusive contract keys / months)."""
+    front, back = keys[legs[:, 0]], keys[legs[:, -1]]
+    mask = np.ones(len(legs), dtype=bool)
+    for values, (low, high) in ((front, start_range), (back, end_range), (back - front, width_range)):
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+    if equal_wings:
+        gaps = np.diff(keys[legs], axis=1)
+        mask &= (gaps == gaps[:, :1]).all(axis=1)
+    return mask
+
+
+def build_surface(catalogue, commodity_id, kind, start_range=(None, None), end_range=(None, None),
+                  width_range=(None, None), equal_wings=False):
+    """
+    {commodity_code, commodity_name, kind, months, settlement_ids, legs, prices} for one
+    commodity. legs[i] holds positions into months (front leg first) and prices[i] its
+    theoretical price. Raises SurfaceTooLarge when the filters leave too many points.
+    """
+    weights = SURFACE_WEIGHTS[kind]
+    settlements, curve = catalogue.curve(commodity_id)
+    keys = np.array([s.contract_key for s in settlements], dtype=np.int64)
+    legs = leg_combinations(len(settlements), len(weights))
+    legs = legs[surface_mask(keys, legs, start_range, end_range, width_range, equal_wings)]
+    if len(legs) > MAX_SURFACE_POINTS:
+        raise SurfaceTooLarge(
+            f"{len(legs)} points match; narrow the tenor filters to at most {MAX_SURFACE_POINTS}."
+        )
+
+    commodity = catalogue.commodities[commodity_id]
+    return {
+        "commodity_code": commodity.code,
+        "commodity_name": commodity.name,
+        "kind": kind,
+        "months": [f"{s.month}{s.year}" for s in settlements],
+        "settlement_ids": [s.id for s in settlements],
+        "legs": legs.tolist(),
+        "prices": from_cents(structure_prices(curve, legs, weights)).tolist(),
+    }
+
+
+def cached_surface(catalogue, commodity_id, kind, **filters):
+    """build_surface memoized on the catalogue, i.e. once per settlement version."""
+    key = ("surface", commodity_id, kind, tuple(sorted(filters.items())))
+    return catalogue.memoize(key, lambda: build_surface(catalogue, commodity_id, kind, **filters))
@@ -1,3 +1,214 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from trade.cache import catalogue_cache
+from trade.loaders import bulk_load_catalogue
+from trade.models import Availability, Settlement
+
+from .models import Leg, Spreads, SpreadsExit
+
+
+class StructureSurfaceTests(TestCase):
+    prices = ['400.00', '410.50', '425.25', '431.00', '436.75', '450.00', '452.50', '461.25']
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'ZC': ['Mar', 'Jun', 'Sep', 'Dec']}, start_year=2025, end_year=2026, spreads=False)
+        settlements = list(Settlement.objects.order_by('contract_key'))
+        for price, settlement in zip(cls.prices, settlements):
+            settlement.settlement_price = Decimal(price)
+        Settlement.objects.bulk_update(settlements, ['settlement_price'])
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw')
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, query):
+        return self.client.get(f'/api/flytrades/surfaces/{query}')
+
+    def test_fly_surface_covers_every_triple(self):
+        response = self.get('fly/?commodity=zc')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['legs']), 56)
+        self.assertEqual(response.data['legs'][0], [0, 1, 2])
+        self.assertEqual(response.data['prices'][0], 400.00 - 2 * 410.50 + 425.25)
+
+    def test_dfly_surface_with_tenor_filters(self):
+        response = self.get('dfly/?commodity=ZC&start_from=Jun25&end_to=Dec26&equal_wings=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['legs'], [[1, 2, 3, 4], [1, 3, 5, 7], [2, 3, 4, 5], [3, 4, 5, 6], [4, 5, 6, 7]])
+        p = [Decimal(price) for price in self.prices]
+        self.assertEqual(response.data['prices'][1], float(p[1] - 3 * p[3] + 3 * p[5] - p[7]))
+        self.assertEqual(len(self.get('dfly/?commodity=ZC&max_width=9').data['legs']), 5)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.get('condor/?commodity=ZC').status_code, 404)
+        self.assertEqual(self.get('fly/?commodity=XX').status_code, 404)
+        self.assertEqual(self.get('fly/?commodity=ZC&start_from=Foo').status_code, 400)
+
+    def test_surface_is_cached_per_settlement_version(self):
+        self.get('fly/?commodity=ZC')
+        with self.assertNumQueries(0):
+            self.get('fly/?commodity=ZC')
+        settlement = Settlement.objects.get(commodity__code='ZC', month='Jun', year=2025)
+        settlement.settlement_price = Decimal('411.50')
+        with self.captureOnCommitCallbacks(execute=True):
+            settlement.save(update_fields=['settlement_price'])
+        self.assertEqual(self.get('fly/?commodity=ZC').data['prices'][0], 400.00 - 2 * 411.50 + 425.25)
+
+
+class SpreadLifecycleQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='manager', password='pw', is_staff=True)
+        cls.spread = Spreads.objects.create(spread_type='fly', trade_type='long', trader=cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_status_transitions_write_only_touched_columns(self):
+        base = f'/api/flytrades/spreads/{self.spread.id}'
+        for url, data, queries in [
+            (f'{base}/update-status/', {'status': 'approved'}, 5),
+            (f'{base}/update-status/', {'status': 'order_placed'}, 6),
+            (f'{base}/request-close/', {}, 6),
+            (f'{base}/accept-close/', {}, 6),
+        ]:
+            with self.assertNumQueries(queries):
+                response = self.client.patch(url, data, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+        self.spread.refresh_from_db()
+        self.assertEqual((self.spread.status, self.spread.close_accepted), ('order_placed', True))
+
+    def test_exit_fill_writes_the_exit_and_its_counters(self):
+        Spreads.objects.filter(pk=self.spread.pk).update(avg_price=12)
+        exit_obj = SpreadsExit.objects.create(spread=self.spread, requested_exit_lots=4, exit_price=15,
+                                              exit_initiated_by=self.user, exit_status='order_placed')
+        exit_obj = SpreadsExit.objects.select_related('spread').get(pk=exit_obj.pk)
+        exit_obj.received_lots = 3
+        # The write, reading which commodity (point value) the spread's legs trade, and the
+        # spread's exit_received_lots counter
+        with self.assertNumQueries(3):
+            exit_obj.save_changes()
+        exit_obj.refresh_from_db()
+        self.assertEqual(
+            (exit_obj.exit_status, exit_obj.profit_loss, exit_obj.is_closed),
+            ('partial_filled', Decimal('9.00'), False),
+        )
+
+    def test_spread_exits_cap_on_the_remaining_lots(self):
+        Spreads.objects.filter(pk=self.spread.pk).update(total_lots=5)
+        url = '/api/flytrades/spreads/exits/create/'
+        response = self.client.post(url, {'spread': self.spread.id, 'exits': [{'requested_exit_lots': 3}]}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        response = self.client.post(url, {'spread': self.spread.id, 'exits': [{'requested_exit_lots': 2}, {'requested_exit_lots': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.spread.refresh_from_db()
+        self.assertEqual((self.spread.exit_requested_lots, self.spread.remaining_lots), (3, 2))
+
+        # A cancelled exit gives its lots back, and cannot take them again once they are requested
+        first = SpreadsExit.objects.get(spread=self.spread)
+        update = f'/api/flytrades/spreads/exits/{first.id}/update-status/'
+        self.assertEqual(self.client.patch(update, {'exit_status': 'cancelled'}, format='json').status_code, 200)
+        response = self.client.post(url, {'spread': self.spread.id, 'exits': [{'requested_exit_lots': 5}]}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        response = self.client.patch(update, {'exit_status': 'approved'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], "Requested exits (3 lots) exceed the spread's remaining lots (0).")
+        self.spread.refresh_from_db()
+        self.assertEqual(self.spread.exit_requested_lots, 5)
+
+
+class SpreadListQueryCountTests(TestCase):
+    """Every leg and spread list endpoint costs a fixed number of queries, whatever the number of rows it returns."""
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw', is_staff=True)
+        cls.availabilities = list(Availability.objects.order_by('pk')[:2])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.rows = 0
+
+    def add_rows(self, count):
+        """Per row: two legs, and an open spread with two exit events, a closed one awaiting acceptance and an accepted one on them."""
+        for _ in range(count):
+            self.rows += 1
+            approver = get_user_model().objects.create_user(username=f'manager{get_user_model().objects.count()}')
+            legs = [Leg.objects.create(name=availability, trader=self.user) for availability in self.availabilities]
+            for is_closed, close_accepted in ((True, False), (True, True), (False, False)):
+                spread = Spreads.objects.create(spread_type='fly', trade_type='long', trader=self.user, approved_by=approver,
+                                                is_closed=is_closed, close_accepted=close_accepted)
+                spread.legs.set(legs)
+            for _ in range(2):
+                SpreadsExit.objects.create(spread=spread, requested_exit_lots=1, exit_initiated_by=approver,
+                                           exit_approved_by=approver)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        # Paginated views count first; legs and exit events are one prefetch each
+        for url, queries in [
+            ('/api/flytrades/legs/my/', 1),
+            ('/api/flytrades/spreads/manager/?page_size=100', 3),
+            ('/api/flytrades/spreads/my/', 2),
+            ('/api/flytrades/spreads/exits/my/', 3),
+            ('/api/flytrades/spreads/exits/all/', 3),
+            ('/api/flytrades/spreads/pending-close/', 2),
+            ('/api/flytrades/spreads/closed/', 2),
+        ]:
+            for rows in (1, 5):
+                self.add_rows(rows - self.rows)
+                with self.subTest(url=url, rows=rows), self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data)
+            self.rows = 0
+            Spreads.objects.all().delete()
+            Leg.objects.all().delete()
+
+
+class SpreadVersionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='manager', password='pw', is_staff=True)
+        entries = [{'lots': 4, 'price': 10, 'added_at': '2026-01-05T10:00:00Z', 'fills_received': 0, 'stop_loss': 5}]
+        cls.leg = Leg.objects.create(name=Availability.objects.spreads().get(), lots_and_price=entries, trader=cls.user)
+        cls.spread = Spreads.objects.create(spread_type='fly', trade_type='long', trader=cls.user, status='order_placed')
+        cls.spread.legs.add(cls.leg)
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def update_fills(self, filled, **versions):
+        entries = [dict(self.leg.lots_and_price[0], fills_received=filled)]
+        return self.client.patch(f'/api/flytrades/spreads/{self.spread.id}/update-fills/',
+                                 {'leg_id': self.leg.id, 'lots_and_price': entries, **versions}, format='json')
+
+    def test_leg_and_spread_are_written_together(self):
+        Leg.objects.filter(pk=self.leg.pk).update(version=2)
+        response = self.update_fills(2, version=1, leg_version=1)
+        self.assertEqual((response.status_code, response.data['version']), (409, 2))
+
+        # The leg matches but the spread moved on: the leg write is rolled back with it
+        Spreads.objects.filter(pk=self.spread.pk).update(version=3)
+        response = self.update_fills(2, version=1, leg_version=2)
+        self.assertEqual((response.status_code, response.data['version']), (409, 3))
+        self.assertEqual(Leg.objects.values_list('lots_and_price', 'version').get(pk=self.leg.pk),
+                         (self.leg.lots_and_price, 2))
+
+        response = self.update_fills(2, version=3, leg_version=2)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['version'], response.data['legs'][0]['version']), (4, 3))
+        self.assertEqual((response.data['total_lots'], response.data['status']), (2, 'partial_fills_received'))
 
-# Create your tests here.
@@ -25,4 +25,7 @@ urlpatterns = [
     path('spreads/pending-close/', views.pending_spread_close_requests, name='pending_spread_close_requests'),
     path('spreads/<int:spread_id>/accept-close/', views.accept_spread_close, name='accept_spread_close'),
     path('spreads/closed/', views.closed_spreads, name='closed_spreads'),
+
+    # Theoretical price surfaces
+    path('surfaces/<str:kind>/', views.structure_surface, name='structure_surface'),
 ]
\ No newline at end of file
@@ -1,7 +1,7 @@
 
 from decimal import Decimal
 from django.db import transaction
-from django.db.models import Prefetch, Sum, Q
+from django.db.models import Sum, Q
 from django.shortcuts import get_object_or_404
 from django.utils.timezone import now
 from rest_framework import generics, permissions, status
@@ -11,11 +11,17 @@ from rest_framework.response import Response
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
+from trade.cache import catalogue_cache
+from trade.models import VersionConflict, parse_contract
+from trade.pagination import list_response
+from trade.ticks import from_ticks, to_ticks
+from trade.views import FILLED_FIRST, NEWEST_FIRST, expect_client_version, version_conflict
 from .models import Leg, Spreads, SpreadsExit, Availability
 from .serializers import (
-    LegSerializer, SpreadsSerializer, SpreadsExitSerializer, 
+    LegSerializer, SpreadsSerializer, SpreadsExitSerializer, SpreadsExitRequestSerializer,
     SpreadsWithExitsSerializer
 )
+from .surfaces import SURFACE_WEIGHTS, SurfaceTooLarge, cached_surface
 
 # WebSocket notification functions
 def notify_spread_update(spread: Spreads):
@@ -46,6 +52,21 @@ def notify_spread_exit_update(exit_obj: SpreadsExit):
     except Exception as e:
         print(f"WebSocket notification failed for spread exit {exit_obj.id}: {e}")
 
+def notify_spread_exits_created(spread_id, exits_data):
+    """One message listing every exit event a create_spread_exit request added to a spread"""
+    try:
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            'spreads',
+            {
+                'type': 'spreads_exits_created',
+                'spread': spread_id,
+                'exits': exits_data
+            }
+        )
+    except Exception as e:
+        print(f"WebSocket notification failed for exits of spread {spread_id}: {e}")
+
 class SpreadsPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
@@ -67,6 +88,9 @@ def create_leg(request):
 def add_lots_to_leg(request, leg_id):
     """Add lots to existing leg"""
     leg = get_object_or_404(Leg, id=leg_id, trader=request.user)
+    error = expect_client_version(leg, request)
+    if error:
+        return error
 
     new_entries = request.data.get("lots_and_price", [])
     if not isinstance(new_entries, list):
@@ -78,7 +102,10 @@ def add_lots_to_leg(request, leg_id):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     leg.lots_and_price = new_entries
-    leg.save()
+    try:
+        leg.save()
+    except VersionConflict as e:
+        return version_conflict(e)
 
     return Response(LegSerializer(leg).data)
 
@@ -86,7 +113,7 @@ def add_lots_to_leg(request, leg_id):
 @permission_classes([permissions.IsAuthenticated])
 def my_legs(request):
     """Get user's legs"""
-    legs = Leg.objects.filter(trader=request.user).order_by('-created_on')
+    legs = Leg.objects.filter(trader=request.user).for_listing().order_by('-created_on')
     serializer = LegSerializer(legs, many=True)
     return Response(serializer.data)
 
@@ -109,7 +136,7 @@ class ManagerSpreadListView(generics.ListAPIView):
     pagination_class = SpreadsPagination
 
     def get_queryset(self):
-        return Spreads.objects.select_related('trader', 'approved_by').prefetch_related('legs').order_by('-created_at')
+        return Spreads.objects.for_listing().order_by('-created_at')
 
 class UserSpreadListView(generics.ListAPIView):
     """User view to list their own spreads"""
@@ -118,7 +145,7 @@ class UserSpreadListView(generics.ListAPIView):
     pagination_class = SpreadsPagination
 
     def get_queryset(self):
-        return Spreads.objects.filter(trader=self.request.user).select_related('approved_by').prefetch_related('legs').order_by('-created_at')
+        return Spreads.objects.filter(trader=self.request.user).for_listing().order_by('-created_at')
 
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAuthenticated])
@@ -126,6 +153,9 @@ def update_spread_status(request, spread_id):
     """Update spread status with proper transitions and timestamps"""
     spread = get_object_or_404(Spreads, id=spread_id)
     new_status = request.data.get("status")
+    error = expect_client_version(spread, request)
+    if error:
+        return error
 
     valid_statuses = ['pending', 'approved', 'order_placed', 'fills_received', 'partial_fills_received']
     if new_status not in valid_statuses:
@@ -163,7 +193,10 @@ def update_spread_status(request, spread_id):
         spread.order_placed_at = None
         spread.fills_received_at = None
 
-    spread.save()
+    try:
+        spread.save_changes()
+    except VersionConflict as e:
+        return version_conflict(e)
     notify_spread_update(spread)
 
     return Response(SpreadsSerializer(spread).data)
@@ -171,8 +204,15 @@ def update_spread_status(request, spread_id):
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAuthenticated])
 def update_spread_fills(request, spread_id):
-    """Update fills for spread legs"""
+    """
+    Update fills for spread legs.
+    Send the spread's `version` and the leg's `leg_version` to have the update refused with 409
+    if either changed since they were read.
+    """
     spread = get_object_or_404(Spreads, id=spread_id)
+    error = expect_client_version(spread, request)
+    if error:
+        return error
 
     if spread.status not in ['approved', 'order_placed', 'partial_fills_received']:
         return Response({"error": "Cannot update fills for this spread status."}, status=status.HTTP_400_BAD_REQUEST)
@@ -187,6 +227,10 @@ def update_spread_fills(request, spread_id):
     leg = get_object_or_404(Leg, id=leg_id, trader=spread.trader)
     if leg not in spread.legs.all():
         return Response({"error": "Leg does not belong to this spread."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        leg.expect_version(request.data.get("leg_version"))
+    except ValueError as e:
+        return Response({"error": f"leg_{e}"}, status=status.HTTP_400_BAD_REQUEST)
 
     # Validate via serializer
     leg_serializer = LegSerializer(leg, data={'lots_and_price': new_entries}, partial=True)
@@ -194,40 +238,45 @@ def update_spread_fills(request, spread_id):
         return Response(leg_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     leg.lots_and_price = new_entries
-    leg.save()
-
-    # Recalculate spread totals
-    total_lots = 0
-    total_weighted_price = 0
-
-    for spread_leg in spread.legs.all():
-        for entry in spread_leg.lots_and_price:
-            fills = entry.get('fills_received', 0)
-            if fills > 0:
-                total_lots += fills
-                total_weighted_price += fills * entry.get('price', 0)
-
-    spread.total_lots = total_lots
-    spread.avg_price = total_weighted_price / total_lots if total_lots > 0 else 0
-
-    # Update status based on fills
-    if spread.status in ['order_placed', 'partial_fills_received']:
-        # Determine if we have partial or complete fills
-        total_requested_lots = sum(
-            sum(entry.get('lots', 0) for entry in leg.lots_and_price)
-            for leg in spread.legs.all()
-        )
-
-        if 0 < total_lots < total_requested_lots:
-            spread.status = 'partial_fills_received'
-            if spread.fills_received_at is None:
-                spread.fills_received_at = now()
-        elif total_lots >= total_requested_lots:
-            spread.status = 'fills_received'
-            if spread.fills_received_at is None:
-                spread.fills_received_at = now()
-
-    spread.save()
+    try:
+        # The leg and the spread totals computed from it are written together or not at all
+        with transaction.atomic():
+            leg.save()
+
+            # Recalculate spread totals, summing prices as integer ticks
+            total_lots = 0
+            total_ticks = 0
+
+            for spread_leg in spread.legs.all():
+                for entry in spread_leg.lots_and_price:
+                    fills = entry.get('fills_received', 0)
+                    if fills > 0:
+                        total_lots += fills
+                        total_ticks += fills * to_ticks(entry.get('price', 0))
+
+            spread.total_lots = total_lots
+            spread.avg_price = from_ticks(total_ticks) / total_lots if total_lots > 0 else 0
+
+            # Update status based on fills
+            if spread.status in ['order_placed', 'partial_fills_received']:
+                # Determine if we have partial or complete fills
+                total_requested_lots = sum(
+                    sum(entry.get('lots', 0) for entry in leg.lots_and_price)
+                    for leg in spread.legs.all()
+                )
+
+                if 0 < total_lots < total_requested_lots:
+                    spread.status = 'partial_fills_received'
+                    if spread.fills_received_at is None:
+                        spread.fills_received_at = now()
+                elif total_lots >= total_requested_lots:
+                    spread.status = 'fills_received'
+                    if spread.fills_received_at is None:
+                        spread.fills_received_at = now()
+
+            spread.save_changes()
+    except VersionConflict as e:
+        return version_conflict(e)
     notify_spread_update(spread)
 
     return Response(SpreadsSerializer(spread).data)
@@ -237,13 +286,19 @@ def update_spread_fills(request, spread_id):
 def update_spread_close(request, spread_id):
     """Request to close a spread"""
     spread = get_object_or_404(Spreads, id=spread_id, trader=request.user)
+    error = expect_client_version(spread, request)
+    if error:
+        return error
 
     if spread.is_closed:
         return Response({"error": "Close request already sent."}, status=status.HTTP_400_BAD_REQUEST)
 
     spread.close_requested_at = now()
     spread.is_closed = True
-    spread.save()
+    try:
+        spread.save_changes()
+    except VersionConflict as e:
+        return version_conflict(e)
 
     notify_spread_update(spread)
     return Response(SpreadsSerializer(spread).data)
@@ -252,15 +307,14 @@ def update_spread_close(request, spread_id):
 @permission_classes([permissions.IsAuthenticated])
 def my_spreads(request):
     """Get user's spreads with legs"""
-    spreads = Spreads.objects.filter(trader=request.user).prefetch_related('legs').order_by('-created_at')
-    serializer = SpreadsSerializer(spreads, many=True)
-    return Response(serializer.data)
+    spreads = Spreads.objects.filter(trader=request.user).for_listing().order_by('-created_at')
+    return list_response(request, spreads, SpreadsSerializer, NEWEST_FIRST)
 
 # SPREADS EXIT VIEWS
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def create_spread_exit(request):
-    """Create multiple spread exits in one request"""
+    """Create multiple spread exits in one request: one bulk insert and one broadcast for all of them"""
     spread_id = request.data.get("spread")
     exits = request.data.get("exits")
 
@@ -279,22 +333,25 @@ def create_spread_exit(request):
     if spread.trader != request.user and not request.user.is_staff:
         return Response({"error": "Not allowed to exit this spread."}, status=status.HTTP_403_FORBIDDEN)
 
-    created = []
-    with transaction.atomic():
-        for item in exits:
-            payload = {
-                "spread": spread.id,
-                "requested_exit_lots": item.get("requested_exit_lots"),
-                "exit_price": item.get("exit_price"),
-            }
+    items = SpreadsExitRequestSerializer(data=exits, many=True)
+    items.is_valid(raise_exception=True)
 
-            serializer = SpreadsExitSerializer(data=payload)
-            serializer.is_valid(raise_exception=True)
-            obj = serializer.save(exit_initiated_by=request.user)
-            notify_spread_exit_update(obj)
-            created.append(SpreadsExitSerializer(obj).data)
-
-    return Response({"spread": spread.id, "created": created}, status=status.HTTP_201_CREATED)
+    with transaction.atomic():
+        # One locked read of the spread's exit counters caps the whole request
+        spread = Spreads.objects.select_for_update().get(pk=spread.pk)
+        requested = sum(item["requested_exit_lots"] for item in items.validated_data)
+        if requested > spread.remaining_lots:
+            return Response(
+                {"error": f"Requested exits ({requested} lots) exceed the spread's remaining lots ({spread.remaining_lots})."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        created = SpreadsExit.objects.create_requests([
+            SpreadsExit(spread=spread, exit_initiated_by=request.user, **item) for item in items.validated_data
+        ])
+        data = SpreadsExitSerializer(created, many=True).data
+        transaction.on_commit(lambda: notify_spread_exits_created(spread.id, data))
+
+    return Response({"spread": spread.id, "created": data}, status=status.HTTP_201_CREATED)
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -303,9 +360,7 @@ def my_spread_exit_requests(request):
     spreads = Spreads.objects.filter(
         trader=request.user,
         is_closed=False
-    ).prefetch_related(
-        Prefetch('exit_events', queryset=SpreadsExit.objects.order_by('-requested_at'))
-    ).order_by('-created_at')
+    ).for_listing().with_exits().order_by('-created_at')
 
     serializer = SpreadsWithExitsSerializer(spreads, many=True)
     return Response(serializer.data)
@@ -316,9 +371,7 @@ def all_spread_exit_requests(request):
     """Get all spread exit requests for managers"""
     spreads = Spreads.objects.filter(
         is_closed=False
-    ).prefetch_related(
-        Prefetch('exit_events', queryset=SpreadsExit.objects.order_by('-requested_at'))
-    ).order_by('-created_at')
+    ).for_listing().with_exits().order_by('-created_at')
 
     serializer = SpreadsWithExitsSerializer(spreads, many=True)
     return Response(serializer.data)
@@ -363,7 +416,11 @@ def update_spread_exit_status(request, exit_id):
     else:
         return Response({"error": "Invalid exit_status."}, status=status.HTTP_400_BAD_REQUEST)
 
-    exit_obj.save()
+    try:
+        exit_obj.save_changes()
+    except ValueError as e:
+        # Re-activating the exit would request more lots than the spread has left
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     notify_spread_exit_update(exit_obj)
 
     return Response(SpreadsExitSerializer(exit_obj).data)
@@ -372,7 +429,7 @@ def update_spread_exit_status(request, exit_id):
 @permission_classes([permissions.IsAdminUser])
 def pending_spread_close_requests(request):
     """Get pending spread close requests for managers"""
-    spreads = Spreads.objects.filter(is_closed=True, close_accepted=False).order_by('-close_requested_at')
+    spreads = Spreads.objects.filter(is_closed=True, close_accepted=False).for_listing().order_by('-close_requested_at')
     serializer = SpreadsSerializer(spreads, many=True)
     return Response(serializer.data)
 
@@ -381,12 +438,18 @@ def pending_spread_close_requests(request):
 def accept_spread_close(request, spread_id):
     """Accept spread close request"""
     spread = get_object_or_404(Spreads, id=spread_id)
+    error = expect_client_version(spread, request)
+    if error:
+        return error
 
     if not spread.is_closed or spread.close_accepted:
         return Response({"error": "Invalid close request."}, status=status.HTTP_400_BAD_REQUEST)
 
     spread.close_accepted = True
-    spread.save()
+    try:
+        spread.save_changes()
+    except VersionConflict as e:
+        return version_conflict(e)
 
     notify_spread_update(spread)
     return Response(SpreadsSerializer(spread).data)
@@ -395,6 +458,50 @@ def accept_spread_close(request, spread_id):
 @permission_classes([permissions.IsAdminUser])
 def closed_spreads(request):
     """Get closed and accepted spreads"""
-    spreads = Spreads.objects.filter(is_closed=True, close_accepted=True).order_by('-fills_received_at')
-    serializer = SpreadsSerializer(spreads, many=True)
-    return Response(serializer.data)
+    spreads = Spreads.objects.filter(is_closed=True, close_accepted=True).for_listing().order_by('-fills_received_at')
+    return list_response(request, spreads, SpreadsSerializer, FILLED_FIRST)
+
+
+# SURFACE VIEWS
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def structure_surface(request, kind):
+    """
+    Theoretical fly ("fly") or double-fly ("dfly") prices for one commodity from its settlements.
+    Query params:
+    - commodity (required)
+    - start_from, start_to, end_from, end_to: front / back leg contract months like "Mar26" (inclusive)
+    - min_width, max_width: months between front and back leg
+    - equal_wings: "true" to keep only evenly spaced legs
+    Served from the catalogue cache until the next settlement update.
+    """
+    if kind not in SURFACE_WEIGHTS:
+        return Response({"error": "kind must be 'fly' or 'dfly'."}, status=status.HTTP_404_NOT_FOUND)
+    params = request.GET
+    catalogue = catalogue_cache.get()
+    commodity = catalogue.commodities_by_code.get((params.get('commodity') or '').strip().lower())
+    if commodity is None:
+        return Response({"error": "Commodity not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    ranges = {}
+    for name in ['start_from', 'start_to', 'end_from', 'end_to']:
+        ranges[name] = parse_contract(params[name]) if params.get(name) else None
+        if params.get(name) and ranges[name] is None:
+            return Response({"error": f"Invalid {name}, expected a contract month like Mar26."},
+                            status=status.HTTP_400_BAD_REQUEST)
+    try:
+        width_range = tuple(int(params[name]) if params.get(name) else None for name in ['min_width', 'max_width'])
+    except ValueError:
+        return Response({"error": "min_width and max_width must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        surface = cached_surface(
+            catalogue, commodity.id, kind,
+            start_range=(ranges['start_from'], ranges['start_to']),
+            end_range=(ranges['end_from'], ranges['end_to']),
+            width_range=width_range,
+            equal_wings=params.get('equal_wings', '').lower() in ['1', 'true', 'yes'],
+        )
+    except SurfaceTooLarge as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(surface)
@@ -1,5 +1,14 @@
-from django.contrib import admin
-from .models import Trade, Commodity, Availability, Exit, Settlement
+import io
+
+from django import forms
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .loaders import load_settlement_prices
+from .fills import save_entries
+from .matching import rematch
+from .models import Trade, Commodity, Availability, Exit, Fill, LotMatch, Settlement
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -7,10 +16,14 @@ User = get_user_model()
 # Register your models here.
 admin.site.register(Exit)
 
+class PriceUploadForm(forms.Form):
+    price_file = forms.FileField(help_text="CSV with a code,month,year,price header")
+
+
 @admin.register(Settlement)
 class SettlementAdmin(admin.ModelAdmin):
-    list_display = ('commodity', 'month', 'year', 'settlement_price')
-    list_filter = ('month', 'year', 'commodity__name')
+    list_display = ('commodity', 'month', 'year', 'settlement_price', 'expired_at')
+    list_filter = ('month', 'year', 'commodity__name', ('expired_at', admin.EmptyFieldListFilter))
     list_editable = ('settlement_price',)
     search_fields = (
         'commodity__code',
@@ -19,9 +32,45 @@ class SettlementAdmin(admin.ModelAdmin):
     )
     raw_id_fields = ('commodity',)
 
+    def get_urls(self):
+        return [
+            path('upload-prices/', self.admin_site.admin_view(self.upload_prices_view), name='trade_settlement_upload_prices'),
+        ] + super().get_urls()
+
+    def upload_prices_view(self, request):
+        if not self.has_change_permission(request):
+            return redirect('admin:trade_settlement_changelist')
+        form = PriceUploadForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            lines = io.TextIOWrapper(form.cleaned_data['price_file'].file, encoding='utf-8-sig')
+            result = load_settlement_prices(lines)
+            for line_number, error in sorted(result['errors'] + result['unmatched'])[:20]:
+                self.message_user(request, f"Line {line_number}: {error}", messages.WARNING)
+            if result['errors'] or result['unmatched']:
+                self.message_user(
+                    request,
+                    f"{len(result['errors'])} rows skipped, {len(result['unmatched'])} matched no contract.",
+                    messages.WARNING,
+                )
+            timings = ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in result['timings'].items())
+            self.message_user(
+                request,
+                f"{result['rows']} prices read, {result['settlements']} settlements and "
+                f"{result['availabilities']} availabilities changed ({timings}).",
+                messages.SUCCESS,
+            )
+            return redirect('admin:trade_settlement_changelist')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'form': form,
+            'title': 'Upload settlement prices',
+        }
+        return TemplateResponse(request, 'admin/trade/settlement/upload_prices.html', context)
+
 @admin.register(Commodity)
 class CommodityAdmin(admin.ModelAdmin):
-    list_display = ('code', 'name')
+    list_display = ('code', 'name', 'tick_size', 'point_value')
     search_fields = ('code', 'name')
     ordering = ('code',)
 
@@ -35,7 +84,7 @@ class AvailabilityAdmin(admin.ModelAdmin):
 @admin.register(Trade)
 class TradeAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "trade_type", "trader", "status", "avg_price", "total_lots", "created_at", "is_closed")
-    list_filter = ("trade_type", "status", "is_closed")
+    list_filter = ("trade_type", "status", "is_closed", "lot_matching")
     search_fields = ("id", "trader__username", "ame__id")
     ordering = ("-created_at",)
     readonly_fields = ("avg_price", "total_lots", "created_at", "approved_at", "order_placed_at", "fills_received_at")
@@ -51,4 +100,27 @@ class TradeAdmin(admin.ModelAdmin):
         if db_field.name == "trader":
             # Example: skip banned/disabled users if you have that field
             kwargs.setdefault("queryset", User.objects.all())
-        return super().formfield_for_foreignkey(db_field, request, **kwargs)
\ No newline at end of file
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        if 'lots_and_price' in form.changed_data or not change:
+            save_entries(obj, obj.lots_and_price)
+        else:
+            # Only the edited columns: the exit lot counters are moved by exit writes
+            obj.save_changes()
+        if change and 'lot_matching' in form.changed_data:
+            rematch(obj)
+
+
+@admin.register(Fill)
+class FillAdmin(admin.ModelAdmin):
+    list_display = ("id", "trade", "commodity", "lots", "open_lots", "price", "filled_at")
+    list_filter = ("commodity", "filled_at")
+    date_hierarchy = "filled_at"
+    raw_id_fields = ("trade", "entry")
+
+
+@admin.register(LotMatch)
+class LotMatchAdmin(admin.ModelAdmin):
+    list_display = ("id", "exit", "fill", "lots", "profit_loss")
+    raw_id_fields = ("exit", "fill")
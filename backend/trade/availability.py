@@ -0,0 +1,121 @@
+"""
+Availability lookups shared by the API views and serializers.
+
+With settings.VIRTUAL_SPREADS enabled the catalogue only stores single contract months;
+calendar spreads are derived on demand from the Settlement list and exposed with a
+virtual id ("v<start_settlement_id>-<end_settlement_id>"). A concrete Availability row is
+created the first time a Trade or Leg references one of those ids.
+"""
+import re
+
+from django.conf import settings
+from django.db.models import F
+
+from .curves import calendar_spread
+from .models import Availability, Settlement
+
+VIRTUAL_ID_RE = re.compile(r"^v(\d+)-(\d+)$")
+
+# Stable search order; (commodity, start_key, end_key) is unique so it doubles as the keyset cursor
+SEARCH_ORDERING = [("commodity_id", False, False), ("start_key", False, False), ("end_key", False, True)]
+
+
+def virtual_spreads_enabled():
+    return getattr(settings, "VIRTUAL_SPREADS", False)
+
+
+def virtual_id(start_id, end_id):
+    return f"v{start_id}-{end_id}"
+
+
+def parse_virtual_id(value):
+    """Return (start_settlement_id, end_settlement_id) for a virtual id, else None."""
+    if not isinstance(value, str):
+        return None
+    match = VIRTUAL_ID_RE.match(value.strip())
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def resolve_availability(start_id, end_id):
+    """
+    The Availability for a calendar spread between two settlements: the stored row if there is
+    one, else an unsaved instance that store_availability saves. Reads only.
+    Raises Settlement.DoesNotExist for unknown settlements and ValueError for an invalid pair.
+    """
+    settlements = Settlement.objects.in_bulk([start_id, end_id])
+    if start_id not in settlements or end_id not in settlements:
+        raise Settlement.DoesNotExist(f"Unknown settlement in spread {start_id}-{end_id}.")
+    start, end = settlements[start_id], settlements[end_id]
+    if start.commodity_id != end.commodity_id:
+        raise ValueError("Both legs of a spread must belong to the same commodity.")
+    if start.contract_key is None or end.contract_key is None or start.contract_key >= end.contract_key:
+        raise ValueError("Spread start month must be before its end month.")
+    if start.expired_at or end.expired_at:
+        raise ValueError("Spread references an expired contract.")
+
+    availability = Availability.objects.filter(commodity_id=start.commodity_id, start_month=start, end_month=end).first()
+    if availability is None:
+        availability = Availability(
+            commodity_id=start.commodity_id, start_month=start, end_month=end, is_available=True,
+            settlement_price=calendar_spread(start.settlement_price, end.settlement_price),
+        )
+    return availability
+
+
+def store_availability(availability):
+    """Save an Availability from resolve_availability unless it is stored already; returns the stored row."""
+    if availability.pk is not None:
+        return availability
+    stored, _ = Availability.objects.get_or_create(
+        commodity_id=availability.commodity_id,
+        start_month=availability.start_month,
+        end_month=availability.end_month,
+        defaults={"settlement_price": availability.settlement_price, "is_available": availability.is_available},
+    )
+    return stored
+
+
+def availability_row(availability_id, commodity, start, end, settlement_price, is_available=True):
+    """The dict shape returned by the availabilities endpoint."""
+    return {
+        "id": availability_id,
+        "commodity_name": commodity.name,
+        "commodity_code": commodity.code,
+        "start_month": start.month if start else "N/A",
+        "start_year": start.year if start else "N/A",
+        "end_month": end.month if end else "N/A",
+        "end_year": end.year if end else "N/A",
+        "period_display": f"{start.month}{start.year} to {end.month}{end.year}" if start and end else "N/A",
+        "settlement_price": settlement_price,
+        "is_available": is_available,
+    }
+
+
+def search_queryset(commodity_ids=None, start_range=(None, None), end_range=(None, None),
+                    width_range=(None, None), kind=None):
+    """
+    Available stored rows for the search endpoint. Ranges are inclusive (low, high) tuples of
+    contract keys, or of spread widths in months; None leaves that side open.
+    """
+    qs = Availability.objects.filter(is_available=True)
+    if commodity_ids is not None:
+        qs = qs.filter(commodity_id__in=commodity_ids)
+    for field, (low, high) in (("start_key", start_range), ("end_key", end_range)):
+        if low is not None:
+            qs = qs.filter(**{f"{field}__gte": low})
+        if high is not None:
+            qs = qs.filter(**{f"{field}__lte": high})
+    if kind == "single":
+        qs = qs.filter(end_key__isnull=True)
+    elif kind == "spread":
+        qs = qs.filter(end_key__isnull=False)
+    width_low, width_high = width_range
+    if width_low is not None or width_high is not None:
+        qs = qs.annotate(width=F("end_key") - F("start_key"))
+        if width_low is not None:
+            qs = qs.filter(width__gte=width_low)
+        if width_high is not None:
+            qs = qs.filter(width__lte=width_high)
+    return qs
@@ -0,0 +1,263 @@
+"""
+Batch fill ingestion for the end-of-day broker drop.
+
+One call carries new fills for many trades (appended to a lots_and_price entry, as with
+append_fills) and received lots for many exits. Everything is checked against the locked rows
+before anything is written; then the whole batch is applied in one transaction with bulk
+writes. A batch with any bad item is rejected as a whole, with a report saying which items
+were wrong.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .fills import BATCH_SIZE, _status_after_fills, set_totals, to_decimal
+from .matching import LotBook
+from .models import AVERAGE_COST, INACTIVE_EXIT_STATUSES, Exit, Fill, Trade, TradeEntry, VersionedMixin
+from .ticks import check_tick, contract_spec, from_ticks, notional_ticks
+
+FILLABLE_STATUSES = ["approved", "order_placed", "partial_fills_received"]
+TRADE_FIELDS = ["lots_and_price", "total_lots", "fill_notional", "avg_price", "status", "fills_received_at"]
+EXIT_FIELDS = ["recieved_lots", "exit_price", "filled_at", "exit_status", "profit_loss", "is_closed"]
+
+
+class BatchRejected(ValueError):
+    """Raised when any item of a batch is invalid; `report` has one result per item."""
+
+    def __init__(self, report):
+        super().__init__("Batch rejected; nothing was applied.")
+        self.report = report
+
+
+def money(value):
+    return None if value is None else str(Decimal(value).quantize(Decimal("0.01")))
+
+
+def write_columns(model, objs, fields):
+    """
+    UPDATE `fields` of every object with one prepared statement through executemany (pipelined
+    by psycopg on PostgreSQL). bulk_update's CASE WHEN expression costs more to build than the
+    write itself at broker-file sizes. Sends no signals. Versioned rows get their version
+    bumped; the caller holds their locks, so there is nothing to compare it against.
+    """
+    if not objs:
+        return
+    if issubclass(model, VersionedMixin):
+        for obj in objs:
+            obj.version += 1
+        fields = [*fields, "version"]
+    meta = model._meta
+    columns = [meta.get_field(name) for name in fields]
+    quote = connection.ops.quote_name
+    assignments = ", ".join(f"{quote(column.column)} = %s" for column in columns)
+    sql = f"UPDATE {quote(meta.db_table)} SET {assignments} WHERE {quote(meta.pk.column)} = %s"
+    params = [
+        [column.get_db_prep_save(getattr(obj, column.attname), connection) for column in columns] + [obj.pk]
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def add_to_columns(model, deltas, fields):
+    """
+    UPDATE column = column + %s for `fields` of every {pk: (n, ...)} in `deltas`, with one
+    prepared statement through executemany, like write_columns. Rows whose deltas are all 0 are skipped.
+    """
+    params = [[*values, pk] for pk, values in deltas.items() if any(values)]
+    if not params:
+        return
+    meta = model._meta
+    quote = connection.ops.quote_name
+    columns = [quote(meta.get_field(name).column) for name in fields]
+    assignments = ", ".join(f"{column} = {column} + %s" for column in columns)
+    with connection.cursor() as cursor:
+        cursor.executemany(f"UPDATE {quote(meta.db_table)} SET {assignments} WHERE {quote(meta.pk.column)} = %s", params)
+
+
+def lock_rows(trade_items, exit_items):
+    """
+    Lock every trade the batch touches (including the trades of its exits), then its exits,
+    each in id order so concurrent batches cannot deadlock. Returns ({id: Trade}, {id: Exit}).
+    """
+    exit_ids = sorted({item["exit"] for item in exit_items})
+    exit_trades = dict(Exit.objects.filter(pk__in=exit_ids).values_list("pk", "trade_id"))
+    trade_ids = sorted({item["trade"] for item in trade_items} | set(exit_trades.values()))
+    trades = {
+        trade.pk: trade
+        for trade in Trade.objects.select_for_update(of=("self",)).select_related("name").filter(pk__in=trade_ids).order_by("pk")
+    }
+    exits = {exit_obj.pk: exit_obj for exit_obj in Exit.objects.select_for_update().filter(pk__in=exit_ids).order_by("pk")}
+    for exit_obj in exits.values():
+        exit_obj.trade = trades[exit_obj.trade_id]
+    return trades, exits
+
+
+def check_items(trade_items, exit_items, trades, exits):
+    """Per-item report with an "error" on every item that cannot be applied."""
+    filled = {}
+    trade_report = []
+    for index, item in enumerate(trade_items):
+        result = {"index": index, "trade": item["trade"], "ok": False}
+        trade_report.append(result)
+        trade = trades.get(item["trade"])
+        if trade is None:
+            result["error"] = "Trade not found."
+            continue
+        if trade.status not in FILLABLE_STATUSES:
+            result["error"] = "Cannot update fills for this trade status."
+            continue
+        position = item["entry"]
+        if position >= len(trade.lots_and_price):
+            result["error"] = f"Trade {trade.pk} has no entry {position}."
+            continue
+        entry = trade.lots_and_price[position]
+        key = (trade.pk, position)
+        if key not in filled:
+            filled[key] = sum(int(f.get("lots", 0) or 0) for f in entry.get("fills_received", []) if isinstance(f, dict))
+        lots = sum(fill["lots"] for fill in item["fills"])
+        if filled[key] + lots > int(entry.get("lots", 0) or 0):
+            result["error"] = f"Entry {position}: total filled lots cannot exceed requested lots ({entry['lots']})."
+            continue
+        try:
+            tick_size = contract_spec(trade.name_id).tick_size
+            for fill in item["fills"]:
+                check_tick(fill["price"], tick_size)
+        except ValueError as e:
+            result["error"] = str(e)
+            continue
+        filled[key] += lots
+        result["ok"] = True
+
+    exit_report = []
+    for index, item in enumerate(exit_items):
+        result = {"index": index, "exit": item["exit"], "ok": False}
+        exit_report.append(result)
+        exit_obj = exits.get(item["exit"])
+        if exit_obj is None:
+            result["error"] = "Exit not found."
+        elif item["recieved_lots"] > exit_obj.requested_exit_lots:
+            result["error"] = "Received lots cannot exceed requested exit lots."
+        else:
+            result["ok"] = True
+    return {"trades": trade_report, "exits": exit_report}
+
+
+def apply_fill_batch(trade_items, exit_items, filled_at=None, skip_invalid=False):
+    """
+    Apply a validated batch:
+      trade_items: [{"trade": id, "entry": index, "fills": [{"lots", "price"}, ...]}, ...]
+      exit_items:  [{"exit": id, "recieved_lots": n, "exit_price": optional}, ...]
+
+    Trade fills go in with one Fill bulk_create and one prepared Trade UPDATE (running totals,
+    JSON and status as append_fills sets them); exits of those trades are repriced in one
+    UPDATE; the batch's exits are derived (P&L, is_closed, status) and written the same way,
+    exits of FIFO / LIFO trades matching against one LotBook. Returns (report, trade ids, exit
+    ids). Raises BatchRejected when any item is invalid (an exit closing more lots than its
+    trade has open, or re-activating beyond its trade's remaining lots, included), unless
+    `skip_invalid`, in which case those items are reported and left out.
+    """
+    filled_at = filled_at or timezone.now()
+    with transaction.atomic():
+        trades, exits = lock_rows(trade_items, exit_items)
+        report = check_items(trade_items, exit_items, trades, exits)
+        if not skip_invalid and not all(result["ok"] for results in report.values() for result in results):
+            raise BatchRejected(report)
+        trade_items = [item for item, result in zip(trade_items, report["trades"]) if result["ok"]]
+        exit_rows = [(item, result) for item, result in zip(exit_items, report["exits"]) if result["ok"]]
+
+        # Trade fills, in item order so fills on the same entry keep their positions
+        entry_ids = dict(
+            ((trade_id, position), entry_id)
+            for trade_id, position, entry_id in TradeEntry.objects.filter(
+                trade_id__in={item["trade"] for item in trade_items}
+            ).values_list("trade_id", "position", "id")
+        )
+        new_fills, filled_trades, next_position = [], {}, {}
+        for item in trade_items:
+            trade = trades[item["trade"]]
+            key = (trade.pk, item["entry"])
+            entry = trade.lots_and_price[item["entry"]]
+            if key not in next_position:
+                existing = [f for f in entry.get("fills_received", []) if isinstance(f, dict)]
+                entry["fills_received"] = existing
+                next_position[key] = len(existing)
+            for position, fill in enumerate(item["fills"], start=next_position[key]):
+                new_fills.append(Fill(
+                    entry_id=entry_ids[key], trade=trade, commodity_id=trade.name.commodity_id,
+                    position=position, lots=fill["lots"], price=to_decimal(fill["price"]), filled_at=filled_at,
+                    open_lots=fill["lots"],
+                ))
+            next_position[key] += len(item["fills"])
+            entry["fills_received"].extend({"lots": fill["lots"], "price": fill["price"]} for fill in item["fills"])
+            lots = sum(fill["lots"] for fill in item["fills"])
+            set_totals(trade, trade.total_lots + lots, trade.fill_notional + from_ticks(notional_ticks(item["fills"])))
+            filled_trades[trade.pk] = trade
+        for trade in filled_trades.values():
+            _status_after_fills(trade)
+
+        if new_fills:
+            Fill.objects.bulk_create(new_fills, batch_size=BATCH_SIZE)
+            write_columns(Trade, list(filled_trades.values()), TRADE_FIELDS)
+            # Queryset writes send no signals: reprice the exits the new avg_prices affect here
+            averaged = [pk for pk, trade in filled_trades.items() if trade.lot_matching == AVERAGE_COST]
+            if averaged:
+                Exit.objects.filter(trade_id__in=averaged).recompute_profit_loss()
+
+        # Read after the new fills went in, so exits can close lots filled in the same batch
+        book = LotBook([exits[item["exit"]] for item, _ in exit_rows])
+        changed_exits, counters = {}, {}
+        for item, result in exit_rows:
+            exit_obj = exits[item["exit"]]
+            before = exit_obj.held_lots()
+            if exit_obj.exit_status in INACTIVE_EXIT_STATUSES and item["recieved_lots"] > 0:
+                # Fills re-activate a rejected / cancelled exit, whose lots then count against its
+                # (locked) trade again: the cap create_exit and ExitLifecycleMixin.save apply
+                trade = exit_obj.trade
+                remaining = trade.remaining_lots - counters.get(trade.pk, (0, 0))[0]
+                if exit_obj.requested_exit_lots > remaining:
+                    result.update(ok=False, error=(
+                        f"Requested exits ({exit_obj.requested_exit_lots} lots) exceed the trade's "
+                        f"remaining lots ({remaining})."
+                    ))
+                    if not skip_invalid:
+                        raise BatchRejected(report)
+                    continue
+            exit_obj.recieved_lots = item["recieved_lots"]
+            if item.get("exit_price") is not None:
+                exit_obj.exit_price = item["exit_price"]
+            exit_obj.filled_at = filled_at
+            if exit_obj.trade.lot_matching != AVERAGE_COST:
+                exit_obj._lot_book = book
+            try:
+                exit_obj.derive_exit_state()
+            except ValueError as e:
+                result.update(ok=False, error=str(e))
+                if not skip_invalid:
+                    raise BatchRejected(report)
+                continue
+            finally:
+                exit_obj.__dict__.pop("_lot_book", None)
+            changed_exits[exit_obj.pk] = exit_obj
+            after = exit_obj.held_lots()
+            requested, received = counters.get(exit_obj.trade_id, (0, 0))
+            counters[exit_obj.trade_id] = (requested + after[0] - before[0], received + after[1] - before[1])
+        book.save()
+        if changed_exits:
+            write_columns(Exit, list(changed_exits.values()), EXIT_FIELDS)
+            add_to_columns(Trade, counters, ["exit_requested_lots", "exit_received_lots"])
+
+    for result in report["trades"]:
+        if result["ok"]:
+            trade = trades[result["trade"]]
+            result.update(total_lots=trade.total_lots, avg_price=money(trade.avg_price), status=trade.status)
+    for result in report["exits"]:
+        if result["ok"]:
+            exit_obj = exits[result["exit"]]
+            result.update(
+                recieved_lots=exit_obj.recieved_lots, exit_status=exit_obj.exit_status,
+                profit_loss=money(exit_obj.profit_loss), is_closed=exit_obj.is_closed,
+            )
+    affected = sorted(set(filled_trades) | {exit_obj.trade_id for exit_obj in changed_exits.values()})
+    return report, affected, sorted(changed_exits)
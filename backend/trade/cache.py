@@ -0,0 +1,379 @@
+"""
+Per-worker, in-memory copy of the commodity / settlement / availability catalogue.
+
+The catalogue changes roughly once a day, so every worker loads compact records once and
+answers availability lookups and display strings from memory. post_save / post_delete
+signals (see signals.py) and the bulk loaders call `catalogue_cache.invalidate()`, which
+drops the local copy and bumps a version stamp in Django's cache (Redis, shared by every
+worker) so the other workers reload on their next check. A copy older than
+CATALOGUE_CACHE_MAX_AGE seconds is reloaded regardless.
+"""
+import itertools
+import threading
+from bisect import bisect_left, bisect_right
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .availability import availability_row, virtual_id
+from .curves import from_cents, spread_matrix, to_cents
+from .models import Availability, Commodity, Settlement
+from .ticks import ContractSpec
+
+VERSION_KEY = "trade:catalogue:version"
+DERIVED_CACHE_SIZE = 256
+
+CommodityRecord = namedtuple("CommodityRecord", "id code name tick_size point_value")
+SettlementRecord = namedtuple(
+    "SettlementRecord", "id commodity_id month year contract_key settlement_price expired_at"
+)
+AvailabilityRecord = namedtuple(
+    "AvailabilityRecord", "id commodity_id start_id end_id start_key end_key settlement_price is_available"
+)
+
+
+class Catalogue:
+    def __init__(self, commodities, settlements, availabilities):
+        self.commodities = {c.id: c for c in commodities}
+        self.commodities_by_code = {c.code.lower(): c for c in commodities}
+        self.settlements = {s.id: s for s in settlements}
+        self.availabilities = {a.id: a for a in availabilities}
+
+        # Live contracts per commodity in contract order; expired ones only resolve by id
+        self.settlements_by_commodity = {}
+        for s in sorted(settlements, key=lambda s: (s.contract_key is None, s.contract_key or 0)):
+            if s.contract_key is not None and s.expired_at is None:
+                self.settlements_by_commodity.setdefault(s.commodity_id, []).append(s)
+        self.keys_by_commodity = {
+            commodity_id: [s.contract_key for s in rows] for commodity_id, rows in self.settlements_by_commodity.items()
+        }
+
+        # Stored rows in primary key order, per commodity, and indexed by leg pair
+        self.availability_list = sorted(availabilities, key=lambda a: a.id)
+        self.availabilities_by_commodity = {}
+        self.availability_by_legs = {}
+        for a in self.availability_list:
+            self.availabilities_by_commodity.setdefault(a.commodity_id, []).append(a)
+            self.availability_by_legs[(a.commodity_id, a.start_id, a.end_id)] = a
+
+        # Payloads derived from the settlement curves live as long as this copy of the catalogue
+        self._derived = OrderedDict()
+
+    @classmethod
+    def load(cls):
+        return cls(
+            [CommodityRecord(*row) for row in Commodity.objects.values_list("id", "code", "name", "tick_size", "point_value")],
+            [
+                SettlementRecord(*row)
+                for row in Settlement.objects.values_list(
+                    "id", "commodity_id", "month", "year", "contract_key", "settlement_price", "expired_at"
+                )
+            ],
+            [
+                AvailabilityRecord(*row)
+                for row in Availability.objects.values_list(
+                    "id", "commodity_id", "start_month_id", "end_month_id", "start_key", "end_key",
+                    "settlement_price", "is_available",
+                )
+            ],
+        )
+
+    def _commodities(self, code=None):
+        if code:
+            commodity = self.commodities_by_code.get(code.lower())
+            return [commodity] if commodity else []
+        return [self.commodities[pk] for pk in sorted(self.commodities)]
+
+    def row(self, a):
+        """Availability record -> the dict shape returned by the availabilities endpoint."""
+        return availability_row(
+            a.id,
+            self.commodities[a.commodity_id],
+            self.settlements.get(a.start_id),
+            self.settlements.get(a.end_id),
+            a.settlement_price,
+            a.is_available,
+        )
+
+    def virtual_row(self, commodity, s1, s2):
+        """The row of a spread that is not stored yet, priced off the commodity's cached curve."""
+        cents = self.curve_cents(commodity.id)
+        return availability_row(virtual_id(s1.id, s2.id), commodity, s1, s2, (cents[s1.id] - cents[s2.id]) / 100)
+
+    def iter_availabilities(self, code=None, start_key=None, end_key=None):
+        """Stored, available rows matching the filters, in primary key order."""
+        if code:
+            commodity = self.commodities_by_code.get(code.lower())
+            rows = self.availabilities_by_commodity.get(commodity.id, []) if commodity else []
+        else:
+            rows = self.availability_list
+        for a in rows:
+            if not a.is_available:
+                continue
+            if start_key is not None and a.start_key != start_key:
+                continue
+            if end_key is not None and a.end_key != end_key:
+                continue
+            yield self.row(a)
+
+    def iter_virtual_availabilities(self, code=None, start_key=None, end_key=None):
+        """
+        Rows in catalogue order (per commodity: single months, then spreads), combining stored
+        rows with spreads derived from the settlement list. Unstored spreads get a virtual id.
+        """
+        for commodity in self._commodities(code):
+            settlements = self.settlements_by_commodity.get(commodity.id, [])
+
+            if end_key is None:
+                for s in settlements:
+                    a = self.availability_by_legs.get((commodity.id, s.id, None))
+                    if a is not None and a.is_available and start_key in (None, s.contract_key):
+                        yield self.row(a)
+
+            for s1, s2 in itertools.combinations(settlements, 2):
+                if start_key not in (None, s1.contract_key) or end_key not in (None, s2.contract_key):
+                    continue
+                a = self.availability_by_legs.get((commodity.id, s1.id, s2.id))
+                if a is None:
+                    yield self.virtual_row(commodity, s1, s2)
+                elif a.is_available:
+                    yield self.row(a)
+
+    def _search_pairs(self, commodity_id, start_range, end_range, width_range, kind, after):
+        """
+        Yield (sort_key, settlement, end_settlement_or_None) for one commodity in
+        (start_key, end_key NULLS LAST) order, resuming strictly after `after`.
+        """
+        settlements = self.settlements_by_commodity.get(commodity_id, [])
+        keys = self.keys_by_commodity.get(commodity_id, [])
+        start_lo, start_hi = start_range
+        end_lo, end_hi = end_range
+        width_lo, width_hi = width_range
+        after_start, after_end = after if after else (None, None)
+
+        first = bisect_left(keys, start_lo) if start_lo is not None else 0
+        if after and after_start is not None:
+            first = max(first, bisect_left(keys, after_start))
+        last = bisect_right(keys, start_hi) if start_hi is not None else len(keys)
+
+        for i in range(first, last):
+            s1 = settlements[i]
+            resuming = after is not None and s1.contract_key == after_start
+            if resuming and after_end is None:
+                # The single month was the last row returned for this start month
+                continue
+
+            if kind != "single":
+                lo = max(k for k in (s1.contract_key + 1, end_lo,
+                                     s1.contract_key + width_lo if width_lo is not None else None) if k is not None)
+                highs = [k for k in (end_hi, s1.contract_key + width_hi if width_hi is not None else None) if k is not None]
+                if resuming:
+                    lo = max(lo, after_end + 1)
+                j_first = bisect_left(keys, lo)
+                j_last = bisect_right(keys, min(highs)) if highs else len(keys)
+                for j in range(j_first, j_last):
+                    s2 = settlements[j]
+                    yield (commodity_id, s1.contract_key, s2.contract_key), s1, s2
+
+            if kind != "spread" and width_lo is None and width_hi is None and end_lo is None and end_hi is None:
+                yield (commodity_id, s1.contract_key, None), s1, None
+
+    def search(self, commodity_ids=None, start_range=(None, None), end_range=(None, None),
+               width_range=(None, None), kind=None, after=None):
+        """
+        Yield (sort_key, row) for available singles and spreads, stored or virtual, ordered by
+        (commodity_id, start_key, end_key NULLS LAST) and starting strictly after the `after` key.
+        Ranges are inclusive (low, high) contract keys / widths in months; None means open.
+        """
+        ids = sorted(self.commodities if commodity_ids is None else commodity_ids)
+        if after:
+            ids = ids[bisect_left(ids, after[0]):]
+        for commodity_id in ids:
+            commodity = self.commodities.get(commodity_id)
+            if commodity is None:
+                continue
+            resume = tuple(after[1:]) if after and after[0] == commodity_id else None
+            for key, s1, s2 in self._search_pairs(commodity_id, start_range, end_range, width_range, kind, resume):
+                a = self.availability_by_legs.get((commodity_id, s1.id, s2.id if s2 else None))
+                if a is not None:
+                    if a.is_available:
+                        yield key, self.row(a)
+                elif s2 is not None:
+                    yield key, self.virtual_row(commodity, s1, s2)
+
+    def count(self, commodity_ids=None, start_range=(None, None), end_range=(None, None),
+              width_range=(None, None), kind=None):
+        """
+        Estimate of how many rows `search` returns, computed from the in-memory settlement
+        lists without building rows (stored but unavailable rows are still counted).
+        """
+        total = 0
+        for commodity_id in (self.commodities if commodity_ids is None else commodity_ids):
+            total += sum(1 for _ in self._search_pairs(commodity_id, start_range, end_range, width_range, kind, None))
+        return total
+
+    def curve(self, commodity_id):
+        """(settlement records, cents vector) for a commodity's live contracts in contract order."""
+        settlements = self.settlements_by_commodity.get(commodity_id, [])
+        return settlements, to_cents(s.settlement_price for s in settlements)
+
+    def curve_cents(self, commodity_id):
+        """{settlement id: price in cents} of a commodity's live contracts, from its curve."""
+        def build():
+            settlements, curve = self.curve(commodity_id)
+            return dict(zip((s.id for s in settlements), curve.tolist()))
+
+        return self.memoize(("curve_cents", commodity_id), build)
+
+    def spread_matrix(self, commodity_id):
+        """
+        The settlement curve and full calendar spread matrix for one commodity, as plain lists:
+        matrix[i][j] is the price of the months[i] to months[j] spread (meaningful for i < j).
+        """
+        def build():
+            settlements, curve = self.curve(commodity_id)
+            commodity = self.commodities[commodity_id]
+            return {
+                "commodity_code": commodity.code,
+                "commodity_name": commodity.name,
+                "months": [f"{s.month}{s.year}" for s in settlements],
+                "settlement_ids": [s.id for s in settlements],
+                "curve": from_cents(curve).tolist(),
+                "matrix": from_cents(spread_matrix(curve)).tolist(),
+            }
+
+        return self.memoize(("spread_matrix", commodity_id), build)
+
+    def memoize(self, key, build):
+        """
+        Return build() computed at most once per catalogue load for `key`. The least recently
+        used entries are dropped beyond DERIVED_CACHE_SIZE, so filtered payloads stay bounded.
+        """
+        try:
+            value = self._derived[key]
+            self._derived.move_to_end(key)
+            return value
+        except KeyError:
+            pass
+        value = self._derived[key] = build()
+        while len(self._derived) > DERIVED_CACHE_SIZE:
+            try:
+                self._derived.popitem(last=False)
+            except KeyError:
+                break
+        return value
+
+    def contract_spec(self, availability_id):
+        """ContractSpec of the availability's commodity, or None when the availability is unknown."""
+        a = self.availabilities.get(availability_id)
+        if a is None:
+            return None
+        commodity = self.commodities[a.commodity_id]
+        return ContractSpec(commodity.tick_size, commodity.point_value)
+
+    def display_name(self, availability_id):
+        a = self.availabilities.get(availability_id)
+        return self.commodities[a.commodity_id].code if a else None
+
+    def contract_month(self, availability_id):
+        a = self.availabilities.get(availability_id)
+        if a is None:
+            return None
+        s, e = self.settlements.get(a.start_id), self.settlements.get(a.end_id)
+        if s and e:
+            return f"{s.month}{s.year}-{e.month}{e.year}"
+        return "N/A"
+
+
+class CatalogueCache:
+    """
+    Lazily loaded Catalogue with hit/miss counters.
+
+    A hit is a lookup answered by the loaded copy; a miss is one that had to (re)load it.
+    Fallbacks count lookups for records the loaded copy did not know about, which were
+    answered from the database instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalogue = None
+        self._version = None
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    @property
+    def check_interval(self):
+        return getattr(settings, "CATALOGUE_CACHE_CHECK_INTERVAL", 5)
+
+    @property
+    def max_age(self):
+        return getattr(settings, "CATALOGUE_CACHE_MAX_AGE", 300)
+
+    def _is_stale(self):
+        now = time.monotonic()
+        if now - self._loaded_at > self.max_age:
+            # Bounds staleness should a version bump never reach this worker
+            return True
+        if now - self._checked_at <= self.check_interval:
+            return False
+        self._checked_at = now
+        return cache.get(VERSION_KEY, 0) != self._version
+
+    def get(self):
+        catalogue = self._catalogue
+        if catalogue is not None and self._is_stale():
+            catalogue = self._catalogue = None
+
+        if catalogue is not None:
+            self.hits += 1
+            return catalogue
+
+        with self._lock:
+            self.misses += 1
+            if self._catalogue is None:
+                self._version = cache.get(VERSION_KEY, 0)
+                self._checked_at = self._loaded_at = time.monotonic()
+                self._catalogue = Catalogue.load()
+                self.loads += 1
+            return self._catalogue
+
+    def record_fallback(self):
+        self.fallbacks += 1
+
+    def invalidate(self):
+        self._catalogue = None
+        self.invalidations += 1
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, timeout=None)
+
+    def invalidate_on_commit(self):
+        transaction.on_commit(self.invalidate)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        catalogue = self._catalogue
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "fallbacks": self.fallbacks,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+            "loaded": catalogue is not None,
+            "commodities": len(catalogue.commodities) if catalogue else 0,
+            "settlements": len(catalogue.settlements) if catalogue else 0,
+            "availabilities": len(catalogue.availabilities) if catalogue else 0,
+        }
+
+
+catalogue_cache = CatalogueCache()
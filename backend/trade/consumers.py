@@ -14,13 +14,25 @@ class TradeConsumer(AsyncWebsocketConsumer):
     async def trade_update(self, event):
         # Send the received 'trade' data to the WebSocket
         # The 'event' dictionary from channel_layer.group_send contains 'type' and 'trade'
-        await self.send(text_data=json.dumps({
+        message = {
             'type': event['type'], # This will be 'trade_update'
             'trade': event['trade'] # This is the serialized trade object
-        }))
+        }
+        # Batch fill updates carry the trade's changed exits in the same message
+        if 'exits' in event:
+            message['exits'] = event['exits']
+        await self.send(text_data=json.dumps(message))
         
     async def exit_update(self, event):
         await self.send(text_data=json.dumps({
             'type': 'exit_update',
             'exit': event['exit']
+        }))
+
+    # Every exit a create_exit request added, in one message
+    async def exits_created(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'exits_created',
+            'trade': event['trade'],
+            'exits': event['exits']
         }))
\ No newline at end of file
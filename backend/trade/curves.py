@@ -0,0 +1,72 @@
+"""
+Array maths on settlement curves.
+
+A curve is one commodity's settlement prices in contract order, held as int64 cents so
+differences between legs are exact. Dividing a cents result by 100 once yields the same
+float as converting the exact decimal result, which keeps these values comparable with
+prices computed in SQL.
+"""
+import itertools
+from functools import lru_cache
+from math import comb
+
+import numpy as np
+
+
+def to_cents(prices):
+    """Decimal (or float) prices with two decimals -> int64 cents vector."""
+    prices = list(prices)
+    return np.rint(np.fromiter(prices, dtype=np.float64, count=len(prices)) * 100).astype(np.int64)
+
+
+def from_cents(cents):
+    return cents / 100
+
+
+def spread_prices(settlement_ids, curve, start_ids, end_ids):
+    """
+    Prices for availabilities given their leg settlement ids, with `curve` in cents; an end
+    id of 0 marks a single contract month. Leg ids must all be present in `settlement_ids`.
+    """
+    order = np.argsort(settlement_ids)
+    sorted_ids = settlement_ids[order]
+    start_pos = order[np.searchsorted(sorted_ids, start_ids)]
+    is_spread = end_ids != 0
+    end_pos = order[np.searchsorted(sorted_ids, np.where(is_spread, end_ids, sorted_ids[0]))]
+    return from_cents(curve[start_pos] - np.where(is_spread, curve[end_pos], 0))
+
+
+def calendar_spread(start_price, end_price):
+    """Price of one calendar spread from its legs' settlement prices, as spread_prices computes it."""
+    start, end = to_cents([start_price, end_price])
+    return float(from_cents(start - end))
+
+
+def spread_matrix(curve):
+    """N x N matrix of calendar spread prices: [i, j] = curve[i] - curve[j], in cents."""
+    return curve[:, None] - curve[None, :]
+
+
+# Leg weights of the structures priced off a curve, front leg first
+FLY_WEIGHTS = (1, -2, 1)  # a - 2b + c
+DFLY_WEIGHTS = (1, -3, 3, -1)  # fly(a, b, c) - fly(b, c, d)
+
+
+@lru_cache(maxsize=16)
+def leg_combinations(n, k):
+    """
+    Every strictly increasing k-tuple of positions in an n-contract curve as an (M, k) array,
+    in lexicographic order. Depends only on the curve length, so it is shared across
+    commodities; treat the result as read-only.
+    """
+    count = comb(n, k)
+    flat = np.fromiter(itertools.chain.from_iterable(itertools.combinations(range(n), k)),
+                       dtype=np.int16, count=count * k)
+    legs = flat.reshape(count, k)
+    legs.flags.writeable = False
+    return legs
+
+
+def structure_prices(curve, legs, weights):
+    """Price of every row of `legs` (positions into `curve`) for the given leg weights, in cents."""
+    return curve[legs] @ np.asarray(weights, dtype=np.int64)
@@ -0,0 +1,288 @@
+"""
+Normalized storage for Trade.lots_and_price.
+
+Every entry of the JSON list is a TradeEntry row and every element of its fills_received
+list is a Fill row. Those tables are what avg_price / total_lots are aggregated from and
+what fill reporting queries; lots_and_price stays on Trade as the serialized form the API
+returns, written in the same transaction.
+
+Trade.fill_notional (sum of lots x price) and total_lots are running totals: appends move
+them by the new fills only, and verify_totals() recomputes both from scratch to check them.
+"""
+import json
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .matching import rematch
+from .models import AVERAGE_COST, Fill, Trade, TradeEntry, VersionConflict
+from .ticks import check_tick, contract_spec, from_ticks, notional_ticks, to_ticks
+
+ENTRY_KEYS = ("lots", "price", "added_at", "fills_received", "stop_loss")
+BATCH_SIZE = 2000
+
+
+def to_decimal(value):
+    return Decimal(str(value or 0))
+
+
+def to_number(value):
+    """Decimal column value -> the JSON number the client sent (int when it has no fraction)."""
+    if value is None:
+        return None
+    return int(value) if value == value.to_integral_value() else float(value)
+
+
+def build_rows(trade, entries, commodity_id, previous=None, filled_at=None):
+    """
+    (TradeEntry list, [(entry_position, Fill), ...]) for a lots_and_price list.
+    A fill that is unchanged at the same (entry, fill) position keeps its timestamp from
+    `previous`; new ones get `filled_at` (default now).
+    """
+    previous = previous or {}
+    filled_at = filled_at or timezone.now()
+    entry_rows, fill_rows = [], []
+    for position, entry in enumerate(entries or []):
+        entry_rows.append(TradeEntry(
+            trade=trade,
+            position=position,
+            lots=int(entry.get("lots", 0) or 0),
+            price=to_decimal(entry.get("price")),
+            stop_loss=to_decimal(entry["stop_loss"]) if entry.get("stop_loss") is not None else None,
+            added_at=str(entry.get("added_at") or ""),
+            extra={key: value for key, value in entry.items() if key not in ENTRY_KEYS},
+        ))
+        fills = entry.get("fills_received", [])
+        if not isinstance(fills, list):
+            continue
+        for fill_position, fill in enumerate(f for f in fills if isinstance(f, dict)):
+            lots, price = int(fill.get("lots", 0) or 0), to_decimal(fill.get("price"))
+            old = previous.get((position, fill_position))
+            fill_rows.append((position, Fill(
+                trade=trade,
+                commodity_id=commodity_id,
+                position=fill_position,
+                lots=lots,
+                price=price,
+                filled_at=old[2] if old and old[:2] == (lots, price) else filled_at,
+                open_lots=lots,
+            )))
+    return entry_rows, fill_rows
+
+
+def write_rows(entry_rows, fill_rows):
+    """bulk_create entries, then their fills linked by entry position."""
+    TradeEntry.objects.bulk_create(entry_rows, batch_size=BATCH_SIZE)
+    by_position = {(e.trade_id, e.position): e for e in entry_rows}
+    for position, fill in fill_rows:
+        fill.entry = by_position[(fill.trade_id, position)]
+    Fill.objects.bulk_create([fill for _, fill in fill_rows], batch_size=BATCH_SIZE)
+
+
+def average_price(lots, notional):
+    """Lot-weighted average price; the avg_price column rounds it to two places on save."""
+    return Decimal(notional) / Decimal(lots) if lots else Decimal("0")
+
+
+def trade_totals(trade):
+    """(total_lots, notional) aggregated in SQL over the trade's fills."""
+    totals = Fill.objects.filter(trade=trade).totals()
+    return totals["total_lots"], totals["notional"]
+
+
+def json_totals(entries):
+    """
+    (total_lots, notional) recomputed from a lots_and_price list, the way the JSON was always
+    read. Prices are summed as integer ticks; notional is converted to Decimal once.
+    """
+    lots = ticks = 0
+    for entry in entries or []:
+        fills = entry.get("fills_received", []) if isinstance(entry, dict) else []
+        for fill in fills if isinstance(fills, list) else []:
+            if isinstance(fill, dict):
+                fill_lots = int(fill.get("lots", 0) or 0)
+                lots += fill_lots
+                ticks += fill_lots * to_ticks(fill.get("price") or 0)
+    return lots, from_ticks(ticks)
+
+
+def set_totals(trade, lots, notional):
+    trade.total_lots = lots
+    trade.fill_notional = notional
+    trade.avg_price = average_price(lots, notional)
+
+
+def save_entries(trade, entries, update_fields=None):
+    """
+    Replace a trade's lots_and_price with `entries`: rewrite its TradeEntry / Fill rows, then
+    save the trade once with the JSON and the aggregated avg_price / total_lots. Unsaved trades
+    are inserted first. `update_fields` adds other changed columns to that save. Exits of a
+    FIFO / LIFO trade are matched again against the new fills (ValueError if they no longer fit).
+    """
+    with transaction.atomic():
+        created = trade.pk is None
+        if created:
+            trade.lots_and_price = entries
+            trade.save()
+        previous = {
+            (entry_position, position): (lots, price, filled_at)
+            for entry_position, position, lots, price, filled_at in Fill.objects.filter(trade=trade).values_list(
+                "entry__position", "position", "lots", "price", "filled_at"
+            )
+        }
+        TradeEntry.objects.filter(trade=trade).delete()
+        write_rows(*build_rows(trade, entries, trade.name.commodity_id, previous))
+
+        trade.lots_and_price = entries
+        set_totals(trade, *trade_totals(trade))
+        fields = ["lots_and_price", "total_lots", "fill_notional", "avg_price"]
+        trade.save(update_fields=fields + [f for f in (update_fields or []) if f not in fields])
+        if not created and trade.lot_matching != AVERAGE_COST:
+            rematch(trade)
+    return trade
+
+
+def entries_json(trade):
+    """Serialize a trade's TradeEntry / Fill rows back into the lots_and_price JSON form."""
+    entries = []
+    for entry in trade.entries.prefetch_related("fills").order_by("position"):
+        entries.append({
+            "lots": entry.lots,
+            "price": to_number(entry.price),
+            "added_at": entry.added_at,
+            "fills_received": [
+                {"lots": fill.lots, "price": to_number(fill.price)}
+                for fill in sorted(entry.fills.all(), key=lambda f: f.position)
+            ],
+            "stop_loss": to_number(entry.stop_loss),
+            **entry.extra,
+        })
+    return entries
+
+
+
+def _append_json(trade, entry_position, items):
+    """
+    Append `items` to the stored lots_and_price without rewriting it: to the fills_received
+    list of entry `entry_position`, or to the entry list itself when it is None. PostgreSQL
+    does this in place with jsonb || and jsonb_set; other backends write the updated list.
+    """
+    if connection.vendor != "postgresql":
+        Trade.objects.filter(pk=trade.pk).update(lots_and_price=trade.lots_and_price)
+        return
+    table = connection.ops.quote_name(Trade._meta.db_table)
+    with connection.cursor() as cursor:
+        if entry_position is None:
+            cursor.execute(
+                f"UPDATE {table} SET lots_and_price = lots_and_price || %s::jsonb WHERE id = %s",
+                [json.dumps(items), trade.pk],
+            )
+        else:
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                   SET lots_and_price = jsonb_set(
+                           lots_and_price, ARRAY[%s, 'fills_received'],
+                           COALESCE(lots_and_price -> %s -> 'fills_received', '[]'::jsonb) || %s::jsonb)
+                 WHERE id = %s
+                """,
+                [str(entry_position), entry_position, json.dumps(items), trade.pk],
+            )
+
+
+def _status_after_fills(trade):
+    """Move an order_placed / partially filled trade to partial_fills_received or fills_received."""
+    if trade.status not in ["order_placed", "partial_fills_received"] or trade.total_lots <= 0:
+        return
+    requested = sum(int(entry.get("lots", 0) or 0) for entry in trade.lots_and_price)
+    trade.status = "fills_received" if trade.total_lots >= requested else "partial_fills_received"
+    if trade.fills_received_at is None:
+        trade.fills_received_at = timezone.now()
+
+
+def append_fills(trade, entry_position, fills, filled_at=None):
+    """
+    Record new fills ({lots, price} dicts) against one entry of a trade.
+
+    The trade row is locked, the fills are inserted, and total_lots / fill_notional move by
+    the new fills only, so the cost does not grow with the fills already recorded. The JSON
+    is appended to in place. Returns the updated (locked and saved) trade.
+    Raises IndexError for an unknown entry and ValueError when the entry would be overfilled or
+    a price is off the commodity's tick.
+    """
+    with transaction.atomic():
+        trade = Trade.objects.select_for_update().select_related("name").get(pk=trade.pk)
+        if not 0 <= entry_position < len(trade.lots_and_price):
+            raise IndexError(f"Trade {trade.pk} has no entry {entry_position}.")
+        entry = trade.lots_and_price[entry_position]
+        existing = [f for f in entry.get("fills_received", []) if isinstance(f, dict)]
+        lots = sum(int(f["lots"]) for f in fills)
+        if sum(int(f.get("lots", 0) or 0) for f in existing) + lots > int(entry.get("lots", 0) or 0):
+            raise ValueError(f"Entry {entry_position}: total filled lots cannot exceed requested lots ({entry['lots']}).")
+        tick_size = contract_spec(trade.name_id).tick_size
+        for fill in fills:
+            check_tick(fill["price"], tick_size)
+
+        entry_row = TradeEntry.objects.only("id").get(trade=trade, position=entry_position)
+        filled_at = filled_at or timezone.now()
+        Fill.objects.bulk_create([
+            Fill(entry=entry_row, trade=trade, commodity_id=trade.name.commodity_id, position=position,
+                 lots=int(fill["lots"]), price=to_decimal(fill["price"]), filled_at=filled_at, open_lots=int(fill["lots"]))
+            for position, fill in enumerate(fills, start=len(existing))
+        ])
+
+        items = [{"lots": fill["lots"], "price": fill["price"]} for fill in fills]
+        entry["fills_received"] = existing + items
+        _append_json(trade, entry_position, items)
+
+        set_totals(trade, trade.total_lots + lots, trade.fill_notional + from_ticks(notional_ticks(fills)))
+        _status_after_fills(trade)
+        trade.save(update_fields=["total_lots", "fill_notional", "avg_price", "status", "fills_received_at"])
+    return trade
+
+
+def append_entries(trade, entries, update_fields=None):
+    """
+    Add new lots_and_price entries (with any fills they already carry) to a trade: the new
+    TradeEntry / Fill rows are inserted, running totals move by the new fills and the JSON list
+    is appended to in place. `update_fields` adds other changed columns (set on `trade`) to the save.
+    Raises VersionConflict when the trade has moved on from the version `trade` was read at.
+    """
+    with transaction.atomic():
+        locked = Trade.objects.select_for_update().select_related("name").get(pk=trade.pk)
+        if locked.version != trade.version:
+            raise VersionConflict(locked, locked.version)
+        for field in update_fields or []:
+            setattr(locked, field, getattr(trade, field))
+        trade = locked
+
+        start = len(trade.lots_and_price)
+        entry_rows, fill_rows = build_rows(trade, entries, trade.name.commodity_id)
+        for row in entry_rows:
+            row.position += start
+        fill_rows = [(position + start, fill) for position, fill in fill_rows]
+        write_rows(entry_rows, fill_rows)
+
+        trade.lots_and_price = trade.lots_and_price + list(entries)
+        _append_json(trade, None, list(entries))
+
+        lots, notional = json_totals(entries)
+        set_totals(trade, trade.total_lots + lots, trade.fill_notional + notional)
+        fields = ["total_lots", "fill_notional", "avg_price"]
+        trade.save(update_fields=fields + [f for f in (update_fields or []) if f not in fields])
+    return trade
+
+
+def verify_totals(trade):
+    """
+    Full recompute of a trade's fill totals from the Fill rows and from the JSON, compared with
+    the running totals stored on the trade. Returns {} when all three agree, otherwise the
+    (total_lots, notional) each source gives.
+    """
+    stored = (trade.total_lots, Decimal(trade.fill_notional))
+    rows = trade_totals(trade)
+    from_json = json_totals(trade.lots_and_price)
+    if stored == tuple(rows) == from_json:
+        return {}
+    return {"stored": stored, "fills": tuple(rows), "json": from_json}
@@ -0,0 +1,157 @@
+"""
+Streaming import of broker fill confirmation files (CSV or JSON lines).
+
+The file is read line by line and goes through a chain of generators: read_lines -> parse_records
+-> to_items -> chunked. Each chunk is applied with apply_fill_batch in its own transaction, so
+memory stays bounded by the chunk size whatever the file size, and every chunk resolves its
+trades with one id__in query. Each chunk result carries the byte offset just past its last line;
+storing that offset as a checkpoint is what makes an interrupted import resumable.
+
+Record layout (CSV header or JSON keys):
+  trade fill: trade, entry, lots, price    -- appended to lots_and_price[entry] of the trade
+  exit fill:  exit, lots[, price]          -- lots is the exit's total received lots
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from .batch import apply_fill_batch
+
+FORMATS = ("csv", "jsonl")
+CHUNK_SIZE = 5000
+
+
+def detect_format(path):
+    return "jsonl" if str(path).lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_lines(handle, offset=0, line_no=0):
+    """
+    Yield (line number, offset after the line, text) from a binary file handle, starting at
+    byte `offset` (a checkpoint) which is line `line_no`. Blank lines are skipped.
+    """
+    handle.seek(offset)
+    for raw in handle:
+        offset += len(raw)
+        line_no += 1
+        text = raw.decode("utf-8-sig" if line_no == 1 else "utf-8").strip()
+        if text:
+            yield line_no, offset, text
+
+
+def parse_records(lines, fmt, header=None):
+    """Yield (line number, offset, record dict or None, error) for each line."""
+    if fmt == "csv" and header is None:
+        for line_no, offset, text in lines:
+            header = [column.strip().lower() for column in next(csv.reader([text]))]
+            break
+    for line_no, offset, text in lines:
+        try:
+            if fmt == "csv":
+                values = next(csv.reader([text]))
+                if len(values) != len(header):
+                    raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+                record = dict(zip(header, values))
+            else:
+                record = json.loads(text)
+                if not isinstance(record, dict):
+                    raise ValueError("each line must be a JSON object")
+        except ValueError as e:
+            yield line_no, offset, None, str(e)
+            continue
+        yield line_no, offset, record, None
+
+
+def csv_header(handle):
+    """Column names from the first line of a CSV file (needed when resuming past it)."""
+    handle.seek(0)
+    first = handle.readline().decode("utf-8-sig").strip()
+    return [column.strip().lower() for column in next(csv.reader([first]))]
+
+
+def to_item(record):
+    """(kind, item) in apply_fill_batch's shape for one record; raises ValueError when invalid."""
+    def integer(key, minimum):
+        value = record.get(key)
+        if value in (None, ""):
+            raise ValueError(f"'{key}' is required")
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{key}' must be an integer")
+        if number < minimum:
+            raise ValueError(f"'{key}' must be at least {minimum}")
+        return number
+
+    def price(required):
+        value = record.get("price")
+        if value in (None, ""):
+            if required:
+                raise ValueError("'price' is required")
+            return None
+        try:
+            number = Decimal(str(value))
+        except InvalidOperation:
+            raise ValueError("'price' must be numeric")
+        if not number.is_finite() or number < 0:
+            raise ValueError("'price' must be non-negative numeric")
+        return number
+
+    if record.get("exit") not in (None, ""):
+        return "exit", {"exit": integer("exit", 1), "recieved_lots": integer("lots", 0), "exit_price": price(False)}
+    fill_price = price(True)
+    return "trade", {
+        "trade": integer("trade", 1),
+        "entry": integer("entry", 0),
+        "fills": [{"lots": integer("lots", 1), "price": int(fill_price) if fill_price == fill_price.to_integral_value() else float(fill_price)}],
+    }
+
+
+def to_items(records):
+    """Yield (line number, offset, kind, item, error) with each record validated."""
+    for line_no, offset, record, error in records:
+        if error is None:
+            try:
+                kind, item = to_item(record)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            yield line_no, offset, None, None, error
+        else:
+            yield line_no, offset, kind, item, None
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def import_fills(handle, fmt, offset=0, line_no=0, chunk_size=CHUNK_SIZE, filled_at=None):
+    """
+    Import a broker file from a binary handle, resuming at (offset, line_no). Yields one
+    summary per committed chunk: {"line", "offset", "applied", "errors": [(line, message)]}.
+    Items the database rejects (unknown ids, overfills, ...) are reported like parse errors
+    and skipped; the rest of the chunk is applied.
+    """
+    header = csv_header(handle) if fmt == "csv" and offset else None
+    lines = read_lines(handle, offset, line_no)
+    for chunk in chunked(to_items(parse_records(lines, fmt, header)), chunk_size):
+        errors = [(line, error) for line, _, _, _, error in chunk if error is not None]
+        trade_rows = [(line, item) for line, _, kind, item, _ in chunk if kind == "trade"]
+        exit_rows = [(line, item) for line, _, kind, item, _ in chunk if kind == "exit"]
+        applied = 0
+        if trade_rows or exit_rows:
+            report, _, _ = apply_fill_batch(
+                [item for _, item in trade_rows], [item for _, item in exit_rows],
+                filled_at=filled_at, skip_invalid=True,
+            )
+            for rows, results in ((trade_rows, report["trades"]), (exit_rows, report["exits"])):
+                for (line, _), result in zip(rows, results):
+                    if result["ok"]:
+                        applied += 1
+                    else:
+                        errors.append((line, result["error"]))
+        errors.sort()
+        yield {"line": chunk[-1][0], "offset": chunk[-1][1], "applied": applied, "errors": errors}
@@ -0,0 +1,408 @@
+import csv
+import io
+import itertools
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import catalogue_cache
+from .models import CONTRACT_MONTHS, Commodity, Settlement, Availability, contract_key
+from .pricing import refresh_spread_prices
+
+# Month abbreviations in correct order, keyed by the PRODUCT column of the matrix CSV
+MONTH_MAP = {
+    "F Jan": "Jan",
+    "G Feb": "Feb",
+    "H Mar": "Mar",
+    "J Apr": "Apr",
+    "K May": "May",
+    "M Jun": "Jun",
+    "N Jul": "Jul",
+    "Q Aug": "Aug",
+    "U Sep": "Sep",
+    "V Oct": "Oct",
+    "X Nov": "Nov",
+    "Z Dec": "Dec",
+}
+MONTH_ORDER = {abbr: index for index, abbr in enumerate(MONTH_MAP.values(), start=1)}
+
+DEFAULT_START_YEAR = 2025
+DEFAULT_END_YEAR = 2030
+BATCH_SIZE = 5000
+
+
+def iter_month_matrix(csv_file):
+    """
+    Stream (commodity_code, month_abbr) pairs for every TRUE cell of the matrix CSV.
+    Rows whose PRODUCT is not a known contract month are skipped.
+    """
+    with open(csv_file, "r") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            product = row["PRODUCT"].strip()
+            if product not in MONTH_MAP:
+                continue
+            month_abbr = MONTH_MAP[product]
+            for commodity_code, flag in row.items():
+                if commodity_code == "PRODUCT":
+                    continue
+                if (flag or "").strip().upper() == "TRUE":
+                    yield commodity_code.strip(), month_abbr
+
+
+def read_month_matrix(csv_file):
+    """
+    Group the matrix CSV into {commodity_code: [month_abbr, ...]} with months in calendar order.
+    """
+    commodity_months = {}
+    for commodity_code, month_abbr in iter_month_matrix(csv_file):
+        commodity_months.setdefault(commodity_code, []).append(month_abbr)
+    for months in commodity_months.values():
+        months.sort(key=MONTH_ORDER.__getitem__)
+    return commodity_months
+
+
+def settlement_sort_key(settlement):
+    return contract_key(settlement.month, settlement.year) or 0
+
+
+def bulk_load_catalogue(commodity_months, start_year=DEFAULT_START_YEAR, end_year=DEFAULT_END_YEAR,
+                        batch_size=BATCH_SIZE, spreads=True, progress=None):
+    """
+    Create Settlements and Availabilities for every commodity in `commodity_months` using
+    batched INSERT ... ON CONFLICT DO NOTHING inside a single transaction.
+
+    Rows that already exist are left untouched, so the loader is safe to re-run.
+    `progress(code, settlements, availabilities)` is called once per commodity.
+    Returns a dict of totals.
+    """
+    years = range(start_year, end_year + 1)
+    totals = {"commodities": 0, "settlements": 0, "availabilities": 0}
+
+    with transaction.atomic():
+        Commodity.objects.bulk_create(
+            [Commodity(code=code) for code in commodity_months],
+            ignore_conflicts=True,
+        )
+        commodities = Commodity.objects.in_bulk(list(commodity_months), field_name="code")
+
+        Settlement.objects.bulk_create(
+            (
+                Settlement(
+                    commodity=commodities[code],
+                    month=month,
+                    year=year,
+                    contract_key=contract_key(month, year),
+                    settlement_price=Decimal("0.00"),
+                )
+                for code, months in commodity_months.items()
+                for year in years
+                for month in months
+            ),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+        # ON CONFLICT DO NOTHING does not hand back primary keys, so read them once
+        by_commodity = {}
+        for settlement in Settlement.objects.filter(
+            commodity__in=commodities.values(), year__gte=start_year, year__lte=end_year
+        ).only("id", "commodity_id", "month", "year", "contract_key"):
+            by_commodity.setdefault(settlement.commodity_id, []).append(settlement)
+
+        pending = []
+        for code, months in commodity_months.items():
+            commodity = commodities[code]
+            settlements = sorted(
+                (s for s in by_commodity.get(commodity.id, []) if s.month in months),
+                key=settlement_sort_key,
+            )
+            rows = [
+                Availability(commodity=commodity, start_month=s, end_month=None,
+                             start_key=s.contract_key, settlement_price=0, is_available=True)
+                for s in settlements
+            ]
+            if spreads:
+                rows.extend(
+                    Availability(commodity=commodity, start_month=s1, end_month=s2,
+                                 start_key=s1.contract_key, end_key=s2.contract_key,
+                                 settlement_price=0, is_available=True)
+                    for s1, s2 in itertools.combinations(settlements, 2)
+                )
+            pending.extend(rows)
+            if len(pending) >= batch_size:
+                Availability.objects.bulk_create(pending, batch_size=batch_size, ignore_conflicts=True)
+                pending = []
+
+            totals["commodities"] += 1
+            totals["settlements"] += len(settlements)
+            totals["availabilities"] += len(rows)
+            if progress:
+                progress(code, len(settlements), len(rows))
+
+        if pending:
+            Availability.objects.bulk_create(pending, batch_size=batch_size, ignore_conflicts=True)
+
+        # bulk_create does not send post_save
+        catalogue_cache.invalidate_on_commit()
+
+    return totals
+
+
+def sync_settlements(commodity_months, start_year=DEFAULT_START_YEAR, end_year=DEFAULT_END_YEAR,
+                     batch_size=BATCH_SIZE):
+    """
+    Bring Settlement rows in line with the matrix without deleting anything.
+
+    - contracts in the matrix but not in the table are bulk inserted
+    - contracts in the table but no longer in the matrix are expired (expired_at set) and their
+      Availabilities marked unavailable, so existing Trades keep their references
+    - expired contracts that reappear in the matrix are reactivated, and the Availabilities the
+      expiry closed re-opened once all their legs are live (rows disabled by hand stay closed)
+
+    Only contracts of the matrix's commodities within start_year..end_year are compared, so a
+    run for one commodity or a narrower range leaves every other contract alone.
+    Re-running with the same matrix changes nothing. Returns a dict of counts.
+    """
+    years = range(start_year, end_year + 1)
+    desired = {
+        (code, month, year)
+        for code, months in commodity_months.items()
+        for month in months
+        for year in years
+    }
+    counts = {"created": 0, "expired": 0, "reactivated": 0, "unchanged": 0, "commodities_created": 0}
+
+    with transaction.atomic():
+        commodities = Commodity.objects.in_bulk(list(commodity_months), field_name="code")
+        missing_codes = [code for code in commodity_months if code not in commodities]
+        if missing_codes:
+            Commodity.objects.bulk_create(
+                [Commodity(code=code, name=code) for code in missing_codes], ignore_conflicts=True
+            )
+            commodities = Commodity.objects.in_bulk(list(commodity_months), field_name="code")
+            counts["commodities_created"] = len(missing_codes)
+
+        existing = {}
+        for pk, code, month, year, expired_at in Settlement.objects.filter(
+            commodity__code__in=list(commodity_months), year__gte=start_year, year__lte=end_year
+        ).values_list("id", "commodity__code", "month", "year", "expired_at"):
+            existing[(code, month, year)] = (pk, expired_at)
+
+        to_create = [
+            Settlement(
+                commodity=commodities[code],
+                month=month,
+                year=year,
+                contract_key=contract_key(month, year),
+                settlement_price=Decimal("0.00"),
+            )
+            for code, month, year in sorted(desired - existing.keys())
+        ]
+        Settlement.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+        counts["created"] = len(to_create)
+
+        expire_ids = [pk for key, (pk, expired_at) in existing.items() if key not in desired and expired_at is None]
+        reactivate_ids = [pk for key, (pk, expired_at) in existing.items() if key in desired and expired_at is not None]
+        counts["unchanged"] = len(existing) - len(expire_ids) - len(reactivate_ids)
+
+        if expire_ids:
+            expired_at = timezone.now()
+            counts["expired"] = Settlement.objects.filter(id__in=expire_ids).update(expired_at=expired_at)
+            Availability.objects.filter(
+                Q(start_month_id__in=expire_ids) | Q(end_month_id__in=expire_ids), is_available=True
+            ).update(is_available=False, expired_at=expired_at)
+
+        if reactivate_ids:
+            counts["reactivated"] = Settlement.objects.filter(id__in=reactivate_ids).update(expired_at=None)
+            # Re-open the availabilities an expiry closed once their legs are all live again
+            Availability.objects.filter(
+                Q(start_month_id__in=reactivate_ids) | Q(end_month_id__in=reactivate_ids),
+                expired_at__isnull=False,
+                start_month__expired_at__isnull=True,
+            ).filter(
+                Q(end_month__isnull=True) | Q(end_month__expired_at__isnull=True)
+            ).update(is_available=True, expired_at=None)
+
+        # Queryset.update and bulk_create do not send signals
+        catalogue_cache.invalidate_on_commit()
+
+    return counts
+
+
+def iter_price_file(lines):
+    """
+    Parse an end-of-day price file with a `code,month,year,price` header.
+    Yields (line_number, code, contract_key, price) for valid rows and
+    (line_number, None, None, error) for rows that cannot be used.
+    """
+    reader = csv.DictReader(lines)
+    for line_number, row in enumerate(reader, start=2):
+        try:
+            code = (row.get("code") or "").strip()
+            key = contract_key((row.get("month") or "").strip(), int(row.get("year") or ""))
+            price = Decimal((row.get("price") or "").strip()).quantize(Decimal("0.01"))
+        except (ValueError, InvalidOperation):
+            yield line_number, None, None, "year and price must be numeric"
+            continue
+        if not code or key is None:
+            yield line_number, None, None, "unknown commodity code or month"
+            continue
+        yield line_number, code, key, price
+
+
+def _copy_into(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    if hasattr(cursor.cursor, "copy_expert"):  # psycopg2
+        cursor.cursor.copy_expert(sql, buffer)
+    else:  # psycopg 3
+        with cursor.cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+def _apply_prices_postgres(rows, timings):
+    settlement_table = Settlement._meta.db_table
+    commodity_table = Commodity._meta.db_table
+    availability_table = Availability._meta.db_table
+
+    with connection.cursor() as cursor:
+        started = time.perf_counter()
+        cursor.execute(
+            "CREATE TEMP TABLE settlement_price_stage "
+            "(code text, contract_key integer, price numeric(10, 2)) ON COMMIT DROP"
+        )
+        _copy_into(cursor, "settlement_price_stage", ["code", "contract_key", "price"], rows)
+        cursor.execute(f"""
+            SELECT st.code, st.contract_key
+              FROM settlement_price_stage AS st
+             WHERE NOT EXISTS (
+                   SELECT 1
+                     FROM {settlement_table} AS s
+                     JOIN {commodity_table} AS c ON c.id = s.commodity_id
+                    WHERE c.code = st.code
+                      AND s.contract_key = st.contract_key)
+        """)
+        unmatched = set(cursor.fetchall())
+        timings["stage"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cursor.execute(f"""
+            UPDATE {settlement_table} AS s
+               SET settlement_price = st.price
+              FROM settlement_price_stage AS st
+              JOIN {commodity_table} AS c ON c.code = st.code
+             WHERE s.commodity_id = c.id
+               AND s.contract_key = st.contract_key
+               AND s.settlement_price IS DISTINCT FROM st.price
+         RETURNING s.id
+        """)
+        changed_ids = [row[0] for row in cursor.fetchall()]
+        timings["settlements"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        availabilities = 0
+        if changed_ids:
+            # Single months carry the outright price; spreads are start leg minus end leg
+            cursor.execute(f"""
+                UPDATE {availability_table} AS a
+                   SET settlement_price = s1.settlement_price
+                  FROM {settlement_table} AS s1
+                 WHERE a.start_month_id = s1.id
+                   AND a.end_month_id IS NULL
+                   AND a.start_month_id = ANY(%s)
+                   AND a.settlement_price IS DISTINCT FROM s1.settlement_price::float8
+            """, [changed_ids])
+            availabilities += cursor.rowcount
+            cursor.execute(f"""
+                UPDATE {availability_table} AS a
+                   SET settlement_price = s1.settlement_price - s2.settlement_price
+                  FROM {settlement_table} AS s1, {settlement_table} AS s2
+                 WHERE a.start_month_id = s1.id
+                   AND a.end_month_id = s2.id
+                   AND (a.start_month_id = ANY(%s) OR a.end_month_id = ANY(%s))
+                   AND a.settlement_price IS DISTINCT FROM (s1.settlement_price - s2.settlement_price)::float8
+            """, [changed_ids, changed_ids])
+            availabilities += cursor.rowcount
+        timings["availabilities"] = time.perf_counter() - started
+
+    return len(changed_ids), availabilities, unmatched
+
+
+def _apply_prices_generic(rows, timings):
+    """
+    Equivalent of the PostgreSQL path for other backends (development, tests); availability
+    prices are recomputed by the vectorized pricing stage.
+    """
+    started = time.perf_counter()
+    prices = {(code, key): price for code, key, price in rows}
+    settlements = Settlement.objects.filter(
+        commodity__code__in={code for code, _ in prices}, contract_key__in={key for _, key in prices}
+    ).select_related("commodity")
+    changed, matched = [], set()
+    for settlement in settlements:
+        matched.add((settlement.commodity.code, settlement.contract_key))
+        price = prices.get((settlement.commodity.code, settlement.contract_key))
+        if price is not None and settlement.settlement_price != price:
+            settlement.settlement_price = price
+            changed.append(settlement)
+    Settlement.objects.bulk_update(changed, ["settlement_price"], batch_size=BATCH_SIZE)
+    timings["stage"] = 0.0
+    timings["settlements"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    updated = refresh_spread_prices(
+        commodity_ids={s.commodity_id for s in changed}, settlement_ids=[s.id for s in changed]
+    ) if changed else 0
+    timings["availabilities"] = time.perf_counter() - started
+    return len(changed), updated, prices.keys() - matched
+
+
+def load_settlement_prices(lines):
+    """
+    Apply an end-of-day price file to Settlement.settlement_price and refresh the dependent
+    Availability.settlement_price values, all in one transaction.
+
+    On PostgreSQL the file is COPY'd into a temp table and applied with one set-based UPDATE
+    per table; only rows whose price actually changes are written.
+    Returns {"settlements", "availabilities", "rows", "errors", "unmatched", "timings"}:
+    `errors` are the (line, message) pairs of rows skipped as unreadable, `unmatched` those of
+    rows naming a commodity or contract that is not in the catalogue.
+    """
+    timings = {}
+    started = time.perf_counter()
+    prices, line_numbers, errors = {}, {}, []
+    for line_number, code, key, price in iter_price_file(lines):
+        if code is None:
+            errors.append((line_number, price))
+        else:
+            prices[(code, key)] = price  # the last line for a contract wins
+            line_numbers[(code, key)] = line_number
+    rows = [(code, key, price) for (code, key), price in prices.items()]
+    timings["parse"] = time.perf_counter() - started
+
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            settlements, availabilities, unmatched = _apply_prices_postgres(rows, timings)
+        else:
+            settlements, availabilities, unmatched = _apply_prices_generic(rows, timings)
+        if settlements:
+            catalogue_cache.invalidate_on_commit()
+
+    unmatched = sorted(
+        (line_numbers[code, key], f"no {code} {CONTRACT_MONTHS[(key - 1) % 12]}{(key - 1) // 12} contract")
+        for code, key in unmatched
+    )
+    return {
+        "rows": len(rows),
+        "errors": errors,
+        "unmatched": unmatched,
+        "settlements": settlements,
+        "availabilities": availabilities,
+        "timings": timings,
+    }
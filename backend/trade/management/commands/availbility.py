@@ -1,69 +1,95 @@
-import csv
 import itertools
+import time
 from decimal import Decimal
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from trade.models import Commodity, Settlement, Availability
+from trade.loaders import (
+    BATCH_SIZE, DEFAULT_END_YEAR, DEFAULT_START_YEAR, bulk_load_catalogue, read_month_matrix,
+)
+
+
+class BenchmarkRollback(Exception):
+    """Raised inside a benchmark run so its writes are rolled back."""
 
-# Month abbreviations in correct order
-MONTH_MAP = {
-    "F Jan": "Jan",
-    "G Feb": "Feb",
-    "H Mar": "Mar",
-    "J Apr": "Apr",
-    "K May": "May",
-    "M Jun": "Jun",
-    "N Jul": "Jul",
-    "Q Aug": "Aug",
-    "U Sep": "Sep",
-    "V Oct": "Oct",
-    "X Nov": "Nov",
-    "Z Dec": "Dec",
-}
 
 class Command(BaseCommand):
     help = "Import commodities and generate Settlements + Availabilities from matrix CSV"
 
     def add_arguments(self, parser):
         parser.add_argument("csv_file", type=str, help="Path to the commodities CSV file")
+        parser.add_argument(
+            "--mode", choices=["bulk", "row"], default="bulk",
+            help="bulk: batched inserts in one transaction (default). row: one get_or_create per row.",
+        )
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per INSERT in bulk mode")
+        parser.add_argument("--start-year", type=int, default=DEFAULT_START_YEAR)
+        parser.add_argument("--end-year", type=int, default=DEFAULT_END_YEAR)
+        parser.add_argument(
+            "--virtual-spreads", action="store_true", default=getattr(settings, "VIRTUAL_SPREADS", False),
+            help="Only create single contract months; spreads are derived on demand (defaults to VIRTUAL_SPREADS).",
+        )
+        parser.add_argument(
+            "--benchmark", action="store_true",
+            help="Time the row and bulk paths against each other and roll both back.",
+        )
 
     def handle(self, *args, **options):
-        csv_file = options["csv_file"]
-
-        start_year = 2025
-        end_year = 2030
-
         # --- Step 1: Parse CSV into commodity -> available months ---
-        commodity_months = {}
+        commodity_months = read_month_matrix(options["csv_file"])
 
-        with open(csv_file, "r") as f:
-            reader = csv.DictReader(f)
+        if options["benchmark"]:
+            self.benchmark(commodity_months, options)
+            return
 
-            for row in reader:
-                product = row["PRODUCT"].strip()
-                if product not in MONTH_MAP:
-                    continue
-                month_abbr = MONTH_MAP[product]
+        # --- Step 2: Process each commodity ---
+        started = time.perf_counter()
+        if options["mode"] == "row":
+            self.load_rows(
+                commodity_months, options["start_year"], options["end_year"], options["verbosity"],
+                spreads=not options["virtual_spreads"],
+            )
+        else:
+            totals = bulk_load_catalogue(
+                commodity_months,
+                start_year=options["start_year"],
+                end_year=options["end_year"],
+                batch_size=options["batch_size"],
+                spreads=not options["virtual_spreads"],
+                progress=self.report_progress,
+            )
+            self.stdout.write(
+                f"{totals['commodities']} commodities, {totals['settlements']} settlements, "
+                f"{totals['availabilities']} availabilities"
+            )
 
-                for commodity_code, flag in row.items():
-                    if commodity_code == "PRODUCT":
-                        continue
-                    if flag.strip().upper() == "TRUE":
-                        commodity_months.setdefault(commodity_code, []).append(month_abbr)
+        self.stdout.write(self.style.SUCCESS(
+            f"Import completed successfully in {time.perf_counter() - started:.2f}s."
+        ))
 
-        # --- Step 2: Process each commodity ---
+    def report_progress(self, code, settlements, availabilities):
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {code}: {settlements} settlements, {availabilities} availabilities"
+        ))
+
+    def load_rows(self, commodity_months, start_year, end_year, verbosity=1, spreads=True):
+        """The original per-row path: one get_or_create round trip per Settlement and Availability."""
         for commodity_code, months in commodity_months.items():
             commodity, _ = Commodity.objects.get_or_create(code=commodity_code)
 
-            self.stdout.write(self.style.SUCCESS(
-                f"Processing {commodity.code} with months {months}"
-            ))
+            if verbosity:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Processing {commodity.code} with months {months}"
+                ))
 
             all_settlements = []
 
             # Create settlements for each year
             for year in range(start_year, end_year + 1):
                 for month in months:
-                    self.stdout.write(self.style.SUCCESS(f"Creating row in settlements for {commodity}-{month}"))
+                    if verbosity > 1:
+                        self.stdout.write(self.style.SUCCESS(f"Creating row in settlements for {commodity}-{month}"))
                     settlement, _ = Settlement.objects.get_or_create(
                         commodity=commodity,
                         month=f"{month}",
@@ -72,9 +98,9 @@ class Command(BaseCommand):
                     )
                     all_settlements.append(settlement)
             # Create availabilities = all unique single contract month
-            self.stdout.write(self.style.SUCCESS(f"Creating single contract month entries {commodity}"))
             for s in all_settlements:
-                self.stdout.write(self.style.SUCCESS(f"Creating spread of contract month {commodity} {s}"))
+                if verbosity > 1:
+                    self.stdout.write(self.style.SUCCESS(f"Creating contract month {commodity} {s}"))
                 Availability.objects.get_or_create(
                     commodity=commodity,
                     start_month=s,
@@ -82,10 +108,13 @@ class Command(BaseCommand):
                     defaults={"settlement_price": 0, "is_available": True}
                 )
 
+            if not spreads:
+                continue
+
             # Create availabilities = all unique pairs across years
-            self.stdout.write(self.style.SUCCESS(f"Creating spread of contract month {commodity}"))
             for s1, s2 in itertools.combinations(all_settlements, 2):
-                self.stdout.write(self.style.SUCCESS(f"Creating spread of contract month {commodity} {s1}-{s2}"))
+                if verbosity > 1:
+                    self.stdout.write(self.style.SUCCESS(f"Creating spread of contract month {commodity} {s1}-{s2}"))
                 Availability.objects.get_or_create(
                     commodity=commodity,
                     start_month=s1,
@@ -93,4 +122,35 @@ class Command(BaseCommand):
                     defaults={"settlement_price": 0, "is_available": True}
                 )
 
-        self.stdout.write(self.style.SUCCESS("Import completed successfully."))
+    def benchmark(self, commodity_months, options):
+        """
+        Run both paths against the current database and report wall time for each.
+        Every run happens inside a transaction that is rolled back, so nothing is persisted.
+        """
+        runs = {
+            "row": lambda: self.load_rows(
+                commodity_months, options["start_year"], options["end_year"], verbosity=0,
+                spreads=not options["virtual_spreads"],
+            ),
+            "bulk": lambda: bulk_load_catalogue(
+                commodity_months,
+                start_year=options["start_year"],
+                end_year=options["end_year"],
+                batch_size=options["batch_size"],
+                spreads=not options["virtual_spreads"],
+            ),
+        }
+        timings = {}
+        for name, run in runs.items():
+            started = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    run()
+                    timings[name] = time.perf_counter() - started
+                    raise BenchmarkRollback()
+            except BenchmarkRollback:
+                pass
+            self.stdout.write(f"{name:>4}: {timings[name]:.2f}s")
+
+        if timings["bulk"] > 0:
+            self.stdout.write(self.style.SUCCESS(f"bulk is {timings['row'] / timings['bulk']:.1f}x faster"))
@@ -0,0 +1,75 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.timezone import now
+
+from trade.cache import catalogue_cache
+from trade.models import Availability, Trade
+from trade.projection import Projection
+from trade.serializers import TradeSerializer
+
+from .refresh_spreads import BenchmarkRollback
+
+# What the trade list screens show
+LIST_SCREEN_FIELDS = ["id", "status", "trade_type", "avg_price", "total_lots", "display_name", "contract_month", "created_at"]
+
+
+class Command(BaseCommand):
+    help = "Time the full TradeSerializer against the ?fields= projection on throwaway trades, rolled back"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trades", type=int, default=1000, help="Trades to serialize (default 1000)")
+        parser.add_argument("--rounds", type=int, default=5, help="Best of this many runs per mode (default 5)")
+
+    def handle(self, *args, **options):
+        availabilities = list(Availability.objects.order_by("pk").values_list("pk", flat=True)[:20])
+        if not availabilities:
+            raise CommandError("Load the catalogue first; the benchmark trades need Availabilities.")
+        count, rounds = options["trades"], options["rounds"]
+        all_fields = [name for name, field in TradeSerializer().fields.items() if not field.write_only]
+
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(username="list-benchmark")
+                entry = {"lots": 5, "price": 400, "added_at": now().isoformat(), "fills_received": [], "stop_loss": 390}
+                Trade.objects.bulk_create([
+                    Trade(name_id=availabilities[i % len(availabilities)], trade_type="long", trader=user,
+                          approved_by=user, status="approved", avg_price=Decimal("400.25"), total_lots=5,
+                          lots_and_price=[entry])
+                    for i in range(count)
+                ])
+                trades = Trade.objects.filter(trader=user).for_listing().order_by("-created_at", "-id")
+                catalogue_cache.get()
+
+                def best(run):
+                    timings = []
+                    for _ in range(rounds):
+                        started = time.perf_counter()
+                        rows = run()
+                        timings.append(time.perf_counter() - started)
+                    return min(timings), rows
+
+                full_time, full = best(lambda: TradeSerializer(trades, many=True).data)
+                projection = Projection.build(TradeSerializer, all_fields)
+                projected_time, projected = best(lambda: projection.render(projection.values(trades)))
+                screen = Projection.build(TradeSerializer, LIST_SCREEN_FIELDS)
+                screen_time, _ = best(lambda: screen.render(screen.values(trades)))
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+        for label, elapsed in (
+            ("full serializer", full_time),
+            (f"projection, all {len(all_fields)} fields", projected_time),
+            (f"projection, {len(LIST_SCREEN_FIELDS)} list-screen fields", screen_time),
+        ):
+            self.stdout.write(
+                f"{label}: {elapsed * 1000:.1f}ms for {count} trades ({count / elapsed:.0f}/s, "
+                f"{full_time / elapsed:.1f}x the full serializer)"
+            )
+        matches = [dict(row) for row in full] == projected
+        style = self.style.SUCCESS if matches else self.style.ERROR
+        self.stdout.write(style(f"Projected rows {'match' if matches else 'DO NOT match'} the serializer's."))
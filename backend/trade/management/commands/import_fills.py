@@ -0,0 +1,135 @@
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from trade.fills import build_rows, write_rows
+from trade.importer import CHUNK_SIZE, FORMATS, detect_format, import_fills
+from trade.models import Availability, Fill, Trade
+
+from .refresh_spreads import BenchmarkRollback
+
+
+class Command(BaseCommand):
+    help = "Stream a broker fill confirmation file (CSV or JSON lines) into trade and exit fills"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="CSV (trade,entry,lots,price / exit,lots,price) or JSONL file")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help=f"Lines per transaction (default {CHUNK_SIZE})")
+        parser.add_argument("--checkpoint", help="Checkpoint file (default <path>.checkpoint)")
+        parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint of an earlier run")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start at line 1")
+        parser.add_argument("--errors", help="Write rejected lines (line,error) to this CSV file")
+        parser.add_argument(
+            "--benchmark", type=int, metavar="LINES",
+            help="Import a synthetic file of LINES fills into throwaway trades and roll everything back.",
+        )
+
+    def handle(self, *args, **options):
+        if options["benchmark"]:
+            self.benchmark(options["benchmark"], options["chunk_size"])
+            return
+        if not options["path"]:
+            raise CommandError("A file path is required.")
+
+        path = Path(options["path"]).resolve()
+        if not path.is_file():
+            raise CommandError(f"{path} does not exist.")
+        fmt = options["format"] or detect_format(path)
+        checkpoint = Path(options["checkpoint"] or f"{path}.checkpoint")
+
+        offset = line_no = 0
+        if checkpoint.exists() and not options["restart"]:
+            if not options["resume"]:
+                raise CommandError(f"{checkpoint} exists; pass --resume to continue that import or --restart to start over.")
+            state = json.loads(checkpoint.read_text())
+            if state.get("path") != str(path) or state.get("offset", 0) > path.stat().st_size:
+                raise CommandError(f"{checkpoint} does not belong to {path} as it is now.")
+            offset, line_no = state["offset"], state["line"]
+            self.stdout.write(f"Resuming after line {line_no} (byte {offset}).")
+
+        errors_file = open(options["errors"], "a", encoding="utf-8") if options["errors"] else None
+        started = time.perf_counter()
+        applied = rejected = 0
+        try:
+            with open(path, "rb") as handle:
+                for chunk in import_fills(handle, fmt, offset, line_no, options["chunk_size"]):
+                    # The chunk is committed: move the checkpoint past it
+                    checkpoint.write_text(json.dumps({"path": str(path), "offset": chunk["offset"], "line": chunk["line"]}))
+                    applied += chunk["applied"]
+                    rejected += len(chunk["errors"])
+                    for line, error in chunk["errors"]:
+                        if errors_file:
+                            errors_file.write(f"{line},{json.dumps(error)}\n")
+                        elif rejected <= 20:
+                            self.stderr.write(f"line {line}: {error}")
+                    self.stdout.write(f"line {chunk['line']}: {applied} applied, {rejected} rejected")
+        finally:
+            if errors_file:
+                errors_file.close()
+
+        elapsed = time.perf_counter() - started
+        style = self.style.SUCCESS if not rejected else self.style.WARNING
+        self.stdout.write(style(
+            f"{applied} fills applied, {rejected} lines rejected in {elapsed:.2f}s "
+            f"({(applied + rejected) / elapsed if elapsed else 0:.0f} lines/s)."
+        ))
+
+    def benchmark(self, lines, chunk_size):
+        """
+        Synthetic file: `lines` single-lot fills spread over one trade per 50 lines, written to a
+        temporary CSV. The import runs inside a transaction that is rolled back afterwards.
+        """
+        availability = Availability.objects.select_related("commodity").order_by("pk").first()
+        if availability is None:
+            raise CommandError("Load the catalogue first; the benchmark trades need an Availability.")
+        rng = random.Random(17)
+
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(username="import-fills-benchmark")
+                trades = Trade.objects.bulk_create([
+                    Trade(name=availability, trade_type="long", trader=user, status="order_placed",
+                          lots_and_price=[{"lots": 10 ** 9, "price": 400, "added_at": "", "fills_received": [], "stop_loss": 390}])
+                    for _ in range(max(1, lines // 50))
+                ])
+                entry_rows = []
+                for trade in trades:
+                    entry_rows += build_rows(trade, trade.lots_and_price, availability.commodity_id)[0]
+                write_rows(entry_rows, [])
+
+                with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as handle:
+                    handle.write("trade,entry,lots,price\n")
+                    for _ in range(lines):
+                        handle.write(f"{rng.choice(trades).pk},0,1,{rng.randrange(39000, 41000) / 100}\n")
+                size = os.path.getsize(handle.name)
+                self.stdout.write(f"{lines} lines ({size / 2 ** 20:.1f} MiB), {len(trades)} trades, chunks of {chunk_size}")
+
+                rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                started = time.perf_counter()
+                applied = 0
+                with open(handle.name, "rb") as source:
+                    for chunk in import_fills(source, "csv", chunk_size=chunk_size):
+                        applied += chunk["applied"]
+                elapsed = time.perf_counter() - started
+                rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                stored = Fill.objects.filter(trade__in=trades).count()
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+        finally:
+            if "handle" in locals():
+                os.unlink(handle.name)
+
+        self.stdout.write(f"{applied} fills applied ({stored} stored) in {elapsed:.2f}s")
+        self.stdout.write(self.style.SUCCESS(
+            f"{lines / elapsed:.0f} lines/s, peak RSS grew by {(rss_after - rss_before) / 1024:.1f} MiB"
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from trade.loaders import load_settlement_prices
+
+
+class Command(BaseCommand):
+    help = "Bulk load end-of-day settlement prices from a code,month,year,price CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("price_file", type=str, help="Path to the price CSV file")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["price_file"], "r", newline="") as f:
+                result = load_settlement_prices(f)
+        except FileNotFoundError:
+            raise CommandError(f"Price file '{options['price_file']}' not found.")
+
+        for line_number, error in sorted(result["errors"] + result["unmatched"]):
+            self.stdout.write(self.style.WARNING(f"Line {line_number}: {error}"))
+
+        timings = result["timings"]
+        self.stdout.write(
+            "Phases: " + ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in timings.items())
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['rows']} prices read, {result['settlements']} settlements and "
+            f"{result['availabilities']} availabilities changed."
+        ))
+        if result["errors"] or result["unmatched"]:
+            self.stdout.write(self.style.WARNING(
+                f"{len(result['errors'])} rows skipped, {len(result['unmatched'])} matched no contract."
+            ))
@@ -0,0 +1,134 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from trade.models import Availability, Exit, Trade
+from trade.serializers import ExitSerializer
+from trade.views import create_exit, notify_exit_update
+
+from .refresh_spreads import BenchmarkRollback
+
+
+def create_exits_rowwise(trade, items, user):
+    """
+    What create_exit did before the bulk insert, kept as the benchmark's reference: a serializer,
+    an INSERT, a broadcast and a second serialization per exit.
+    """
+    created = []
+    with transaction.atomic():
+        trade = Trade.objects.select_for_update().get(pk=trade.pk)
+        validated = []
+        for item in items:
+            s = ExitSerializer(data={"trade": trade.id, "exit_initiated_by": user.id, **item})
+            s.is_valid(raise_exception=True)
+            validated.append(s)
+        for s in validated:
+            obj = s.save(exit_initiated_by=user)
+            notify_exit_update(obj)
+            created.append(ExitSerializer(obj).data)
+    return created
+
+
+class Command(BaseCommand):
+    help = "Load test exit fill updates: partial then complete fills on a throwaway trade, rolled back"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--exits", type=int, default=500, help="Exits to fill (default 500)")
+        parser.add_argument(
+            "--requests", action="store_true",
+            help="Instead, time create_exit requests of 1, 10 and 100 exits against the per-item loop, rolled back.",
+        )
+
+    def handle(self, *args, **options):
+        availability = Availability.objects.order_by("pk").first()
+        if availability is None:
+            raise CommandError("Load the catalogue first; the load test trade needs an Availability.")
+        if options["requests"]:
+            return self.benchmark_requests(availability)
+        count = options["exits"]
+
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(username="exit-load-test")
+                trade = Trade.objects.create(name=availability, trade_type="long", trader=user,
+                                             avg_price=Decimal("400"), total_lots=count * 4,
+                                             exit_requested_lots=count * 4)
+                Exit.objects.bulk_create([
+                    Exit(trade=trade, requested_exit_lots=4, exit_price=Decimal("401") + i % 20,
+                         exit_status="order_placed", exit_initiated_by=user)
+                    for i in range(count)
+                ])
+                exits = list(Exit.objects.filter(trade=trade).select_related("trade"))
+
+                # Same writes as update_exit_status: received lots, filled_at and the intended status
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for received, intent in ((2, "partial_filled"), (4, "filled")):
+                        for exit_obj in exits:
+                            exit_obj.recieved_lots = received
+                            exit_obj.filled_at = now()
+                            exit_obj.exit_status = intent
+                            exit_obj.save_changes()
+                    elapsed = time.perf_counter() - started
+
+                filled = Exit.objects.filter(trade=trade, exit_status="filled", is_closed=True,
+                                             profit_loss__isnull=False).count()
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+        updates = count * 2
+        writes = sum(1 for query in queries.captured_queries if query["sql"].startswith("UPDATE"))
+        self.stdout.write(
+            f"{updates} fill updates in {elapsed:.2f}s ({updates / elapsed:.0f}/s), "
+            f"{len(queries) / updates:.2f} queries and {writes / updates:.2f} UPDATEs per update"
+        )
+        style = self.style.SUCCESS if filled == count else self.style.ERROR
+        self.stdout.write(style(f"{filled}/{count} exits filled and closed with P&L."))
+
+    def benchmark_requests(self, availability, sizes=(1, 10, 100), rounds=20):
+        factory = APIRequestFactory()
+        results = []
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(username="exit-load-test", is_staff=True)
+                trade = Trade.objects.create(name=availability, trade_type="long", trader=user,
+                                             avg_price=Decimal("400"), total_lots=sum(sizes) * rounds * 2)
+                for size in sizes:
+                    items = [{"requested_exit_lots": 1, "exit_price": "401"} for _ in range(size)]
+
+                    started = time.perf_counter()
+                    for _ in range(rounds):
+                        create_exits_rowwise(trade, items, user)
+                    rowwise = (time.perf_counter() - started) / rounds
+
+                    started = time.perf_counter()
+                    for _ in range(rounds):
+                        request = factory.post("/api/trades/exits/", {"trade": trade.id, "exits": items}, format="json")
+                        force_authenticate(request, user)
+                        response = create_exit(request)
+                        if response.status_code != 201:
+                            raise CommandError(f"create_exit failed: {response.data}")
+                    bulk = (time.perf_counter() - started) / rounds
+
+                    results.append((size, rowwise, bulk))
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+        for size, rowwise, bulk in results:
+            self.stdout.write(
+                f"{size:>4} exits: per-item {rowwise * 1000:.1f}ms, bulk {bulk * 1000:.1f}ms per request "
+                f"({rowwise / bulk:.1f}x faster)"
+            )
+        growth = results[-1][2] / results[0][2]
+        self.stdout.write(self.style.SUCCESS(
+            f"Bulk request time grows {growth:.1f}x from {sizes[0]} to {sizes[-1]} exits."
+        ))
@@ -0,0 +1,84 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from trade.models import Availability, Commodity, Settlement
+from trade.pricing import refresh_spread_prices, refresh_spread_prices_rowwise
+
+
+class BenchmarkRollback(Exception):
+    """Raised inside a benchmark run so its writes are rolled back."""
+
+
+class Command(BaseCommand):
+    help = "Recompute Availability settlement prices from the settlement curves (start minus end)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--commodity", action="append", default=[],
+            help="Commodity code to refresh; repeat for several. Defaults to all commodities.",
+        )
+        parser.add_argument(
+            "--benchmark", action="store_true",
+            help="Shift every settlement price, time the row and vectorized refreshes, and roll both back.",
+        )
+
+    def handle(self, *args, **options):
+        commodity_ids = None
+        if options["commodity"]:
+            codes = {code.upper() for code in options["commodity"]}
+            commodity_ids = list(Commodity.objects.filter(code__in=codes).values_list("id", flat=True))
+            if len(commodity_ids) != len(codes):
+                raise CommandError(f"Unknown commodity in {', '.join(sorted(codes))}.")
+
+        if options["benchmark"]:
+            self.benchmark(commodity_ids)
+            return
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            updated = refresh_spread_prices(commodity_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"{updated} availability prices changed in {time.perf_counter() - started:.2f}s."
+        ))
+
+    def benchmark(self, commodity_ids):
+        """
+        Time a full refresh on both paths after moving every settlement on the curve, so each
+        run has the same rows to re-price. Every run is rolled back, so nothing is persisted.
+        """
+        commodities = Settlement.objects.values("commodity_id")
+        availabilities = Availability.objects.all()
+        if commodity_ids is not None:
+            commodities = commodities.filter(commodity_id__in=commodity_ids)
+            availabilities = availabilities.filter(commodity_id__in=commodity_ids)
+        self.stdout.write(
+            f"{commodities.distinct().count()} commodities, {availabilities.count()} availabilities"
+        )
+
+        runs = {
+            "row": lambda: refresh_spread_prices_rowwise(commodity_ids),
+            "vectorized": lambda: refresh_spread_prices(commodity_ids),
+        }
+        timings = {}
+        for name, run in runs.items():
+            try:
+                with transaction.atomic():
+                    settlements = Settlement.objects.all()
+                    if commodity_ids is not None:
+                        settlements = settlements.filter(commodity_id__in=commodity_ids)
+                    # Queryset update sends no signals, so the curve moves without re-pricing anything yet
+                    settlements.update(settlement_price=F("settlement_price") + F("contract_key") % 7 + 1)
+                    started = time.perf_counter()
+                    updated = run()
+                    timings[name] = time.perf_counter() - started
+                    raise BenchmarkRollback()
+            except BenchmarkRollback:
+                pass
+            self.stdout.write(f"{name:>10}: {timings[name]:.2f}s, {updated} rows updated")
+
+        if timings["vectorized"] > 0:
+            self.stdout.write(self.style.SUCCESS(
+                f"vectorized is {timings['row'] / timings['vectorized']:.1f}x faster"
+            ))
@@ -0,0 +1,98 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from trade.models import AVERAGE_COST, Availability, Exit, Trade
+from trade.ticks import contract_spec
+
+from .refresh_spreads import BenchmarkRollback
+
+
+def recompute_rowwise(trade):
+    """The per-exit loop the trade receiver used to run: one save (and one Exit post_save) per exit."""
+    point_value = contract_spec(trade.name_id).point_value
+    for exit_obj in trade.exits.all():
+        if exit_obj.exit_price is not None and exit_obj.recieved_lots and exit_obj.recieved_lots > 0:
+            calculated_pl = (Decimal(exit_obj.exit_price) - Decimal(trade.avg_price)) * Decimal(exit_obj.recieved_lots) * point_value
+            if exit_obj.profit_loss != calculated_pl:
+                exit_obj.profit_loss = calculated_pl
+                exit_obj.save(update_fields=["profit_loss"])
+
+
+class Command(BaseCommand):
+    help = "Recompute exit profit_loss from each average-cost trade's current avg_price"
+
+    def add_arguments(self, parser):
+        parser.add_argument("trade_ids", nargs="*", type=int, help="Only reprice exits of these trades")
+        parser.add_argument(
+            "--benchmark", action="store_true",
+            help="Build a throwaway trade with --exits exits, time the per-exit and set-based recomputes, and roll back.",
+        )
+        parser.add_argument("--exits", type=int, default=200, help="Exits on the benchmark trade (default 200)")
+
+    def handle(self, *args, **options):
+        if options["benchmark"]:
+            self.benchmark(options["exits"])
+            return
+
+        # FIFO / LIFO exits are priced by the fills they matched, not by avg_price
+        exits = Exit.objects.filter(trade__lot_matching=AVERAGE_COST)
+        if options["trade_ids"]:
+            exits = exits.filter(trade_id__in=options["trade_ids"])
+
+        started = time.perf_counter()
+        changed = exits.recompute_profit_loss()
+        self.stdout.write(self.style.SUCCESS(
+            f"{changed} exits repriced in {time.perf_counter() - started:.2f}s."
+        ))
+
+    def benchmark(self, count):
+        """
+        Both runs start from the same trade: `count` filled exits priced against an avg_price of
+        400, which then moves to 412.5 so every exit needs a new profit_loss.
+        """
+        availability = Availability.objects.order_by("pk").first()
+        if availability is None:
+            raise CommandError("Load the catalogue first; the benchmark trade needs an Availability.")
+
+        runs = {
+            "per-exit": recompute_rowwise,
+            "set-based": lambda trade: trade.exits.recompute_profit_loss(trade.avg_price),
+        }
+        timings, results = {}, {}
+        for name, run in runs.items():
+            try:
+                with transaction.atomic():
+                    user = get_user_model().objects.create_user(username="reprice-exits-benchmark")
+                    trade = Trade.objects.create(name=availability, trade_type="long", trader=user,
+                                                 avg_price=Decimal("400"), total_lots=count * 10)
+                    Exit.objects.bulk_create([
+                        Exit(trade=trade, requested_exit_lots=10, recieved_lots=1 + i % 10,
+                             exit_price=Decimal("395") + Decimal(i % 40) / 2, exit_initiated_by=user,
+                             exit_status="partial_filled",
+                             profit_loss=(Decimal("395") + Decimal(i % 40) / 2 - 400) * (1 + i % 10))
+                        for i in range(count)
+                    ])
+                    trade.avg_price = Decimal("412.5")
+                    Trade.objects.filter(pk=trade.pk).update(avg_price=trade.avg_price)
+
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        run(trade)
+                        timings[name] = time.perf_counter() - started
+                    results[name] = list(Exit.objects.filter(trade=trade).order_by("pk").values_list("profit_loss", flat=True))
+                    raise BenchmarkRollback()
+            except BenchmarkRollback:
+                pass
+            self.stdout.write(f"{name:>10}: {timings[name] * 1000:.1f}ms, {len(queries)} queries")
+
+        if results["per-exit"] != results["set-based"]:
+            raise CommandError("The two recomputes disagree on profit_loss.")
+        if timings["set-based"] > 0:
+            self.stdout.write(self.style.SUCCESS(
+                f"set-based is {timings['per-exit'] / timings['set-based']:.1f}x faster"
+            ))
@@ -0,0 +1,171 @@
+"""
+Lot matching: realized P&L slice by slice for trades closed FIFO or LIFO.
+
+Every Fill is a lot; Fill.open_lots is what earlier exits left of it, so a trade's fills with
+open lots are the queue its exits match against. When an exit receives lots, the new ones are
+taken from that queue (oldest fill first for FIFO, newest first for LIFO) and recorded as
+LotMatch slices priced at the fill's price; lots taken back are released from the exit's newest
+slices. An exit fill moves only its own slices and the fills they take from, so the exits
+matched before it are never revisited and the cost does not grow with the exits a trade has.
+
+Average-cost trades (the default) are not matched: every exit is priced against the position's
+avg_price and repriced when it moves (ExitQuerySet.recompute_profit_loss).
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import AVERAGE_COST, Exit, Fill, LotMatch
+
+CENTS = Decimal("0.01")
+
+
+class LotBook:
+    """
+    The open lots of some exits' trades and those exits' slices, read once (fills locked) and
+    matched in memory; save() writes what changed. Exits of average-cost trades are ignored.
+    """
+
+    def __init__(self, exits):
+        exits = [exit_obj for exit_obj in exits if exit_obj.trade.lot_matching != AVERAGE_COST]
+        self.trade_ids = {exit_obj.trade_id for exit_obj in exits}
+        saved = [exit_obj.pk for exit_obj in exits if exit_obj.pk is not None]
+        slices = list(LotMatch.objects.filter(exit_id__in=saved).order_by("pk")) if saved else []
+        fills = Fill.objects.select_for_update().filter(
+            Q(trade_id__in=self.trade_ids, open_lots__gt=0)
+            | Q(pk__in={match.fill_id for match in slices})
+        ).order_by("filled_at", "pk") if exits else []
+        self.queues = {}
+        self.fills = {}
+        for fill in fills:
+            self.queues.setdefault(fill.trade_id, []).append(fill)
+            self.fills[fill.pk] = fill
+        self.slices = {id(exit_obj): [] for exit_obj in exits}
+        by_exit = {exit_obj.pk: self.slices[id(exit_obj)] for exit_obj in exits if exit_obj.pk is not None}
+        for match in slices:
+            match.fill = self.fills[match.fill_id]
+            by_exit[match.exit_id].append(match)
+        self.changed_fills, self.changed_slices, self.released = {}, {}, []
+
+    def open_lots(self, trade_id):
+        return sum(fill.open_lots for fill in self.queues.get(trade_id, []))
+
+    def matched_lots(self, exit_obj):
+        return sum(match.lots for match in self.slices.get(id(exit_obj), []))
+
+    def match(self, exit_obj):
+        """
+        Bring the exit's slices to its received lots and price them at its exit_price. Returns
+        the exit's profit_loss: the sum of its slices, None while it has no price or no slices.
+        Raises ValueError, before changing anything, when the trade has too few open lots.
+        """
+        slices = self.slices[id(exit_obj)]
+        wanted = (exit_obj.recieved_lots or 0) - self.matched_lots(exit_obj)
+        available = self.open_lots(exit_obj.trade_id)
+        if wanted > available:
+            raise ValueError(f"Trade {exit_obj.trade_id} has {available} open lots; cannot close {wanted} more.")
+        if wanted > 0:
+            self.take(exit_obj, slices, wanted)
+        elif wanted < 0:
+            self.release(slices, -wanted)
+
+        if exit_obj.exit_price is None or not slices:
+            for match in slices:
+                if match.profit_loss is not None:
+                    match.profit_loss = None
+                    self.touch(match)
+            return None
+        point_value = exit_obj.point_value()
+        profit_loss = Decimal(0)
+        for match in slices:
+            value = ((Decimal(exit_obj.exit_price) - match.fill.price) * match.lots * point_value).quantize(CENTS)
+            if match.profit_loss != value:
+                match.profit_loss = value
+                self.touch(match)
+            profit_loss += value
+        return profit_loss
+
+    def take(self, exit_obj, slices, lots):
+        queue = self.queues[exit_obj.trade_id]
+        if exit_obj.trade.lot_matching == "lifo":
+            queue = reversed(queue)
+        for fill in queue:
+            if not lots:
+                break
+            taken = min(fill.open_lots, lots)
+            if not taken:
+                continue
+            fill.open_lots -= taken
+            self.changed_fills[fill.pk] = fill
+            lots -= taken
+            if slices and slices[-1].fill is fill:
+                slices[-1].lots += taken
+                self.touch(slices[-1])
+            else:
+                slices.append(LotMatch(exit=exit_obj, fill=fill, lots=taken))
+
+    def release(self, slices, lots):
+        """Give `lots` back to the queue from the exit's newest slices."""
+        while lots:
+            match = slices[-1]
+            given = min(match.lots, lots)
+            match.fill.open_lots += given
+            self.changed_fills[match.fill.pk] = match.fill
+            match.lots -= given
+            lots -= given
+            if match.lots:
+                self.touch(match)
+            else:
+                slices.pop()
+                if match.pk is not None:
+                    self.released.append(match.pk)
+                    self.changed_slices.pop(match.pk, None)
+
+    def touch(self, match):
+        if match.pk is not None:
+            self.changed_slices[match.pk] = match
+
+    def save(self):
+        """Write the changed open lots and slices: at most one statement each for updates, inserts and deletes."""
+        # Imported here because batch.py imports this module
+        from .batch import write_columns
+
+        write_columns(Fill, list(self.changed_fills.values()), ["open_lots"])
+        write_columns(LotMatch, list(self.changed_slices.values()), ["lots", "profit_loss"])
+        if self.released:
+            LotMatch.objects.filter(pk__in=self.released).delete()
+        new = [match for matches in self.slices.values() for match in matches if match.pk is None]
+        if new:
+            LotMatch.objects.bulk_create(new)
+        self.changed_fills, self.changed_slices, self.released = {}, {}, []
+
+
+def rematch(trade):
+    """
+    Replay every exit of a trade against its fills, after they were rewritten or its
+    lot_matching changed. Exits are matched in the order they were filled; average-cost
+    trades drop their slices and are repriced against avg_price.
+    Raises ValueError when the exits have closed more lots than the fills now hold.
+    """
+    # Imported here because batch.py imports this module
+    from .batch import write_columns
+
+    with transaction.atomic():
+        LotMatch.objects.filter(exit__trade=trade).delete()
+        Fill.objects.filter(trade=trade).exclude(open_lots=F("lots")).update(open_lots=F("lots"))
+        if trade.lot_matching == AVERAGE_COST:
+            return trade.exits.recompute_profit_loss(trade.avg_price)
+        exits = list(Exit.objects.filter(trade=trade, recieved_lots__gt=0).order_by(F("filled_at").asc(nulls_first=True), "pk"))
+        for exit_obj in exits:
+            exit_obj.trade = trade
+        book = LotBook(exits)
+        changed = []
+        for exit_obj in exits:
+            profit_loss = book.match(exit_obj)
+            if exit_obj.profit_loss != profit_loss:
+                exit_obj.profit_loss = profit_loss
+                changed.append(exit_obj)
+        book.save()
+        write_columns(Exit, changed, ["profit_loss"])
+        return len(changed)
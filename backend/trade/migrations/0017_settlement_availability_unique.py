@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:47
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(model, fields):
+    """
+    Keep the lowest id of every group of rows sharing `fields`, point whatever references the
+    others at it, then delete them. Returns nothing; a no-op on a clean table.
+    """
+    groups = (
+        model.objects.order_by().values(*fields).annotate(keep=Min('id'), rows=Count('id')).filter(rows__gt=1)
+    )
+    for group in groups:
+        keep = group.pop('keep')
+        group.pop('rows')
+        duplicates = list(model.objects.filter(**group).exclude(pk=keep).values_list('pk', flat=True))
+        for relation in model._meta.related_objects:
+            if relation.many_to_many:
+                continue
+            relation.related_model.objects.filter(**{f'{relation.field.name}__in': duplicates}).update(
+                **{relation.field.name: keep}
+            )
+        model.objects.filter(pk__in=duplicates).delete()
+
+
+def merge_duplicate_contracts(apps, schema_editor):
+    Settlement = apps.get_model('trade', 'Settlement')
+    Availability = apps.get_model('trade', 'Availability')
+    # Settlements first: merging them can turn availabilities into duplicates
+    merge_duplicates(Settlement, ['commodity', 'month', 'year'])
+    merge_duplicates(Availability, ['commodity', 'start_month', 'end_month'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0016_alter_exit_trade_delete_flytrade'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_contracts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='availability',
+            constraint=models.UniqueConstraint(fields=('commodity', 'start_month', 'end_month'), name='unique_availability_spread'),
+        ),
+        migrations.AddConstraint(
+            model_name='availability',
+            constraint=models.UniqueConstraint(condition=models.Q(('end_month__isnull', True)), fields=('commodity', 'start_month'), name='unique_availability_single'),
+        ),
+        migrations.AddConstraint(
+            model_name='settlement',
+            constraint=models.UniqueConstraint(fields=('commodity', 'month', 'year'), name='unique_settlement_contract'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:49
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+MONTH_NUMBERS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+
+
+def backfill_contract_keys(apps, schema_editor):
+    Settlement = apps.get_model('trade', 'Settlement')
+    Availability = apps.get_model('trade', 'Availability')
+
+    settlements = list(Settlement.objects.only('id', 'month', 'year'))
+    for settlement in settlements:
+        number = MONTH_NUMBERS.get(settlement.month[:3].lower())
+        settlement.contract_key = settlement.year * 12 + number if number else None
+    Settlement.objects.bulk_update(settlements, ['contract_key'], batch_size=2000)
+
+    Availability.objects.update(
+        start_key=Subquery(Settlement.objects.filter(pk=OuterRef('start_month_id')).values('contract_key')[:1]),
+        end_key=Subquery(Settlement.objects.filter(pk=OuterRef('end_month_id')).values('contract_key')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0017_settlement_availability_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='availability',
+            name='end_key',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='availability',
+            name='start_key',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='settlement',
+            name='contract_key',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_contract_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='availability',
+            index=models.Index(fields=['commodity', 'start_key', 'end_key', 'is_available'], name='availability_contract_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='settlement',
+            index=models.Index(fields=['commodity', 'contract_key'], name='settlement_contract_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0018_contract_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='settlement',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
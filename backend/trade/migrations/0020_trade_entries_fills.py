@@ -0,0 +1,105 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+
+from django.db import migrations, models
+
+ENTRY_KEYS = ("lots", "price", "added_at", "fills_received", "stop_loss")
+
+
+def to_decimal(value):
+    return Decimal(str(value or 0))
+
+
+def backfill_entries(apps, schema_editor):
+    """One TradeEntry per lots_and_price element and one Fill per fills_received element."""
+    Trade = apps.get_model('trade', 'Trade')
+    TradeEntry = apps.get_model('trade', 'TradeEntry')
+    Fill = apps.get_model('trade', 'Fill')
+
+    trades = Trade.objects.select_related('name').only(
+        'id', 'lots_and_price', 'created_at', 'fills_received_at', 'name__commodity_id'
+    ).order_by('pk')
+    for offset in range(0, trades.count(), 500):
+        entry_rows, fill_rows = [], []
+        for trade in trades[offset:offset + 500]:
+            for position, entry in enumerate(trade.lots_and_price or []):
+                if not isinstance(entry, dict):
+                    continue
+                entry_row = TradeEntry(
+                    trade_id=trade.id,
+                    position=position,
+                    lots=int(entry.get('lots', 0) or 0),
+                    price=to_decimal(entry.get('price')),
+                    stop_loss=to_decimal(entry['stop_loss']) if entry.get('stop_loss') is not None else None,
+                    added_at=str(entry.get('added_at') or ''),
+                    extra={key: value for key, value in entry.items() if key not in ENTRY_KEYS},
+                )
+                entry_rows.append(entry_row)
+                fills = entry.get('fills_received', [])
+                for fill_position, fill in enumerate(f for f in (fills if isinstance(fills, list) else []) if isinstance(f, dict)):
+                    fill_rows.append((entry_row, Fill(
+                        trade_id=trade.id,
+                        commodity_id=trade.name.commodity_id,
+                        position=fill_position,
+                        lots=int(fill.get('lots', 0) or 0),
+                        price=to_decimal(fill.get('price')),
+                        filled_at=trade.fills_received_at or trade.created_at,
+                    )))
+        TradeEntry.objects.bulk_create(entry_rows, batch_size=2000)
+        for entry_row, fill in fill_rows:
+            fill.entry_id = entry_row.id
+        Fill.objects.bulk_create([fill for _, fill in fill_rows], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0019_settlement_expired_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TradeEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(help_text='Index of this entry in lots_and_price.')),
+                ('lots', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('stop_loss', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('added_at', models.CharField(blank=True, help_text='added_at exactly as the client sent it.', max_length=40)),
+                ('extra', models.JSONField(blank=True, default=dict)),
+                ('trade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='trade.trade')),
+            ],
+            options={
+                'ordering': ['trade', 'position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Fill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(help_text="Index of this fill in the entry's fills_received.")),
+                ('lots', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('filled_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('commodity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fills', to='trade.commodity')),
+                ('trade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fills', to='trade.trade')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fills', to='trade.tradeentry')),
+            ],
+            options={
+                'ordering': ['entry_id', 'position'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='tradeentry',
+            constraint=models.UniqueConstraint(fields=('trade', 'position'), name='unique_trade_entry_position'),
+        ),
+        migrations.AddIndex(
+            model_name='fill',
+            index=models.Index(fields=['commodity', 'filled_at'], name='fill_commodity_idx'),
+        ),
+        migrations.RunPython(backfill_entries, migrations.RunPython.noop),
+    ]
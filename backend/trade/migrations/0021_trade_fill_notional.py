@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:07
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_fill_notional(apps, schema_editor):
+    Trade = apps.get_model('trade', 'Trade')
+    Fill = apps.get_model('trade', 'Fill')
+    output = DecimalField(max_digits=24, decimal_places=6)
+    notional = Fill.objects.filter(trade_id=OuterRef('pk')).order_by().values('trade_id').annotate(
+        total=Sum(ExpressionWrapper(F('lots') * F('price'), output_field=output))
+    ).values('total')
+    Trade.objects.update(fill_notional=Coalesce(Subquery(notional, output_field=output), Value(0), output_field=output))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0020_trade_entries_fills'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trade',
+            name='fill_notional',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=24),
+        ),
+        migrations.RunPython(backfill_fill_notional, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0021_trade_fill_notional'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exit',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, help_text='Bumped by every save.'),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
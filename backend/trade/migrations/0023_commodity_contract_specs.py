@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:36
+
+import django.core.validators
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0022_trade_exit_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commodity',
+            name='point_value',
+            field=models.DecimalField(decimal_places=4, default=1, help_text='Value of a one point price move for one lot; exit P&L is multiplied by it.', max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='commodity',
+            name='tick_size',
+            field=models.DecimalField(decimal_places=4, default=Decimal('0.0001'), help_text='Minimum price increment; fill prices must be a multiple of it.', max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.0001'))]),
+        ),
+    ]
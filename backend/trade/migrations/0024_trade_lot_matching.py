@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def open_all_lots(apps, schema_editor):
+    # Every existing trade is average cost: nothing has been matched yet
+    apps.get_model('trade', 'Fill').objects.update(open_lots=F('lots'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0023_commodity_contract_specs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fill',
+            name='open_lots',
+            field=models.PositiveIntegerField(default=0, help_text='Lots no exit has matched yet (FIFO / LIFO trades).'),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='lot_matching',
+            field=models.CharField(choices=[('average', 'Average cost'), ('fifo', 'FIFO'), ('lifo', 'LIFO')], default='average', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='LotMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lots', models.PositiveIntegerField()),
+                ('profit_loss', models.DecimalField(blank=True, decimal_places=2, help_text='(exit price - fill price) x lots x point value; empty until the exit has a price.', max_digits=10, null=True)),
+                ('exit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='trade.exit')),
+                ('fill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='trade.fill')),
+            ],
+            options={
+                'ordering': ['exit_id', 'id'],
+            },
+        ),
+        migrations.RunPython(open_all_lots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:47
+
+from django.db import migrations, models
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_exit_lot_counters(apps, schema_editor):
+    Trade = apps.get_model('trade', 'Trade')
+    Exit = apps.get_model('trade', 'Exit')
+
+    def total(column, condition=Q()):
+        summed = Exit.objects.filter(condition, trade=OuterRef('pk')).order_by().values('trade').annotate(
+            total=Sum(column)
+        ).values('total')
+        return Coalesce(Subquery(summed, output_field=IntegerField()), Value(0))
+
+    Trade.objects.update(
+        exit_requested_lots=total('requested_exit_lots', ~Q(exit_status__in=['rejected', 'cancelled'])),
+        exit_received_lots=total('recieved_lots'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0024_trade_lot_matching'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trade',
+            name='exit_received_lots',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='exit_requested_lots',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_exit_lot_counters, migrations.RunPython.noop),
+    ]
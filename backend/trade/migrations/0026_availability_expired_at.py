@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils import timezone
+
+
+def mark_expired_availabilities(apps, schema_editor):
+    # Rows a sync closed before this field existed: unavailable with an expired leg
+    Availability = apps.get_model('trade', 'Availability')
+    Availability.objects.filter(
+        Q(start_month__expired_at__isnull=False) | Q(end_month__expired_at__isnull=False),
+        is_available=False,
+    ).update(expired_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0025_trade_exit_lot_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='availability',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_expired_availabilities, migrations.RunPython.noop),
+    ]
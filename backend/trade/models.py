@@ -1,16 +1,194 @@
-from django.db import models
+from datetime import datetime, time, timedelta
+from django.db import models, router, transaction
+from django.db.models import ExpressionWrapper, F, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from decimal import Decimal
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
+
+from .ticks import DEFAULT_SPEC, PRICE_TICK, contract_spec
 
 User = get_user_model()
 
+AVERAGE_COST = "average"
+# Exits in these statuses no longer hold the lots they requested
+INACTIVE_EXIT_STATUSES = ("rejected", "cancelled")
+LOT_MATCHING_METHODS = [(AVERAGE_COST, "Average cost"), ("fifo", "FIFO"), ("lifo", "LIFO")]
+
+CONTRACT_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+MONTH_NUMBERS = {abbr.lower(): number for number, abbr in enumerate(CONTRACT_MONTHS, start=1)}
+
+
+def contract_key(month, year):
+    """
+    Sortable integer for a contract month: year * 12 + month number (Jan = 1).
+    Accepts "Jan"/"jan"/"January" style months; returns None if the month is not recognised.
+    """
+    number = MONTH_NUMBERS.get(str(month or "")[:3].lower())
+    if number is None or year is None:
+        return None
+    return int(year) * 12 + number
+
+
+def parse_contract(value):
+    """Parse "Mar26" / "Mar2026" into a contract key, or None."""
+    value = (value or "").strip()
+    if len(value) < 5 or not value[3:].isdigit():
+        return None
+    year = int(value[3:])
+    if year < 100:
+        year += 2000
+    return contract_key(value[:3], year)
+
+
+class AvailabilityQuerySet(models.QuerySet):
+    def for_contract(self, code=None, start=None, end=None):
+        """
+        Exact lookup by commodity code and (month, year) tuples for either leg.
+        Served by availability_contract_idx instead of case-insensitive joins on Settlement.month.
+        """
+        qs = self
+        if code:
+            qs = qs.filter(commodity__code__iexact=code)
+        for field, contract in (('start_key', start), ('end_key', end)):
+            if contract:
+                key = contract_key(*contract)
+                if key is None:
+                    return qs.none()
+                qs = qs.filter(**{field: key})
+        return qs
+
+    def start_between(self, low, high):
+        return self.filter(start_key__gte=low, start_key__lte=high)
+
+    def end_between(self, low, high):
+        return self.filter(end_key__gte=low, end_key__lte=high)
+
+    def spreads(self):
+        return self.filter(end_key__isnull=False)
+
+
+class FillQuerySet(models.QuerySet):
+    def for_commodity(self, code):
+        return self.filter(commodity__code__iexact=code)
+
+    def filled_on(self, day):
+        """Fills recorded on a calendar day (in the current time zone); a range on fill_commodity_idx."""
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        return self.filter(filled_at__gte=start, filled_at__lt=start + timedelta(days=1))
+
+    def totals(self):
+        """{'total_lots', 'notional'} summed in SQL; the average price is notional / total_lots."""
+        return self.aggregate(
+            total_lots=Coalesce(Sum("lots"), 0),
+            notional=Coalesce(
+                Sum(ExpressionWrapper(F("lots") * F("price"), output_field=models.DecimalField(max_digits=24, decimal_places=6))),
+                Decimal("0"),
+                output_field=models.DecimalField(max_digits=24, decimal_places=6),
+            ),
+        )
+
+
+class ExitQuerySet(models.QuerySet):
+    def for_listing(self):
+        """The initiator and approver the exit serializers name, joined instead of read per row."""
+        return self.select_related("exit_initiated_by", "exit_approved_by")
+
+    def recompute_profit_loss(self, entry_price=None):
+        """
+        Set profit_loss = (exit_price - entry_price) * received lots * point value on every
+        filled exit in one UPDATE. Without `entry_price` each exit is priced against its own position's
+        avg_price (a correlated subquery), so exits of many trades share the statement.
+        Rows already holding that value are left alone and no signals are sent.
+        Returns the number of exits changed.
+        """
+        money = models.DecimalField(max_digits=10, decimal_places=2)
+        if entry_price is None:
+            position = self.model._meta.get_field(self.model.position_field).related_model
+            entry = Subquery(
+                position.objects.filter(pk=OuterRef(self.model.position_field)).values("avg_price")[:1],
+                output_field=money,
+            )
+        else:
+            entry = Value(Decimal(entry_price), output_field=money)
+        point_value = Coalesce(
+            Subquery(
+                Commodity.objects.filter(**{self.model.commodity_path: OuterRef(self.model.position_field)})
+                .values("point_value")[:1]
+            ),
+            Value(DEFAULT_SPEC.point_value),
+            output_field=models.DecimalField(max_digits=14, decimal_places=4),
+        )
+        profit_loss = ExpressionWrapper(
+            (F("exit_price") - entry) * F(self.model.lots_field) * point_value, output_field=money,
+        )
+        changes = {"profit_loss": profit_loss}
+        if issubclass(self.model, VersionedMixin):
+            changes["version"] = F("version") + 1
+        return (
+            self.filter(exit_price__isnull=False, **{f"{self.model.lots_field}__gt": 0})
+            .exclude(profit_loss=profit_loss)
+            .update(**changes)
+        )
+
+    def create_requests(self, exits):
+        """
+        Insert new exit requests with one bulk_create. Each gets its derived state first, and the
+        exit counters of every position involved move with one UPDATE, in the same transaction.
+        Sends no signals. Returns the exits, now with pks.
+        """
+        attname = self.model._meta.get_field(self.model.position_field).attname
+        totals = {}
+        for exit_obj in exits:
+            exit_obj.derive_exit_state()
+            requested, received = exit_obj.held_lots()
+            first, requested_total, received_total = totals.get(getattr(exit_obj, attname), (exit_obj, 0, 0))
+            totals[getattr(exit_obj, attname)] = (first, requested_total + requested, received_total + received)
+        with transaction.atomic(using=self.db, savepoint=False):
+            self.bulk_create(exits)
+            for first, requested, received in totals.values():
+                first.move_position_counters(requested, received, self.db)
+        for exit_obj in exits:
+            exit_obj._snapshot()
+        return exits
+
+
+class TradeQuerySet(models.QuerySet):
+    """
+    Querysets for the trade list endpoints, shaped so a page costs the same number of
+    queries whatever its size.
+    """
+
+    def for_listing(self):
+        """
+        What TradeSerializer reads beyond the trade row: the trader and approver, joined.
+        display_name and contract_month come from the catalogue cache, so the availability
+        is not joined.
+        """
+        return self.select_related("trader", "approved_by")
+
+    def with_exits(self):
+        """The trades' exits, newest first, prefetched in one query for TradeWithExitsSerializer."""
+        return self.prefetch_related(Prefetch("exits", queryset=Exit.objects.order_by("-requested_at")))
+
+
 class Commodity(models.Model):
     code = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=100, blank=True)
     description = models.TextField(blank=True, null=True)
+    # Contract specs (see ticks.py)
+    tick_size = models.DecimalField(
+        max_digits=12, decimal_places=4, default=PRICE_TICK, validators=[MinValueValidator(PRICE_TICK)],
+        help_text="Minimum price increment; fill prices must be a multiple of it.",
+    )
+    point_value = models.DecimalField(
+        max_digits=14, decimal_places=4, default=1,
+        help_text="Value of a one point price move for one lot; exit P&L is multiplied by it.",
+    )
 
     def __str__(self):
         return self.code
@@ -20,6 +198,32 @@ class Settlement(models.Model):
     settlement_price = models.DecimalField(max_digits=10, decimal_places=2)
     month = models.CharField(max_length=20)  # E.g. "Jan25"
     year = models.IntegerField()  # E.g. 2025
+    contract_key = models.IntegerField(null=True, editable=False)  # year * 12 + month, kept in sync on save
+    expired_at = models.DateTimeField(null=True, blank=True)  # set when the contract drops out of the matrix CSV
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['commodity', 'month', 'year'], name='unique_settlement_contract'),
+        ]
+        indexes = [
+            models.Index(fields=['commodity', 'contract_key'], name='settlement_contract_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.contract_key = contract_key(self.month, self.year)
+        update_fields = kwargs.get('update_fields')
+        moved = update_fields is None or bool({'month', 'year'} & set(update_fields))
+        if update_fields is not None and moved:
+            kwargs['update_fields'] = set(update_fields) | {'contract_key'}
+        if self._state.adding or not moved:
+            return super().save(*args, **kwargs)
+        # The availabilities this contract is a leg of carry its key too (start_key / end_key)
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            dependents = Availability.objects.using(using)
+            dependents.filter(start_month=self).exclude(start_key=self.contract_key).update(start_key=self.contract_key)
+            dependents.filter(end_month=self).exclude(end_key=self.contract_key).update(end_key=self.contract_key)
 
     def __str__(self):
         return f"{self.commodity.code} - {self.month}{self.year} @ {self.settlement_price}"
@@ -30,13 +234,303 @@ class Availability(models.Model):
     end_month = models.ForeignKey(Settlement, on_delete=models.CASCADE, related_name="end", default=None, null=True)
     settlement_price = models.FloatField(default=0)
     is_available = models.BooleanField()
+    # Set when sync_settlements closed the row because a leg expired; only those rows are re-opened
+    expired_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Denormalized Settlement.contract_key of each leg so range lookups stay on one index
+    start_key = models.IntegerField(null=True, editable=False)
+    end_key = models.IntegerField(null=True, editable=False)
+
+    objects = AvailabilityQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['commodity', 'start_month', 'end_month'], name='unique_availability_spread'),
+            # end_month is NULL for single contract months and NULLs never collide in a plain unique index
+            models.UniqueConstraint(
+                fields=['commodity', 'start_month'],
+                condition=models.Q(end_month__isnull=True),
+                name='unique_availability_single',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['commodity', 'start_key', 'end_key', 'is_available'], name='availability_contract_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.start_key = self.start_month.contract_key if self.start_month_id else None
+        self.end_key = self.end_month.contract_key if self.end_month_id else None
+        super().save(*args, **kwargs)
 
     def __str__(self):
         start_info = f"{self.start_month.month}{self.start_month.year}" if self.start_month else "N/A"
         end_info = f"{self.end_month.month}{self.end_month.year}" if self.end_month else "N/A"
         return f"{self.commodity.code}-({start_info} - {end_info})"
 
-class Trade(models.Model):
+class TrackedFieldsMixin:
+    """
+    Remembers the loaded value of every concrete column (JSON columns excluded: they are
+    edited in place) so signal receivers and views can tell what a save actually changes.
+    The snapshot moves forward after each save, for the columns that save wrote.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loaded_values = {}
+        self._snapshot()
+
+    @classmethod
+    def _tracked_fields(cls):
+        fields = cls.__dict__.get("_tracked_field_list")
+        if fields is None:
+            fields = cls._tracked_field_list = [
+                field for field in cls._meta.concrete_fields
+                if not field.primary_key and not isinstance(field, models.JSONField)
+            ]
+        return fields
+
+    def _snapshot(self, names=None):
+        for field in self._tracked_fields():
+            if (names is None or field.name in names) and field.attname in self.__dict__:
+                self._loaded_values[field.name] = self.__dict__[field.attname]
+
+    def changed_fields(self, update_fields=None):
+        """
+        Names of the tracked columns that differ from their loaded value (all of them for an
+        unsaved instance; a deferred column counts once it is assigned), limited to `update_fields` when one is given.
+        """
+        missing = object()
+        changed = {
+            field.name for field in self._tracked_fields()
+            if self._state.adding
+            or (field.attname in self.__dict__
+                and self.__dict__[field.attname] != self._loaded_values.get(field.name, missing))
+        }
+        if update_fields is not None:
+            changed &= set(update_fields)
+        return changed
+
+    def has_changed(self, *names, update_fields=None):
+        return bool(self.changed_fields(update_fields) & set(names))
+
+    def save_changes(self, *extra_fields):
+        """Write only the changed columns (plus `extra_fields`); no query when nothing changed."""
+        fields = self.changed_fields() | set(extra_fields)
+        if fields:
+            self.save(update_fields=sorted(fields))
+        return fields
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        self._snapshot(None if update_fields is None else set(update_fields))
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot(None if fields is None else set(fields))
+
+
+class VersionConflict(Exception):
+    """A versioned save lost the race: the row moved on since the instance was read."""
+
+    def __init__(self, instance, current_version):
+        super().__init__(
+            f"{instance._meta.verbose_name.capitalize()} {instance.pk} was changed by someone else "
+            f"(now at version {current_version}); reload it and try again."
+        )
+        self.current_version = current_version
+
+
+class VersionedMixin:
+    """
+    Optimistic concurrency on a `version` column. save() of an existing row is a
+    compare-and-swap: UPDATE ... WHERE pk = %s AND version = <version it was read at> with
+    version bumped by one, and VersionConflict (carrying the current version) when another
+    writer got there first. Nothing is locked between read and write.
+    """
+
+    def expect_version(self, version):
+        """Base the next save on `version` (the copy a client edited) instead of the loaded one."""
+        if version in (None, ""):
+            return
+        try:
+            self.version = int(version)
+        except (TypeError, ValueError):
+            raise ValueError("version must be an integer.")
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if self._state.adding or (update_fields is not None and not update_fields):
+            return super().save(*args, **kwargs)
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "version"}
+        self._expected_version = self.version
+        self.version += 1
+        try:
+            super().save(*args, **kwargs)
+        except VersionConflict:
+            self.version = self._expected_version
+            # The UPDATE only matched no row: an enclosing transaction is still usable
+            using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+            if transaction.get_connection(using).in_atomic_block:
+                transaction.set_rollback(False, using=using)
+            raise
+        except BaseException:
+            self.version = self._expected_version
+            raise
+        finally:
+            del self._expected_version
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = getattr(self, "_expected_version", None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if super()._do_update(base_qs.filter(version=expected), using, pk_val, values, update_fields, forced_update):
+            return True
+        current = base_qs.filter(pk=pk_val).values_list("version", flat=True).first()
+        if current is None:
+            # The row is gone: let save() handle it as it would without versioning
+            return False
+        raise VersionConflict(self, current)
+
+
+class ExitLifecycleMixin(TrackedFieldsMixin):
+    """
+    Shared by Exit and SpreadsExit: profit_loss, is_closed and exit_status are derived from
+    the fill columns inside save(), so an exit update is a single write.
+    """
+    # Column holding the lots closed by the exit (Exit misspells it) and the FK to the position
+    lots_field = "recieved_lots"
+    position_field = "trade"
+    # Commodity -> position lookup, for the point value P&L is multiplied by
+    commodity_path = "availability__trades"
+
+    def derived_from(self):
+        return {"exit_price", self.lots_field, "requested_exit_lots", "exit_status", "profit_loss", "is_closed"}
+
+    def point_value(self):
+        return contract_spec(getattr(self, self.position_field).name_id).point_value
+
+    def held_lots(self, loaded=False, update_fields=None):
+        """
+        (requested, received) lots this exit counts for in its position's exit_requested_lots /
+        exit_received_lots: as last saved when `loaded`, otherwise as a save with `update_fields`
+        writes them.
+        """
+        if loaded and self._state.adding:
+            return 0, 0
+
+        def value(name):
+            if loaded or (update_fields is not None and name not in update_fields):
+                return self._loaded_values.get(name, getattr(self, name))
+            return getattr(self, name)
+
+        requested = 0 if value("exit_status") in INACTIVE_EXIT_STATUSES else value("requested_exit_lots") or 0
+        return requested, value(self.lots_field) or 0
+
+    def move_position_counters(self, requested, received, using=None):
+        """Add to the position's exit lot counters: one UPDATE ... SET counter = counter + n."""
+        field = self._meta.get_field(self.position_field)
+        field.related_model._base_manager.using(using).filter(pk=getattr(self, field.attname)).update(
+            exit_requested_lots=F("exit_requested_lots") + requested,
+            exit_received_lots=F("exit_received_lots") + received,
+        )
+
+    def check_position_capacity(self, requested, using=None):
+        """
+        Lock the position row for the rest of the transaction and raise ValueError unless it has
+        `requested` more lots left to exit (remaining_lots).
+        """
+        field = self._meta.get_field(self.position_field)
+        position = field.related_model._base_manager.using(using).select_for_update().get(
+            pk=getattr(self, field.attname)
+        )
+        if requested > position.remaining_lots:
+            raise ValueError(
+                f"Requested exits ({requested} lots) exceed the {self.position_field}'s remaining lots "
+                f"({position.remaining_lots})."
+            )
+
+    def derives_on_save(self, update_fields=None):
+        return self._state.adding or bool(self.changed_fields(update_fields) & self.derived_from())
+
+    def realized_profit_loss(self, received):
+        """
+        (exit_price - position avg_price) * received lots * point value; the current value
+        until the exit has a price and lots.
+        """
+        if self.exit_price is None or received is None or received <= 0:
+            return self.profit_loss
+        entry_price = Decimal(getattr(self, self.position_field).avg_price)
+        return (Decimal(self.exit_price) - entry_price) * received * self.point_value()
+
+    def derive_exit_state(self):
+        """
+        - profit_loss from realized_profit_loss(), once lots are received.
+        - is_closed when every requested lot is received.
+        - exit_status follows received vs requested lots.
+        Returns the names of the columns it changed.
+        """
+        received = getattr(self, self.lots_field)
+        changed = set()
+        # 1) P&L
+        profit_loss = self.realized_profit_loss(received)
+        if self.profit_loss != profit_loss:
+            self.profit_loss = profit_loss
+            changed.add("profit_loss")
+
+        # 2) is_closed flag (for the exit, not the position)
+        is_closed = received == self.requested_exit_lots and received > 0
+        if self.is_closed != is_closed:
+            self.is_closed = is_closed
+            changed.add("is_closed")
+
+        # 3) status transitions
+        new_status = self.exit_status
+        if received == self.requested_exit_lots and received > 0:
+            new_status = "filled"
+        elif 0 < (received or 0) < (self.requested_exit_lots or 0):
+            new_status = "partial_filled"
+        elif (received or 0) == 0 and self.exit_status in ["filled", "partial_filled"]:
+            # fills taken back: the order is still working
+            new_status = "order_placed"
+        if new_status != self.exit_status:
+            self.exit_status = new_status
+            changed.add("exit_status")
+        return changed
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if self.derives_on_save(update_fields):
+            derived = self.derive_exit_state()
+            if update_fields is not None and derived:
+                kwargs["update_fields"] = set(update_fields) | derived
+        before = self.held_lots(loaded=True)
+        after = self.held_lots(update_fields=kwargs.get("update_fields"))
+        if before == after:
+            return super().save(*args, **kwargs)
+        # The position's counters move in the exit's transaction. New requests are capped when
+        # they are created; an existing exit that requests more (re-activated after a rejection
+        # or cancellation, or its lots raised) is checked here, in a savepoint so that a caller's
+        # transaction survives the ValueError.
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        grows = not self._state.adding and after[0] > before[0]
+        with transaction.atomic(using=using, savepoint=grows):
+            if grows:
+                self.check_position_capacity(after[0] - before[0], using)
+            super().save(*args, **kwargs)
+            self.move_position_counters(after[0] - before[0], after[1] - before[1], using)
+
+    def delete(self, using=None, keep_parents=False):
+        requested, received = self.held_lots(loaded=True)
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            deleted = super().delete(using=using, keep_parents=keep_parents)
+            if requested or received:
+                self.move_position_counters(-requested, -received, using)
+        return deleted
+
+
+class Trade(VersionedMixin, TrackedFieldsMixin, models.Model):
     TRADE_OPTIONS = [('long', 'Long'), ('short', 'Short')]
     APPROVAL_STATUSES = [
         ('pending', 'Pending'), 
@@ -63,10 +557,27 @@ class Trade(models.Model):
     ratio = models.DecimalField(max_digits=10, decimal_places=2, default=100.00)
     avg_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_lots = models.IntegerField(default=0)
+    # Running sum of lots x price over all fills; avg_price = fill_notional / total_lots
+    fill_notional = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    # How exits are priced: against avg_price, or slice by slice against the fills (see matching.py)
+    lot_matching = models.CharField(max_length=10, choices=LOT_MATCHING_METHODS, default=AVERAGE_COST)
+    # Lots requested by exits (rejected / cancelled ones excluded) and received by them. Moved with
+    # F() in the exit write's transaction (ExitLifecycleMixin), so trades are saved with update_fields.
+    exit_requested_lots = models.IntegerField(default=0, editable=False)
+    exit_received_lots = models.IntegerField(default=0, editable=False)
+    # Bumped by every save; updates are conditional on it (see VersionedMixin)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = TradeQuerySet.as_manager()
 
     def __str__(self):
         return f"Trade {self.id} - {self.name} ({self.trade_type})"
 
+    @property
+    def remaining_lots(self):
+        """Filled lots no exit has requested yet: the cap on new exit requests."""
+        return self.total_lots - self.exit_requested_lots
+
     def clean(self):
         if not isinstance(self.lots_and_price, list):
             raise ValidationError("lots_and_price must be a list of dicts.")
@@ -93,14 +604,9 @@ class Trade(models.Model):
         if self.trade_type == "short" and stop_loss <= price:
             raise ValidationError("For SHORT trades, stop_loss must be higher than entry price.")
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        
-        # self._original_fills_recivied_for = self.fills_recivied_for
-
 
 
-class Exit(models.Model):
+class Exit(VersionedMixin, ExitLifecycleMixin, models.Model):
     EXIT_STATUSES = [
         ('pending', 'Pending Approval'),
         ('approved', 'Approved'),
@@ -183,6 +689,9 @@ class Exit(models.Model):
     )
     
     is_closed = models.BooleanField(default=False, help_text="When all the lots are receieved.")
+    version = models.PositiveIntegerField(default=1, editable=False, help_text="Bumped by every save.")
+
+    objects = ExitQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Trade Exit"
@@ -194,3 +703,94 @@ class Exit(models.Model):
             f"Exit for Trade {self.trade.id} ({self.trade.name}) - "
             f"{self.requested_exit_lots} lots requested at {self.exit_price or 'N/A'}"
         )
+
+    def realized_profit_loss(self, received):
+        # save() and apply_fill_batch set a LotBook on exits of FIFO / LIFO trades
+        book = self.__dict__.get("_lot_book")
+        if book is None:
+            return super().realized_profit_loss(received)
+        return book.match(self)
+
+    def save(self, *args, **kwargs):
+        """
+        Exits of FIFO / LIFO trades match their received lots against the trade's open lots;
+        the slices are written with the exit, in one transaction.
+        """
+        if not self.derives_on_save(kwargs.get("update_fields")) or self.trade.lot_matching == AVERAGE_COST:
+            return super().save(*args, **kwargs)
+        # Imported here because matching.py imports this module
+        from .matching import LotBook
+
+        with transaction.atomic(using=kwargs.get("using") or router.db_for_write(Exit, instance=self)):
+            self._lot_book = LotBook([self])
+            try:
+                super().save(*args, **kwargs)
+                self._lot_book.save()
+            finally:
+                del self._lot_book
+
+
+class TradeEntry(models.Model):
+    """
+    One element of Trade.lots_and_price: an order for `lots` at `price`. Keys of the JSON
+    entry that have no column here are kept in `extra` so the entry serializes back unchanged.
+    """
+    trade = models.ForeignKey(Trade, on_delete=models.CASCADE, related_name="entries")
+    position = models.PositiveIntegerField(help_text="Index of this entry in lots_and_price.")
+    lots = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=14, decimal_places=4)
+    stop_loss = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
+    added_at = models.CharField(max_length=40, blank=True, help_text="added_at exactly as the client sent it.")
+    extra = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ["trade", "position"]
+        constraints = [
+            models.UniqueConstraint(fields=["trade", "position"], name="unique_trade_entry_position"),
+        ]
+
+    def __str__(self):
+        return f"Trade {self.trade_id} entry {self.position}: {self.lots} @ {self.price}"
+
+
+class Fill(models.Model):
+    """
+    One element of an entry's fills_received list. Commodity is copied from the trade so
+    fill reporting by commodity and day is a single index range scan.
+    """
+    entry = models.ForeignKey(TradeEntry, on_delete=models.CASCADE, related_name="fills")
+    trade = models.ForeignKey(Trade, on_delete=models.CASCADE, related_name="fills")
+    commodity = models.ForeignKey(Commodity, on_delete=models.CASCADE, related_name="fills")
+    position = models.PositiveIntegerField(help_text="Index of this fill in the entry's fills_received.")
+    lots = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=14, decimal_places=4)
+    filled_at = models.DateTimeField(default=timezone.now)
+    open_lots = models.PositiveIntegerField(default=0, help_text="Lots no exit has matched yet (FIFO / LIFO trades).")
+
+    objects = FillQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["entry_id", "position"]
+        indexes = [
+            models.Index(fields=["commodity", "filled_at"], name="fill_commodity_idx"),
+        ]
+
+    def __str__(self):
+        return f"Fill {self.lots} @ {self.price} on trade {self.trade_id}"
+
+
+class LotMatch(models.Model):
+    """`lots` of a fill closed by an exit of a FIFO / LIFO trade, and the P&L they realized."""
+    exit = models.ForeignKey(Exit, on_delete=models.CASCADE, related_name="matches")
+    fill = models.ForeignKey(Fill, on_delete=models.CASCADE, related_name="matches")
+    lots = models.PositiveIntegerField()
+    profit_loss = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, blank=True,
+        help_text="(exit price - fill price) x lots x point value; empty until the exit has a price.",
+    )
+
+    class Meta:
+        ordering = ["exit_id", "id"]
+
+    def __str__(self):
+        return f"Exit {self.exit_id}: {self.lots} lots of fill {self.fill_id}"
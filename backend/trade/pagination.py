@@ -0,0 +1,186 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Pages are addressed by the sort key of the last row already returned rather than by an
+OFFSET, so page 500 costs the same index range scan as page 1. Cursors are opaque,
+URL-safe base64 encoded JSON lists holding that sort key.
+
+list_response gives the trade and spread list endpoints opt-in keyset pages and a streaming
+mode, for histories too long to build as one response in memory, and ?fields= (projection.py).
+"""
+import base64
+import datetime
+import itertools
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+from .projection import Projection, requested_fields
+
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 500
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":"), cls=DjangoJSONEncoder).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, ordering, model=None):
+    """
+    Decode a cursor produced by encode_cursor for `ordering`; with `model`, each value is also
+    converted to the type of its ordering field. Raises ValidationError if it is malformed.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValidationError({"cursor": "Invalid cursor."})
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise ValidationError({"cursor": "Invalid cursor."})
+    if model is None:
+        return values
+    converted = []
+    for (field, _, nullable), value in zip(ordering, values):
+        if value is None and nullable:
+            converted.append(None)
+            continue
+        if value is None or isinstance(value, (bool, list, dict)):
+            raise ValidationError({"cursor": "Invalid cursor."})
+        try:
+            converted.append(model._meta.get_field(field).to_python(value))
+        except (DjangoValidationError, TypeError, ValueError):
+            raise ValidationError({"cursor": "Invalid cursor."})
+    return converted
+
+
+def keyset_filter(ordering, values):
+    """
+    Q selecting rows strictly after `values` for `ordering`, a list of (field, descending, nullable)
+    tuples. Nullable fields are expected to be ordered NULLS LAST in both directions.
+
+    For (a, b, c) this expands to a > A | (a = A & b > B) | (a = A & b = B & c > C), which
+    PostgreSQL answers with a range scan on a matching composite index.
+    """
+    condition = Q(pk__in=[])
+    equal = Q()
+    for (field, descending, nullable), value in zip(ordering, values):
+        if value is None:
+            # Nothing sorts after NULL when nulls are last
+            after = Q(pk__in=[])
+            same = Q(**{f"{field}__isnull": True})
+        else:
+            after = Q(**{f"{field}__{'lt' if descending else 'gt'}": value})
+            if nullable:
+                after |= Q(**{f"{field}__isnull": True})
+            same = Q(**{field: value})
+        condition |= equal & after
+        equal &= same
+    return condition
+
+
+def order_by_keyset(queryset, ordering):
+    """Apply `ordering` ((field, descending, nullable) tuples) to a queryset, NULLS LAST."""
+    expressions = []
+    for field, descending, nullable in ordering:
+        expression = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+        expressions.append(expression if nullable else (f"-{field}" if descending else field))
+    return queryset.order_by(*expressions)
+
+
+def estimate_count(queryset):
+    """
+    Cheap row count for a filtered queryset.
+    On PostgreSQL this is the planner's estimate from EXPLAIN, which never touches the rows;
+    other backends fall back to an exact COUNT(*).
+    """
+    if connection.vendor != "postgresql":
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    if isinstance(plan, list):
+        plan = plan[0]
+    return int(plan["Plan"]["Plan Rows"])
+
+
+def cursor_key(obj, ordering):
+    """
+    The sort key of a row for `ordering`. Datetimes are kept to the microsecond (DjangoJSONEncoder
+    would cut them to milliseconds, and the next page would repeat or skip rows).
+    """
+    values = [obj[field] if isinstance(obj, dict) else getattr(obj, field) for field, _, _ in ordering]
+    return [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+
+
+def stream_rows(rows, render, chunk_size):
+    """A JSON array of the rendered rows, written one chunk of `chunk_size` rows at a time."""
+    encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    separator = ""
+    yield "["
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        yield separator + ",".join(encoder.encode(row) for row in render(chunk))
+        separator = ","
+    yield "]"
+
+
+def list_response(request, queryset, serializer_class, ordering):
+    """
+    Response for a list endpoint. Every mode lists in `ordering` ((field, descending, nullable)
+    tuples ending with a unique field), NULLS LAST, so the rows come in the same order
+    whichever mode is asked for:
+
+      default                  every row in one JSON array, as before
+      ?page_size= / ?cursor=   one keyset page: {"next": url, "results": [...]}
+      ?stream=1                every row (after ?cursor=, if given), as a JSON array
+                               streamed from .iterator(chunk_size=STREAM_CHUNK_SIZE), so memory per
+                               request stays bounded whatever the history holds
+
+    Any mode takes ?fields=a,b,c to return only those fields, from a .values() projection when
+    they allow one (see projection.py). Raises ValidationError on malformed page_size, cursor
+    or fields.
+    """
+    params = request.query_params
+    context = {"request": request}
+    fields = requested_fields(params, serializer_class)
+    projection = Projection.build(serializer_class, fields) if fields else None
+    if projection is not None:
+        render = projection.render
+        source = lambda queryset: projection.values(queryset, extra=[field for field, _, _ in ordering])
+    else:
+        context["fields"] = fields
+        render = lambda rows: serializer_class(rows, many=True, context=context).data
+        source = lambda queryset: queryset
+
+    stream = params.get("stream", "").lower() in ("1", "true", "yes")
+    if not stream and "page_size" not in params and "cursor" not in params:
+        return Response(render(source(order_by_keyset(queryset, ordering))))
+
+    if params.get("cursor"):
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(params["cursor"], ordering, queryset.model)))
+    queryset = order_by_keyset(queryset, ordering)
+    if stream:
+        rows = source(queryset).iterator(chunk_size=STREAM_CHUNK_SIZE)
+        return StreamingHttpResponse(stream_rows(rows, render, STREAM_CHUNK_SIZE), content_type="application/json")
+
+    try:
+        page_size = min(int(params.get("page_size", LIST_PAGE_SIZE)), LIST_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValidationError({"page_size": "page_size must be an integer."})
+    if page_size < 1:
+        raise ValidationError({"page_size": "page_size must be positive."})
+    rows = list(source(queryset)[:page_size + 1])
+    next_url = None
+    if len(rows) > page_size:
+        next_url = replace_query_param(request.build_absolute_uri(), "cursor", encode_cursor(cursor_key(rows[page_size - 1], ordering)))
+    return Response({
+        "next": next_url,
+        "results": render(rows[:page_size]),
+    })
@@ -0,0 +1,122 @@
+"""
+Availability pricing derived from the settlement curve.
+
+A single contract month is priced at its settlement; a calendar spread at start minus end.
+Each commodity's curve is loaded into a NumPy vector once and every dependent Availability
+price is computed from it with array indexing, so a full refresh costs two SELECTs plus
+batched UPDATEs for only the rows whose price actually moved.
+"""
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .cache import catalogue_cache
+from .curves import spread_prices, to_cents
+from .models import Availability, Settlement
+
+BATCH_SIZE = 5000
+
+
+def load_curves(commodity_ids=None):
+    """
+    {commodity_id: (settlement_ids, cents)} with both arrays in contract order (see curves.py).
+    Expired contracts are kept so spreads that still reference them price consistently.
+    """
+    qs = Settlement.objects.order_by("commodity_id", "contract_key", "id")
+    if commodity_ids is not None:
+        qs = qs.filter(commodity_id__in=commodity_ids)
+    rows = list(qs.values_list("commodity_id", "id", "settlement_price"))
+    if not rows:
+        return {}
+
+    commodity_col = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    cents = to_cents(r[2] for r in rows)
+
+    # Rows are grouped by commodity, so each curve is a contiguous slice
+    starts = np.flatnonzero(np.r_[True, commodity_col[1:] != commodity_col[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+    return {int(commodity_col[a]): (ids[a:b], cents[a:b]) for a, b in zip(starts, ends)}
+
+
+def refresh_spread_prices(commodity_ids=None, settlement_ids=None, batch_size=BATCH_SIZE):
+    """
+    Recompute Availability.settlement_price from the settlement curves and write back only
+    the rows that changed. Limit the work with `commodity_ids`, and further to availabilities
+    with a leg in `settlement_ids`. Returns the number of availabilities updated.
+    """
+    curves = load_curves(commodity_ids)
+    if not curves:
+        return 0
+
+    qs = Availability.objects.filter(commodity_id__in=list(curves))
+    if settlement_ids is not None:
+        qs = qs.filter(Q(start_month_id__in=settlement_ids) | Q(end_month_id__in=settlement_ids))
+    rows = list(qs.order_by("commodity_id").values_list(
+        "commodity_id", "id", "start_month_id", "end_month_id", "settlement_price"
+    ))
+    if not rows:
+        return 0
+
+    count = len(rows)
+    commodity_col = np.fromiter((r[0] for r in rows), dtype=np.int64, count=count)
+    ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=count)
+    start_ids = np.fromiter((r[2] for r in rows), dtype=np.int64, count=count)
+    end_ids = np.fromiter((r[3] or 0 for r in rows), dtype=np.int64, count=count)
+    current = np.fromiter((r[4] for r in rows), dtype=np.float64, count=count)
+
+    prices = np.empty(count, dtype=np.float64)
+    starts = np.flatnonzero(np.r_[True, commodity_col[1:] != commodity_col[:-1]])
+    for a, b in zip(starts, np.r_[starts[1:], count]):
+        curve_ids, curve = curves[int(commodity_col[a])]
+        prices[a:b] = spread_prices(curve_ids, curve, start_ids[a:b], end_ids[a:b])
+
+    moved = np.flatnonzero(prices != current)
+    if len(moved):
+        write_prices(ids[moved].tolist(), prices[moved].tolist(), batch_size)
+        # Neither write path sends signals
+        catalogue_cache.invalidate_on_commit()
+    return len(moved)
+
+
+def write_prices(ids, prices, batch_size=BATCH_SIZE):
+    """
+    Set Availability.settlement_price for parallel lists of ids and prices.
+
+    On PostgreSQL each batch is one UPDATE joined against unnest()ed arrays; other backends
+    (SQLite in development) get a prepared UPDATE through executemany. Both avoid
+    bulk_update's CASE WHEN expression, which Django builds and the database evaluates per row.
+    """
+    table = connection.ops.quote_name(Availability._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor != "postgresql":
+            cursor.executemany(f"UPDATE {table} SET settlement_price = %s WHERE id = %s", list(zip(prices, ids)))
+            return
+        for offset in range(0, len(ids), batch_size):
+            cursor.execute(
+                f"""
+                UPDATE {table} AS a
+                   SET settlement_price = v.price
+                  FROM unnest(%s::bigint[], %s::double precision[]) AS v(id, price)
+                 WHERE a.id = v.id
+                """,
+                [ids[offset:offset + batch_size], prices[offset:offset + batch_size]],
+            )
+
+
+def refresh_spread_prices_rowwise(commodity_ids=None):
+    """Per-row reference implementation, kept for the benchmark and for verifying the vectorized path."""
+    qs = Availability.objects.select_related("start_month", "end_month")
+    if commodity_ids is not None:
+        qs = qs.filter(commodity_id__in=commodity_ids)
+    updated = 0
+    with transaction.atomic():
+        for availability in qs:
+            price = availability.start_month.settlement_price
+            if availability.end_month is not None:
+                price -= availability.end_month.settlement_price
+            if availability.settlement_price != float(price):
+                availability.settlement_price = float(price)
+                availability.save(update_fields=["settlement_price"])
+                updated += 1
+    return updated
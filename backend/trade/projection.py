@@ -0,0 +1,136 @@
+"""
+Sparse fieldsets and the projection read path of the list endpoints.
+
+A ?fields=a,b,c request gets only those keys in each row. When every requested field is a
+column of the row or of a row it points to, a choice's display value, or a method field its
+serializer can derive in bulk (`derived_columns` / `derive`), the rows are built as dicts
+from one .values() query: no model instances and no field-by-field serializer pass, each
+value still formatted by the serializer field that would have produced it. Otherwise (nested
+serializers, say) the serializer runs with the other fields dropped (SparseFieldsMixin).
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+class SparseFieldsMixin:
+    """Drops the fields a ?fields= request (context['fields']) did not ask for."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def requested_fields(params, serializer_class):
+    """The ?fields= list, or None when absent; raises ValidationError naming unknown fields."""
+    if not params.get('fields'):
+        return None
+    fields = list(dict.fromkeys(name.strip() for name in params['fields'].split(',') if name.strip()))
+    readable = {name for name, field in serializer_class().fields.items() if not field.write_only}
+    unknown = [name for name in fields if name not in readable]
+    if unknown:
+        raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}."})
+    return fields
+
+
+def model_path(model, attrs):
+    """The .values() path of a field source (['trader', 'username'] -> 'trader__username'), or None."""
+    if len(attrs) not in (1, 2):
+        return None
+    try:
+        field = model._meta.get_field(attrs[0])
+    except FieldDoesNotExist:
+        return None
+    if not field.concrete or field.many_to_many:
+        return None
+    if len(attrs) == 2:
+        if not field.many_to_one:
+            return None
+        try:
+            related = field.related_model._meta.get_field(attrs[1])
+        except FieldDoesNotExist:
+            return None
+        if not related.concrete or related.is_relation:
+            return None
+    return '__'.join(attrs)
+
+
+class Projection:
+    """
+    How to build the rows of `fields` from .values(): per field its path and either a
+    converter (the serializer field's to_representation, a choice display, a pk as is) or the
+    serializer's bulk `derive`. Use Projection.build, which returns None when any field cannot
+    be projected.
+    """
+
+    def __init__(self, serializer_class, fields, columns, derived):
+        self.serializer_class = serializer_class
+        self.fields = fields
+        self.columns = columns
+        self.derived = derived
+
+    @classmethod
+    def build(cls, serializer_class, fields):
+        model = serializer_class.Meta.model
+        serializer_fields = serializer_class().fields
+        derived_columns = getattr(serializer_class, 'derived_columns', {})
+        columns, derived = {}, {}
+        for name in fields:
+            field = serializer_fields[name]
+            if isinstance(field, serializers.SerializerMethodField):
+                if name not in derived_columns:
+                    return None
+                derived[name] = derived_columns[name]
+                continue
+            if isinstance(field, (serializers.BaseSerializer, serializers.ManyRelatedField)):
+                return None
+            attrs = field.source_attrs
+            if len(attrs) == 1 and attrs[0].startswith('get_') and attrs[0].endswith('_display'):
+                path = model_path(model, [attrs[0][4:-8]])
+                if path is None:
+                    return None
+                choices = dict(model._meta.get_field(path).flatchoices)
+                columns[name] = (path, lambda value, choices=choices: choices.get(value, value), None)
+                continue
+            path = model_path(model, attrs)
+            if path is None:
+                return None
+            if isinstance(field, serializers.RelatedField):
+                convert = None
+            else:
+                convert = field.to_representation
+            # The serializer leaves a key out when a row it reads through is missing
+            via = attrs[0] if len(attrs) == 2 else None
+            columns[name] = (path, convert, via)
+        return cls(serializer_class, fields, columns, derived)
+
+    def values(self, queryset, extra=()):
+        """The .values() queryset of the projection, with `extra` columns (a cursor's sort key) too."""
+        paths = {path for path, _, _ in self.columns.values()} | {via for _, _, via in self.columns.values() if via}
+        paths |= set(self.derived.values()) | set(extra)
+        return queryset.prefetch_related(None).values(*paths)
+
+    def render(self, rows):
+        """The output dicts of .values() rows, derived fields filled one column at a time."""
+        rows = list(rows)
+        derived = {
+            name: self.serializer_class.derive(name, [row[path] for row in rows])
+            for name, path in self.derived.items()
+        }
+        output = []
+        for index, row in enumerate(rows):
+            item = {}
+            for name in self.fields:
+                if name in derived:
+                    item[name] = derived[name][index]
+                    continue
+                path, convert, via = self.columns[name]
+                if via is not None and row[via] is None:
+                    continue
+                value = row[path]
+                item[name] = value if value is None or convert is None else convert(value)
+            output.append(item)
+        return output
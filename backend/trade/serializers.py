@@ -1,12 +1,46 @@
 from rest_framework import serializers
-from django.db.models import Sum
 from django.contrib.auth import get_user_model
 
-from .models import Trade, Exit, Availability
+from .models import Trade, Exit, Availability, Settlement
+from .availability import parse_virtual_id, resolve_availability, store_availability
+from .cache import catalogue_cache
+from .fills import save_entries
+from .projection import SparseFieldsMixin
+from .ticks import check_tick, contract_spec
 
 User = get_user_model()
 
 
+class AvailabilityField(serializers.PrimaryKeyRelatedField):
+    """
+    Availability FK that also accepts virtual spread ids ("v<start>-<end>").
+    Validation only resolves a virtual id; a spread that is not stored yet comes back unsaved
+    and the serializer's save() creates its row (StoredAvailabilityMixin), so a rejected
+    request writes nothing.
+    """
+
+    def to_internal_value(self, data):
+        spread = parse_virtual_id(data)
+        if spread is None:
+            return super().to_internal_value(data)
+        try:
+            return resolve_availability(*spread)
+        except Settlement.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+
+class StoredAvailabilityMixin:
+    """Stores the unsaved Availability an AvailabilityField resolved before the object is saved."""
+
+    def save(self, **kwargs):
+        availability = self.validated_data.get('name')
+        if availability is not None and availability.pk is None:
+            self.validated_data['name'] = store_availability(availability)
+        return super().save(**kwargs)
+
+
 class AvailabilitySerializer(serializers.ModelSerializer):
     commodity_code = serializers.CharField(source='commodity.code', read_only=True)
     commodity_name = serializers.CharField(source='commodity.name', read_only=True)
@@ -32,7 +66,8 @@ class AvailabilitySerializer(serializers.ModelSerializer):
         return "N/A"
 
 
-class TradeSerializer(serializers.ModelSerializer):
+class TradeSerializer(SparseFieldsMixin, StoredAvailabilityMixin, serializers.ModelSerializer):
+    name = AvailabilityField(queryset=Availability.objects.all())
     trader_username = serializers.CharField(source='trader.username', read_only=True)
     approved_by_username = serializers.CharField(source='approved_by.username', read_only=True)
     display_name = serializers.SerializerMethodField()
@@ -60,6 +95,8 @@ class TradeSerializer(serializers.ModelSerializer):
             'ratio',
             'avg_price',
             'total_lots',
+            'lot_matching',
+            'version',
 
             # convenience fields
             'trader_username',
@@ -77,28 +114,62 @@ class TradeSerializer(serializers.ModelSerializer):
             'close_requested_at',
             'avg_price',
             'total_lots',
+            'version',
             'trader_username',
             'approved_by_username',
             'display_name',
             'contract_month',
         ]
 
+    # Method fields the ?fields= projection derives in bulk (see derive), from these columns
+    derived_columns = {'display_name': 'name', 'contract_month': 'name'}
+
     def get_display_name(self, obj):
+        display_name = catalogue_cache.get().display_name(obj.name_id)
+        if display_name is not None:
+            return display_name
+        catalogue_cache.record_fallback()
+        return self.fallback_display_name(obj.name)
+
+    def get_contract_month(self, obj):
+        contract_month = catalogue_cache.get().contract_month(obj.name_id)
+        if contract_month is not None:
+            return contract_month
+        catalogue_cache.record_fallback()
+        return self.fallback_contract_month(obj.name)
+
+    @staticmethod
+    def fallback_display_name(availability):
         try:
-            return f"{obj.name.commodity.code}"
+            return f"{availability.commodity.code}"
         except Exception:
             return "N/A"
 
-    def get_contract_month(self, obj):
+    @staticmethod
+    def fallback_contract_month(availability):
         try:
-            if obj.name and obj.name.start_month and obj.name.end_month:
-                s = obj.name.start_month
-                e = obj.name.end_month
+            if availability and availability.start_month and availability.end_month:
+                s = availability.start_month
+                e = availability.end_month
                 return f"{s.month}{s.year}-{e.month}{e.year}"
         except Exception:
             pass
         return "N/A"
 
+    @classmethod
+    def derive(cls, field_name, availability_ids):
+        """display_name or contract_month for a column of availability ids: the catalogue, then one query for any it misses."""
+        catalogue = catalogue_cache.get()
+        lookup = catalogue.display_name if field_name == 'display_name' else catalogue.contract_month
+        values = [lookup(pk) for pk in availability_ids]
+        missing = {pk for pk, value in zip(availability_ids, values) if value is None}
+        if missing:
+            catalogue_cache.record_fallback()
+            fallback = cls.fallback_display_name if field_name == 'display_name' else cls.fallback_contract_month
+            rows = Availability.objects.select_related('commodity', 'start_month', 'end_month').in_bulk(missing)
+            values = [fallback(rows.get(pk)) if value is None else value for pk, value in zip(availability_ids, values)]
+        return values
+
     def validate_lots_and_price(self, value):
         if not isinstance(value, list):
             raise serializers.ValidationError("lots_and_price must be a list of dicts.")
@@ -172,11 +243,75 @@ class TradeSerializer(serializers.ModelSerializer):
         
         return value
 
-
+    def validate(self, data):
+        # Prices must sit on the commodity's tick, which is only known once the availability is resolved
+        entries = data.get('lots_and_price')
+        availability = data.get('name')
+        if availability is not None and availability.pk is None:
+            # A virtual spread that is not stored yet: read the tick off its commodity
+            tick_size = availability.commodity.tick_size
+        else:
+            availability_id = availability.pk if availability else getattr(self.instance, 'name_id', None)
+            tick_size = contract_spec(availability_id).tick_size if entries and availability_id else None
+        if entries and tick_size:
+            for idx, entry in enumerate(entries):
+                try:
+                    check_tick(entry["price"], tick_size)
+                except ValueError as e:
+                    raise serializers.ValidationError({'lots_and_price': f"Entry {idx}: {e}"})
+                for fill_idx, fill in enumerate(entry["fills_received"]):
+                    try:
+                        check_tick(fill["price"], tick_size)
+                    except ValueError as e:
+                        raise serializers.ValidationError({'lots_and_price': f"Entry {idx}, Fill {fill_idx}: {e}"})
+        return data
 
     def create(self, validated_data):
         validated_data['trader'] = self.context['request'].user
-        return super().create(validated_data)
+        entries = validated_data.pop('lots_and_price', [])
+        return save_entries(Trade(**validated_data), entries)
+
+    def update(self, instance, validated_data):
+        entries = validated_data.pop('lots_and_price', None)
+        instance = super().update(instance, validated_data)
+        if entries is not None:
+            save_entries(instance, entries)
+        return instance
+
+
+class FillInputSerializer(serializers.Serializer):
+    lots = serializers.IntegerField(min_value=1)
+    price = serializers.FloatField(min_value=0)
+
+
+class AppendFillsSerializer(serializers.Serializer):
+    entry = serializers.IntegerField(min_value=0, help_text="Index of the lots_and_price entry being filled.")
+    fills = FillInputSerializer(many=True, allow_empty=False)
+
+
+class BatchTradeFillsSerializer(AppendFillsSerializer):
+    trade = serializers.IntegerField(min_value=1)
+
+
+class BatchExitFillSerializer(serializers.Serializer):
+    exit = serializers.IntegerField(min_value=1)
+    recieved_lots = serializers.IntegerField(min_value=0)
+    exit_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+
+class BatchFillsSerializer(serializers.Serializer):
+    MAX_ITEMS = 5000
+
+    trades = BatchTradeFillsSerializer(many=True, required=False, default=list)
+    exits = BatchExitFillSerializer(many=True, required=False, default=list)
+
+    def validate(self, data):
+        items = len(data['trades']) + len(data['exits'])
+        if not items:
+            raise serializers.ValidationError("Nothing to apply: send 'trades' and/or 'exits'.")
+        if items > self.MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {self.MAX_ITEMS} items per batch.")
+        return data
 
 
 class ExitSerializer(serializers.ModelSerializer):
@@ -201,6 +336,7 @@ class ExitSerializer(serializers.ModelSerializer):
             'order_placed_at',
             'filled_at',
             'is_closed',
+            'version',
             'exit_initiated_by_username',
             'exit_approved_by_username',
         ]
@@ -212,6 +348,7 @@ class ExitSerializer(serializers.ModelSerializer):
             'approved_at',
             'order_placed_at',
             'filled_at',
+            'version',
         ]
 
     def validate(self, data):
@@ -222,9 +359,13 @@ class ExitSerializer(serializers.ModelSerializer):
         if trade is None:
             raise serializers.ValidationError("Trade is required.")
 
-        # Cannot request more than trade total_lots (computed)
-        if requested is not None and trade.total_lots is not None and requested > trade.total_lots:
-            raise serializers.ValidationError("Requested exit lots cannot exceed trade total lots.")
+        # Cannot request more than the lots other exits have not requested yet
+        if requested is not None:
+            available = trade.remaining_lots + (self.instance.held_lots(loaded=True)[0] if self.instance else 0)
+            if requested > available:
+                raise serializers.ValidationError(
+                    f"Requested exit lots cannot exceed the trade's remaining lots ({available})."
+                )
 
         if received is not None and requested is not None and received > requested:
             raise serializers.ValidationError("Received lots cannot exceed requested lots.")
@@ -232,12 +373,20 @@ class ExitSerializer(serializers.ModelSerializer):
         return data
 
 
+class ExitRequestSerializer(serializers.ModelSerializer):
+    """One item of a create_exit request; the trade and the initiator come from the request itself."""
+
+    class Meta:
+        model = Exit
+        fields = ['requested_exit_lots', 'exit_price']
+
+
 class NestedExitSerializer(serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_exit_status_display', read_only=True)
 
     class Meta:
         model = Exit
-        fields = ['id', 'requested_exit_lots', 'exit_price', 'recieved_lots', 'status_display', 'requested_at']
+        fields = ['id', 'requested_exit_lots', 'exit_price', 'recieved_lots', 'status_display', 'requested_at', 'version']
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -257,8 +406,8 @@ class NestedExitSerializer(serializers.ModelSerializer):
         return representation
 
 
-class TradeWithExitsSerializer(serializers.ModelSerializer):
-    # Sum recieved_lots from all related exits
+class TradeWithExitsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Lots received by all the trade's exits, out of its total
     recieved_lots_total_lots = serializers.SerializerMethodField()
     # Use correct related_name 'exits'
     applied_exits = NestedExitSerializer(source='exits', many=True, read_only=True)
@@ -268,9 +417,7 @@ class TradeWithExitsSerializer(serializers.ModelSerializer):
         fields = ['id', 'created_at', 'total_lots', 'recieved_lots_total_lots', 'applied_exits']
 
     def get_recieved_lots_total_lots(self, obj):
-        recieved_lots = obj.exits.aggregate(total_recieved_lots=Sum('recieved_lots'))['total_recieved_lots'] or 0
-        total_lots = obj.total_lots or 0
-        return f"{recieved_lots}/{total_lots}"
+        return f"{obj.exit_received_lots}/{obj.total_lots or 0}"
 
 class TradeExitDetailSerializer(serializers.ModelSerializer):
     class Meta:
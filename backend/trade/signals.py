@@ -1,105 +1,37 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from decimal import Decimal
 
-from .models import Trade, Exit
+from .cache import catalogue_cache
+from .models import AVERAGE_COST, Availability, Commodity, Settlement, Trade
+from .pricing import refresh_spread_prices
 
 
-from decimal import Decimal
-from django.db.models.signals import pre_save
-from django.dispatch import receiver
-
-@receiver(pre_save, sender=Trade)
-def update_trade_stats(sender, instance: Trade, **kwargs):
-    """
-    Compute:
-      - total_lots = sum of fills_received lots across all entries
-      - avg_price = weighted average by fills_received lots and their prices
-    If there are no fills, avg_price=0 and total_lots=0.
-    """
-    entries = instance.lots_and_price or []
-    total_fills = 0
-    weighted_sum = Decimal('0')
+@receiver([post_save, post_delete], sender=Commodity)
+@receiver([post_save, post_delete], sender=Settlement)
+@receiver([post_save, post_delete], sender=Availability)
+def invalidate_catalogue_cache(sender, **kwargs):
+    """Drop the in-memory catalogue once the write that changed it has committed."""
+    catalogue_cache.invalidate_on_commit()
 
-    for entry in entries:
-        # fills_received is now a list of {lots: X, price: Y} objects
-        fills_received = entry.get("fills_received", [])
-        
-        if isinstance(fills_received, list):
-            for fill in fills_received:
-                if isinstance(fill, dict):
-                    fill_lots = int(fill.get("lots", 0) or 0)
-                    fill_price = Decimal(str(fill.get("price", 0) or 0))
-                    
-                    total_fills += fill_lots
-                    weighted_sum += Decimal(fill_lots) * fill_price
-
-    instance.total_lots = int(total_fills)
-    instance.avg_price = (weighted_sum / Decimal(total_fills)) if total_fills > 0 else Decimal('0')
 
+@receiver(post_save, sender=Settlement)
+def refresh_availability_prices(sender, instance: Settlement, created, raw=False, update_fields=None, **kwargs):
+    """Re-price the single month and spreads that use this settlement when its price may have changed."""
+    if created or raw or (update_fields is not None and "settlement_price" not in update_fields):
+        return
+    refresh_spread_prices(commodity_ids=[instance.commodity_id], settlement_ids=[instance.id])
 
 
 @receiver(post_save, sender=Trade)
-def update_exits_on_trade_change(sender, instance: Trade, **kwargs):
+def update_exits_on_trade_change(sender, instance: Trade, created, raw=False, update_fields=None, **kwargs):
     """
-    Recompute profit_loss for exits if trade avg_price/total_lots changed.
+    Recompute profit_loss for exits if trade avg_price changed, in one UPDATE (an Exit's own
+    saves derive it in Exit.save). New trades have no exits and status-only saves leave
+    avg_price alone, so both skip it, as do FIFO / LIFO trades: their exits are priced by
+    the fills they matched.
     """
-    for exit_obj in instance.exits.all():
-        if exit_obj.exit_price is not None and exit_obj.recieved_lots and exit_obj.recieved_lots > 0:
-            trade_entry_price = Decimal(instance.avg_price)
-            calculated_pl = (Decimal(exit_obj.exit_price) - trade_entry_price) * Decimal(exit_obj.recieved_lots)
-            if exit_obj.profit_loss != calculated_pl:
-                exit_obj.profit_loss = calculated_pl
-                exit_obj.save(update_fields=["profit_loss"])
-
-
-@receiver(post_save, sender=Exit)
-def update_exit_on_save(sender, instance: Exit, created, **kwargs):
-    """
-    - Calculate profit_loss for this exit when exit_price/recieved_lots present.
-    - Set is_closed on Exit if fully received.
-    - Update exit_status based on recieved_lots vs requested_exit_lots.
-    """
-    fields_to_update = []
-    # 1) P&L
-    if instance.exit_price is not None and instance.recieved_lots is not None and instance.recieved_lots > 0:
-        trade_entry_price = Decimal(instance.trade.avg_price)
-        calculated_pl = (Decimal(instance.exit_price) - trade_entry_price) * Decimal(instance.recieved_lots)
-        print(instance.exit_price)
-        print(trade_entry_price)
-        print(instance.recieved_lots)
-        print(calculated_pl)
-        if instance.profit_loss != calculated_pl:
-            instance.profit_loss = calculated_pl
-            fields_to_update.append("profit_loss")
-
-    # 2) is_closed flag (for the Exit, not the Trade)
-    if instance.recieved_lots == instance.requested_exit_lots and instance.recieved_lots > 0:
-        if not instance.is_closed:
-            instance.is_closed = True
-            fields_to_update.append("is_closed")
-    else:
-        if instance.is_closed:
-            instance.is_closed = False
-            fields_to_update.append("is_closed")
-
-    # 3) status transitions
-    old_status = instance.exit_status
-    new_status = old_status
-    if instance.recieved_lots == instance.requested_exit_lots and instance.recieved_lots > 0:
-        new_status = "filled"
-    elif 0 < (instance.recieved_lots or 0) < (instance.requested_exit_lots or 0):
-        new_status = "partial_filled"
-    elif (instance.recieved_lots or 0) == 0:
-        # keep pending or order_placed depending on previous transitions
-        if old_status in ["filled", "partial_filled"]:
-            new_status = "order_placed"
-        elif old_status == "pending":
-            new_status = "pending"
-
-    if new_status != old_status:
-        instance.exit_status = new_status
-        fields_to_update.append("exit_status")
-
-    if fields_to_update:
-        instance.save(update_fields=fields_to_update)
+    if created or raw or not instance.has_changed("avg_price", update_fields=update_fields):
+        return
+    if instance.lot_matching != AVERAGE_COST:
+        return
+    instance.exits.recompute_profit_loss(instance.avg_price)
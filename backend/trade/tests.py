@@ -1,3 +1,1319 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .availability import parse_virtual_id, resolve_availability, store_availability
+from .cache import CatalogueCache, catalogue_cache
+from .loaders import bulk_load_catalogue, load_settlement_prices, sync_settlements
+from .fills import append_fills, entries_json, json_totals, save_entries, verify_totals
+from .models import (
+    Availability, Commodity, Exit, Fill, LotMatch, Settlement, Trade, VersionConflict, contract_key, parse_contract,
+)
+from .matching import rematch
+from .pagination import encode_cursor
+from .pricing import refresh_spread_prices, refresh_spread_prices_rowwise
+from .ticks import from_ticks, to_ticks
+
+
+def explain(queryset):
+    """EXPLAIN a queryset with sequential scans discouraged, so tiny test tables still show index choice."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+    return queryset.explain()
+
+
+class CatalogueLoaderTests(TestCase):
+    def test_bulk_load_creates_the_catalogue_once(self):
+        totals = bulk_load_catalogue({'ZC': ['Mar', 'Jul', 'Dec'], 'CL': ['Jan']}, start_year=2025, end_year=2026)
+        # ZC: 6 contracts, 6 singles + 15 spreads; CL: 2 contracts, 2 singles + 1 spread
+        self.assertEqual(totals, {'commodities': 2, 'settlements': 8, 'availabilities': 24})
+        self.assertEqual(Settlement.objects.count(), 8)
+        self.assertEqual(Availability.objects.count(), 24)
+        spread = Availability.objects.get(commodity__code='ZC', start_month__month='Mar', start_month__year=2025,
+                                          end_month__month='Dec', end_month__year=2026)
+        self.assertEqual((spread.start_key, spread.end_key), (contract_key('Mar', 2025), contract_key('Dec', 2026)))
+
+        # Re-running inserts nothing new
+        bulk_load_catalogue({'ZC': ['Mar', 'Jul', 'Dec'], 'CL': ['Jan']}, start_year=2025, end_year=2026)
+        self.assertEqual((Commodity.objects.count(), Settlement.objects.count(), Availability.objects.count()), (2, 8, 24))
+
+    def test_bulk_load_without_spreads(self):
+        totals = bulk_load_catalogue({'ZC': ['Mar', 'Dec']}, start_year=2025, end_year=2025, spreads=False)
+        self.assertEqual(totals['availabilities'], 2)
+        self.assertFalse(Availability.objects.filter(end_month__isnull=False).exists())
+
+
+class SettlementSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'ZC': ['Mar', 'Dec'], 'CL': ['Jan']}, start_year=2026, end_year=2027)
+
+    def sync(self, months, start_year=2026, end_year=2027):
+        counts = sync_settlements(months, start_year, end_year)
+        return {name: count for name, count in counts.items() if count}
+
+    def available(self, month):
+        rows = Availability.objects.filter(Q(start_month__month=month) | Q(end_month__month=month))
+        return set(rows.values_list('is_available', flat=True))
+
+    def test_creates_missing_contracts(self):
+        self.assertEqual(self.sync({'ZC': ['Mar', 'Jun', 'Dec'], 'NG': ['Feb']}),
+                         {'created': 4, 'unchanged': 4, 'commodities_created': 1})
+        self.assertEqual(self.sync({'ZC': ['Mar', 'Jun', 'Dec'], 'NG': ['Feb']}), {'unchanged': 8})
+
+    def test_only_compares_the_requested_commodities_and_years(self):
+        self.assertEqual(self.sync({'ZC': ['Mar']}, 2027, 2027), {'expired': 1, 'unchanged': 1})
+        self.assertEqual(
+            set(Settlement.objects.filter(expired_at__isnull=False).values_list('month', 'year')), {('Dec', 2027)}
+        )
+
+    def test_expires_and_reactivates_without_reopening_rows_disabled_by_hand(self):
+        by_hand = Availability.objects.get(start_month__month='Mar', start_month__year=2026,
+                                           end_month__month='Dec', end_month__year=2026)
+        Availability.objects.filter(pk=by_hand.pk).update(is_available=False)
+
+        self.assertEqual(self.sync({'ZC': ['Mar'], 'CL': ['Jan']}), {'expired': 2, 'unchanged': 4})
+        self.assertEqual(self.available('Dec'), {False})
+        self.assertEqual(self.available('Jan'), {True})
+
+        self.assertEqual(self.sync({'ZC': ['Mar', 'Dec'], 'CL': ['Jan']}), {'reactivated': 2, 'unchanged': 4})
+        self.assertEqual(self.available('Dec'), {True, False})
+        self.assertEqual(list(Availability.objects.filter(is_available=False)), [by_hand])
+        self.assertFalse(Availability.objects.filter(expired_at__isnull=False).exists())
+
+
+class ContractKeyTests(TestCase):
+    def test_contract_key_orders_months_within_and_across_years(self):
+        self.assertEqual(contract_key('Jan', 2025), 2025 * 12 + 1)
+        self.assertEqual(contract_key('dec', 2025) + 1, contract_key('JAN', 2026))
+        self.assertIsNone(contract_key('Foo', 2025))
+        self.assertEqual(parse_contract('Mar26'), contract_key('Mar', 2026))
+        self.assertEqual(parse_contract('Dec2027'), contract_key('Dec', 2027))
+
+    def test_settlement_save_keeps_contract_key_in_sync(self):
+        bulk_load_catalogue({'ZC': ['Mar', 'Dec']}, start_year=2025, end_year=2025)
+        settlement = Settlement.objects.get(commodity__code='ZC', month='Mar', year=2025)
+        self.assertEqual(settlement.contract_key, contract_key('Mar', 2025))
+        settlement.year = 2026
+        settlement.save(update_fields=['year'])
+        settlement.refresh_from_db()
+        self.assertEqual(settlement.contract_key, contract_key('Mar', 2026))
+        self.assertEqual(
+            set(Availability.objects.filter(start_month=settlement).values_list('start_key', flat=True)),
+            {contract_key('Mar', 2026)},
+        )
+        dec = Settlement.objects.get(commodity__code='ZC', month='Dec', year=2025)
+        dec.month = 'Nov'
+        dec.save()
+        spread = Availability.objects.get(end_month=dec)
+        self.assertEqual((spread.start_key, spread.end_key), (contract_key('Mar', 2026), contract_key('Nov', 2025)))
+
+
+class AvailabilityIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue(
+            {'ZC': ['Mar', 'May', 'Jul', 'Sep', 'Dec'], 'CL': ['Jan', 'Jun', 'Dec']},
+            start_year=2025, end_year=2028,
+        )
+
+    def test_loader_populates_leg_keys(self):
+        spread = Availability.objects.spreads().select_related('start_month', 'end_month').first()
+        self.assertEqual(spread.start_key, spread.start_month.contract_key)
+        self.assertEqual(spread.end_key, spread.end_month.contract_key)
+        self.assertFalse(Availability.objects.filter(start_key__isnull=True).exists())
+
+    def test_exact_spread_lookup(self):
+        qs = Availability.objects.filter(is_available=True).for_contract('zc', ('mar', 2026), ('DEC', 2026))
+        spread = qs.get()
+        self.assertEqual((spread.start_month.month, spread.end_month.year), ('Mar', 2026))
+        self.assertFalse(Availability.objects.for_contract('ZC', ('Foo', 2026)).exists())
+
+    def test_start_range_lookup(self):
+        low, high = parse_contract('Mar26'), parse_contract('Dec27')
+        qs = Availability.objects.filter(commodity__code='ZC').spreads().start_between(low, high)
+        starts = {(a.start_month.month, a.start_month.year) for a in qs.select_related('start_month')}
+        self.assertIn(('Mar', 2026), starts)
+        self.assertIn(('Dec', 2027), starts)
+        self.assertNotIn(('Dec', 2025), starts)
+        self.assertNotIn(('Mar', 2028), starts)
+
+    def test_spread_lookup_uses_composite_index(self):
+        commodity_id = Availability.objects.filter(commodity__code='ZC').values_list('commodity_id', flat=True)[0]
+        qs = Availability.objects.filter(
+            commodity_id=commodity_id, start_key=contract_key('Mar', 2026),
+            end_key=contract_key('Dec', 2026), is_available=True,
+        )
+        self.assertIn('availability_contract_idx', explain(qs))
+
+    def test_range_lookup_uses_composite_index(self):
+        commodity_id = Availability.objects.filter(commodity__code='ZC').values_list('commodity_id', flat=True)[0]
+        qs = Availability.objects.filter(commodity_id=commodity_id).start_between(
+            parse_contract('Mar26'), parse_contract('Dec27')
+        )
+        self.assertIn('availability_contract_idx', explain(qs))
+
+    def test_settlement_lookup_uses_contract_index(self):
+        commodity_id = Settlement.objects.filter(commodity__code='CL').values_list('commodity_id', flat=True)[0]
+        qs = Settlement.objects.filter(commodity_id=commodity_id, contract_key__range=(
+            parse_contract('Jan26'), parse_contract('Dec27')
+        ))
+        self.assertIn('settlement_contract_idx', explain(qs))
+
+
+class CatalogueCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'ZC': ['Mar', 'Dec']}, start_year=2025, end_year=2026)
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+
+    def test_lookups_are_served_from_memory(self):
+        catalogue_cache.get()
+        spread = Availability.objects.spreads().first()
+        with self.assertNumQueries(0):
+            rows = list(catalogue_cache.get().iter_availabilities(code='zc', start_key=spread.start_key,
+                                                                  end_key=spread.end_key))
+            contract_month = catalogue_cache.get().contract_month(spread.id)
+        self.assertEqual([row['id'] for row in rows], [spread.id])
+        self.assertEqual(contract_month, rows[0]['period_display'].replace(' to ', '-'))
+        self.assertGreaterEqual(catalogue_cache.stats()['hits'], 2)
+
+    def test_signals_invalidate_after_commit(self):
+        catalogue_cache.get()
+        loads = catalogue_cache.loads
+        with self.captureOnCommitCallbacks(execute=True):
+            Commodity.objects.create(code='CL')
+        self.assertIsNotNone(catalogue_cache.get().commodities_by_code.get('cl'))
+        self.assertEqual(catalogue_cache.loads, loads + 1)
+
+    def test_another_workers_invalidation_reaches_this_copy(self):
+        worker = CatalogueCache()
+        catalogue = worker.get()
+        with override_settings(CATALOGUE_CACHE_CHECK_INTERVAL=-1):
+            self.assertIs(worker.get(), catalogue)
+            # Another worker's invalidation only bumps the shared version stamp
+            catalogue_cache.invalidate()
+            self.assertIsNot(worker.get(), catalogue)
+        self.assertEqual(worker.loads, 2)
+        with override_settings(CATALOGUE_CACHE_MAX_AGE=-1):
+            worker.get()
+        self.assertEqual(worker.loads, 3)
+
+
+class AvailabilitySearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'ZC': ['Mar', 'Dec'], 'CL': ['Jan', 'Jun']}, start_year=2025, end_year=2027)
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+
+    def walk(self, query):
+        rows, url = [], f'/api/trades/availabilities/search/?page_size=7&{query}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            # Counted once, on the first page
+            self.assertEqual(response.data['count_estimate'] is None, 'cursor=' in url)
+            rows += [(r['commodity_code'], r['period_display'], r['start_month'], r['start_year'])
+                     for r in response.data['results']]
+            url = response.data['next']
+        return rows
+
+    def test_pages_cover_every_row_once(self):
+        rows = self.walk('')
+        self.assertEqual(len(rows), Availability.objects.count())
+        self.assertEqual(len(set(rows)), len(rows))
+
+    def test_filters(self):
+        rows = self.walk('commodity=zc&start_from=Mar26&start_to=Dec26')
+        self.assertEqual(rows[:4], [
+            ('ZC', 'Mar2026 to Dec2026', 'Mar', 2026),
+            ('ZC', 'Mar2026 to Mar2027', 'Mar', 2026),
+            ('ZC', 'Mar2026 to Dec2027', 'Mar', 2026),
+            ('ZC', 'N/A', 'Mar', 2026),
+        ])
+        self.assertTrue(all(r[1] != 'N/A' for r in self.walk('kind=spread&min_width=6&max_width=12')))
+        self.assertEqual(self.client.get('/api/trades/availabilities/search/?start_from=Foo').status_code, 400)
+
+    def test_rejects_bad_page_size_and_cursor(self):
+        url = '/api/trades/availabilities/search/'
+        for page_size in ['-3', '0', 'x']:
+            self.assertEqual(self.client.get(f'{url}?page_size={page_size}').status_code, 400)
+        for cursor in [['ZC', 'Mar26', None], [1, [2], None], [1, None, None], [1, 2], 'abc']:
+            token = encode_cursor(cursor) if isinstance(cursor, list) else cursor
+            for virtual in (False, True):
+                with override_settings(VIRTUAL_SPREADS=virtual):
+                    response = self.client.get(f'{url}?cursor={token}')
+                self.assertEqual((response.status_code, response.data), (400, {'cursor': 'Invalid cursor.'}))
+
+    def test_virtual_mode_matches_stored_rows(self):
+        for query in ['', 'commodity=CL&end_from=Jan26&end_to=Jun26', 'kind=spread&max_width=9']:
+            stored = self.walk(query)
+            with override_settings(VIRTUAL_SPREADS=True):
+                self.assertEqual(self.walk(query), stored)
+
+
+class VirtualSpreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun'], 'ZC': ['Mar']}, start_year=2026, end_year=2026, spreads=False)
+        Commodity.objects.update(tick_size=Decimal('0.25'))
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw')
+        cls.jan, cls.jun = Settlement.objects.filter(commodity__code='CL').order_by('contract_key')
+        cls.mar = Settlement.objects.get(commodity__code='ZC')
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def apply(self, name, price=410.25):
+        return self.client.post('/api/trades/apply/', {
+            'name': name, 'trade_type': 'long', 'lots_and_price': [entry(5, price, [])],
+        }, format='json')
+
+    def spreads(self):
+        return Availability.objects.spreads().count()
+
+    @override_settings(VIRTUAL_SPREADS=True)
+    def test_listed_virtual_id_is_stored_on_first_trade(self):
+        response = self.client.get('/api/trades/availabilities/search/?kind=spread')
+        self.assertEqual([row['id'] for row in response.data['results']], [f'v{self.jan.id}-{self.jun.id}'])
+        self.assertEqual(self.spreads(), 0)
+
+        first = self.apply(f'v{self.jan.id}-{self.jun.id}')
+        self.assertEqual(first.status_code, 201, first.data)
+        availability = Availability.objects.spreads().get()
+        self.assertEqual((availability.start_month, availability.end_month), (self.jan, self.jun))
+        self.assertEqual((availability.start_key, availability.end_key), (self.jan.contract_key, self.jun.contract_key))
+        second = self.apply(f'v{self.jan.id}-{self.jun.id}')
+        self.assertEqual(second.data['name'], first.data['name'])
+        self.assertEqual(self.spreads(), 1)
+
+    def test_rejected_request_stores_nothing(self):
+        response = self.apply(f'v{self.jan.id}-{self.jun.id}', price=410.1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tick size 0.25', str(response.data['lots_and_price']))
+        response = self.client.post('/api/flytrades/legs/create/', {
+            'name': f'v{self.jan.id}-{self.jun.id}', 'lots_and_price': [{'lots': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.spreads(), 0)
+
+    def test_invalid_virtual_ids(self):
+        for name, error in [
+            (f'v{self.jun.id}-{self.jan.id}', 'Spread start month must be before its end month.'),
+            (f'v{self.jan.id}-{self.mar.id}', 'Both legs of a spread must belong to the same commodity.'),
+            (f'v{self.jan.id}-999999', 'Invalid pk "v%s-999999" - object does not exist.' % self.jan.id),
+        ]:
+            response = self.apply(name)
+            self.assertEqual((response.status_code, response.data['name']), (400, [error]))
+        Settlement.objects.filter(pk=self.jun.pk).update(expired_at=timezone.now())
+        self.assertEqual(self.apply(f'v{self.jan.id}-{self.jun.id}').data['name'],
+                         ['Spread references an expired contract.'])
+        self.assertEqual(self.spreads(), 0)
+
+
+class SpreadPricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'ZC': ['Mar', 'Dec'], 'CL': ['Jan', 'Jun']}, start_year=2025, end_year=2026)
+        settlements = list(Settlement.objects.all())
+        for settlement in settlements:
+            settlement.settlement_price = Decimal(settlement.contract_key % 13) + Decimal('0.15')
+        Settlement.objects.bulk_update(settlements, ['settlement_price'])
+
+    def prices(self):
+        return dict(Availability.objects.values_list('id', 'settlement_price'))
+
+    def test_vectorized_matches_row_by_row(self):
+        self.assertGreater(refresh_spread_prices(), 0)
+        vectorized = self.prices()
+        Availability.objects.update(settlement_price=0)
+        refresh_spread_prices_rowwise()
+        self.assertEqual(self.prices(), vectorized)
+        self.assertEqual(refresh_spread_prices(), 0)
+
+    def test_settlement_save_reprices_dependent_rows(self):
+        refresh_spread_prices()
+        settlement = Settlement.objects.get(commodity__code='ZC', month='Mar', year=2026)
+        settlement.settlement_price += Decimal('1.10')
+        with self.assertNumQueries(4):  # the save, the curve, the dependent rows, the write
+            settlement.save(update_fields=['settlement_price'])
+        spread = Availability.objects.select_related('start_month', 'end_month').get(
+            start_month=settlement, end_month__month='Dec', end_month__year=2026
+        )
+        self.assertEqual(spread.settlement_price,
+                         float(spread.start_month.settlement_price - spread.end_month.settlement_price))
+        self.assertEqual(Availability.objects.get(start_month=settlement, end_month=None).settlement_price,
+                         float(settlement.settlement_price))
+
+    def test_virtual_and_materialized_spreads_are_priced_like_stored_ones(self):
+        refresh_spread_prices()
+        stored = {(a.start_month_id, a.end_month_id): a.settlement_price for a in Availability.objects.spreads()}
+        Availability.objects.spreads().delete()
+        catalogue_cache.invalidate()
+        client = APIClient()
+        with override_settings(VIRTUAL_SPREADS=True):
+            searched = client.get('/api/trades/availabilities/search/?kind=spread&page_size=200').data['results']
+            listed = client.get('/api/trades/availabilities/').data
+        self.assertEqual({parse_virtual_id(row['id']): row['settlement_price'] for row in searched}, stored)
+        for row in listed:
+            if isinstance(row['id'], str):
+                self.assertEqual(row['settlement_price'], stored[parse_virtual_id(row['id'])])
+        for (start_id, end_id), price in stored.items():
+            stored_row = store_availability(resolve_availability(start_id, end_id))
+            self.assertEqual(stored_row.settlement_price, price)
+
+
+class PriceLoaderTests(TestCase):
+    PRICES = [
+        'code,month,year,price',
+        'ZC,Mar,2026,410.25',
+        'ZC,Dec,2026,432.5',
+        'CL,Jan,2026,70',
+        'XX,Mar,2026,1',         # unknown commodity
+        'ZC,Jul,2026,400',       # no such contract
+        'ZC,Mar,abc,1',          # bad year
+        ',Mar,2026,1',           # no code
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'ZC': ['Mar', 'Dec'], 'CL': ['Jan']}, start_year=2026, end_year=2026)
+        cls.admin = get_user_model().objects.create_superuser(username='admin', password='pw')
+
+    def test_load_reports_skipped_and_unmatched_rows(self):
+        result = load_settlement_prices(StringIO('\n'.join(self.PRICES)))
+        self.assertEqual((result['rows'], result['settlements']), (5, 3))
+        self.assertEqual(result['unmatched'], [(5, 'no XX Mar2026 contract'), (6, 'no ZC Jul2026 contract')])
+        self.assertEqual([line for line, _ in result['errors']], [7, 8])
+        spread = Availability.objects.get(commodity__code='ZC', end_month__isnull=False)
+        self.assertEqual(spread.settlement_price, -22.25)
+        self.assertEqual(load_settlement_prices(StringIO('\n'.join(self.PRICES)))['settlements'], 0)
+
+    def test_command_prints_the_counts(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write('\n'.join(self.PRICES) + '\n')
+        self.addCleanup(os.remove, handle.name)
+        out = StringIO()
+        call_command('load_prices', handle.name, stdout=out)
+        self.assertIn('Line 5: no XX Mar2026 contract', out.getvalue())
+        self.assertIn('5 prices read, 3 settlements', out.getvalue())
+        self.assertIn('2 rows skipped, 2 matched no contract.', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('load_prices', handle.name + '.missing', stdout=StringIO())
+
+    def test_admin_upload_reports_the_counts(self):
+        self.client.force_login(self.admin)
+        upload = SimpleUploadedFile('prices.csv', '\n'.join(self.PRICES).encode())
+        response = self.client.post('/admin/trade/settlement/upload-prices/', {'price_file': upload}, follow=True)
+        messages = [str(message) for message in response.context['messages']]
+        self.assertIn('Line 6: no ZC Jul2026 contract', messages)
+        self.assertIn('2 rows skipped, 2 matched no contract.', messages)
+        self.assertEqual(Settlement.objects.get(commodity__code='CL').settlement_price, Decimal('70'))
+
+
+class SpreadMatrixTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'ZC': ['Mar', 'Dec']}, start_year=2025, end_year=2026)
+        settlements = list(Settlement.objects.order_by('contract_key'))
+        for price, settlement in zip(['410.25', '432.50', '445.75', '451.00'], settlements):
+            settlement.settlement_price = Decimal(price)
+        Settlement.objects.bulk_update(settlements, ['settlement_price'])
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+
+    def test_matrix_is_computed_from_the_curve(self):
+        response = self.client.get('/api/trades/availabilities/matrix/?commodity=zc')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['months'], ['Mar2025', 'Dec2025', 'Mar2026', 'Dec2026'])
+        self.assertEqual(response.data['curve'], [410.25, 432.5, 445.75, 451.0])
+        self.assertEqual(response.data['matrix'][0][2], -35.5)
+        self.assertEqual(response.data['matrix'][1][3], -18.5)
+        self.assertEqual(self.client.get('/api/trades/availabilities/matrix/?commodity=XX').status_code, 404)
+        self.assertEqual(self.client.get('/api/trades/availabilities/matrix/').status_code, 400)
+
+    def test_matrix_is_cached_until_a_settlement_changes(self):
+        self.client.get('/api/trades/availabilities/matrix/?commodity=ZC')
+        with self.assertNumQueries(0):
+            self.client.get('/api/trades/availabilities/matrix/?commodity=ZC')
+        settlement = Settlement.objects.get(commodity__code='ZC', month='Mar', year=2025)
+        settlement.settlement_price = Decimal('400.25')
+        with self.captureOnCommitCallbacks(execute=True):
+            settlement.save(update_fields=['settlement_price'])
+        response = self.client.get('/api/trades/availabilities/matrix/?commodity=ZC')
+        self.assertEqual(response.data['matrix'][0][2], -45.5)
+
+
+def entry(lots, price, fills, stop_loss=None):
+    return {
+        'lots': lots, 'price': price, 'added_at': '2026-10-01T10:00:00Z',
+        'fills_received': [{'lots': l, 'price': p} for l, p in fills],
+        'stop_loss': stop_loss if stop_loss is not None else price - 10,
+    }
+
+
+class FillTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw')
+        cls.availability = Availability.objects.spreads().get()
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_trade(self, entries):
+        response = self.client.post('/api/trades/apply/', {
+            'name': self.availability.id, 'trade_type': 'long', 'lots_and_price': entries,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Trade.objects.get(pk=response.data['id'])
+
+    def test_entries_and_fills_mirror_the_json(self):
+        entries = [entry(5, 410.25, [(2, 410), (3, 410.5)]), entry(4, 411, [(1, 411.75)])]
+        trade = self.create_trade(entries)
+        self.assertEqual(entries_json(trade), entries)
+        self.assertEqual((trade.total_lots, trade.avg_price), (6, Decimal('410.54')))
+        self.assertEqual(Fill.objects.filter(trade=trade).count(), 3)
+
+    def test_unchanged_fills_keep_their_timestamp(self):
+        trade = self.create_trade([entry(5, 410, [(2, 410)])])
+        first = Fill.objects.get(trade=trade)
+        trade.status = 'order_placed'
+        trade.save()
+        response = self.client.patch(f'/api/trades/trades/{trade.id}/update-fills/', {
+            'lots_and_price': [entry(5, 410, [(2, 410), (3, 412)])],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['total_lots'], 5)
+        self.assertEqual(response.data['status'], 'fills_received')
+        fills = list(Fill.objects.filter(trade=trade).order_by('position'))
+        self.assertEqual(fills[0].filled_at, first.filled_at)
+        self.assertEqual(fills[1].price, Decimal('412'))
+
+    def test_fill_reporting_by_commodity_and_day(self):
+        trade = self.create_trade([entry(5, 410, [(2, 410), (3, 411)])])
+        yesterday = timezone.localdate() - timedelta(days=1)
+        Fill.objects.filter(trade=trade, position=0).update(filled_at=timezone.now() - timedelta(days=1))
+        fills = Fill.objects.for_commodity('cl').filled_on(yesterday)
+        self.assertEqual(fills.totals(), {'total_lots': 2, 'notional': Decimal('820')})
+        by_id = Fill.objects.filter(commodity_id=trade.fills.first().commodity_id).filled_on(yesterday)
+        self.assertIn('fill_commodity_idx', explain(by_id.order_by()))
+
+    def test_append_fills_moves_running_totals(self):
+        trade = self.create_trade([entry(10, 410, [(2, 410)]), entry(5, 412, [])])
+        Trade.objects.filter(pk=trade.pk).update(status='order_placed')
+        url = f'/api/trades/trades/{trade.id}/append-fills/'
+        for fills in ([{'lots': 3, 'price': 411.5}], [{'lots': 4, 'price': 409.25}, {'lots': 1, 'price': 412}]):
+            response = self.client.patch(url, {'entry': 0, 'fills': fills}, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['status'], 'partial_fills_received')
+        self.assertEqual(response.data['total_lots'], 10)
+        self.assertEqual(len(response.data['lots_and_price'][0]['fills_received']), 4)
+
+        trade.refresh_from_db()
+        self.assertEqual(verify_totals(trade), {})
+        self.assertEqual(entries_json(trade), trade.lots_and_price)
+        self.assertEqual(trade.avg_price, Decimal('410.35'))
+
+        overfill = self.client.patch(url, {'entry': 0, 'fills': [{'lots': 1, 'price': 410}]}, format='json')
+        self.assertEqual(overfill.status_code, 400)
+        self.assertEqual(self.client.patch(url, {'entry': 7, 'fills': [{'lots': 1, 'price': 1}]}, format='json').status_code, 400)
+
+    def test_add_lots_appends_new_entries(self):
+        first = entry(5, 410, [(5, 410)])
+        trade = self.create_trade([first])
+        second = entry(3, 415, [(1, 416)])
+        response = self.client.patch(f'/api/trades/trade/{trade.id}/add-lots/', {
+            'lots_and_price': [first, second],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        trade.refresh_from_db()
+        self.assertEqual(trade.lots_and_price, [first, second])
+        self.assertEqual(entries_json(trade), [first, second])
+        self.assertEqual((trade.total_lots, verify_totals(trade)), (6, {}))
+
+
+class ContractSpecTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        Commodity.objects.update(tick_size=Decimal('0.25'), point_value=Decimal('50'))
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw', is_staff=True)
+        cls.availability = Availability.objects.spreads().get()
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_tick_arithmetic(self):
+        self.assertEqual(
+            [to_ticks(v) for v in (410, 410.15, '410.15', Decimal('0.00005'), Decimal('0.00015'))],
+            [4100000, 4101500, 4101500, 0, 2],
+        )
+        self.assertEqual(from_ticks(4101500), Decimal('410.15'))
+        # 3 x 0.1 + 3 x 0.2 is 0.9000000000000001 in floats
+        fills = [{'lots': 3, 'price': 0.1}, {'lots': 3, 'price': 0.2}]
+        self.assertEqual(json_totals([{'fills_received': fills}]), (6, Decimal('0.9')))
+
+    def test_prices_must_be_on_tick(self):
+        trade = save_entries(Trade(name=self.availability, trade_type='long', trader=self.user), [entry(10, 400, [])])
+        Trade.objects.filter(pk=trade.pk).update(status='order_placed')
+        url = f'/api/trades/trades/{trade.id}'
+        response = self.client.patch(f'{url}/append-fills/', {'entry': 0, 'fills': [{'lots': 1, 'price': 400.1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Price 400.1 is not a multiple of the tick size 0.25.')
+        response = self.client.patch(f'{url}/append-fills/', {'entry': 0, 'fills': [{'lots': 2, 'price': 400.75}]}, format='json')
+        self.assertEqual((response.status_code, response.data['avg_price']), (200, '400.75'))
+
+        response = self.client.patch(f'{url}/update-fills/', {'lots_and_price': [entry(10, 400.3, [])]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Entry 0: Price 400.3', str(response.data['lots_and_price']))
+
+    def test_exit_pnl_uses_point_value(self):
+        trade = Trade.objects.create(name=self.availability, trade_type='long', trader=self.user,
+                                     avg_price=Decimal('400'), total_lots=4)
+        exit_obj = Exit.objects.create(trade=trade, requested_exit_lots=4, recieved_lots=2,
+                                       exit_price=Decimal('410.25'), exit_initiated_by=self.user)
+        self.assertEqual(exit_obj.profit_loss, Decimal('1025.00'))  # 10.25 points x 2 lots x 50
+        trade.avg_price = Decimal('402.50')
+        trade.save_changes()
+        exit_obj.refresh_from_db()
+        self.assertEqual(exit_obj.profit_loss, Decimal('775.00'))
+
+
+class LotMatchingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw', is_staff=True)
+        cls.availability = Availability.objects.spreads().get()
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        catalogue_cache.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_trade(self, method):
+        """Fills of 2 @ 400, 2 @ 410 and 2 @ 420, a day apart over the last three days."""
+        trade = save_entries(Trade(name=self.availability, trade_type='long', trader=self.user, lot_matching=method),
+                             [entry(8, 400, [(2, 400)])])
+        Trade.objects.filter(pk=trade.pk).update(status='order_placed')
+        Fill.objects.filter(trade=trade).update(filled_at=timezone.now() - timedelta(days=3))
+        for days, price in ((2, 410), (1, 420)):
+            append_fills(trade, 0, [{'lots': 2, 'price': price}], filled_at=timezone.now() - timedelta(days=days))
+        return Trade.objects.get(pk=trade.pk)
+
+    def fill_exit(self, exit_obj, lots):
+        exit_obj = Exit.objects.select_related('trade').get(pk=exit_obj.pk)
+        exit_obj.recieved_lots = lots
+        exit_obj.save_changes()
+        return exit_obj
+
+    def slices(self, exit_obj):
+        return list(LotMatch.objects.filter(exit=exit_obj).order_by('pk').values_list('fill__price', 'lots', 'profit_loss'))
+
+    def test_fifo_and_lifo_slices(self):
+        for method, slices, profit_loss in (
+            ('fifo', [(Decimal('400'), 2, Decimal('60.00')), (Decimal('410'), 1, Decimal('20.00'))], Decimal('80.00')),
+            ('lifo', [(Decimal('420'), 2, Decimal('20.00')), (Decimal('410'), 1, Decimal('20.00'))], Decimal('40.00')),
+            ('average', [], Decimal('60')),  # (430 - 410 avg) x 3, no slices
+        ):
+            trade = self.create_trade(method)
+            exit_obj = Exit.objects.create(trade=trade, requested_exit_lots=3, recieved_lots=3,
+                                           exit_price=Decimal('430'), exit_initiated_by=self.user)
+            self.assertEqual((self.slices(exit_obj), exit_obj.profit_loss), (slices, profit_loss), method)
+
+    def test_exit_fills_do_not_touch_earlier_exits(self):
+        trade = self.create_trade('fifo')
+        first, second = (
+            Exit.objects.create(trade=trade, requested_exit_lots=3, exit_price=Decimal('430'),
+                                exit_initiated_by=self.user, exit_status='order_placed')
+            for _ in range(2)
+        )
+        first = self.fill_exit(first, 3)
+        version = first.version
+        second = self.fill_exit(second, 2)
+        self.assertEqual(self.slices(second), [(Decimal('410'), 1, Decimal('20.00')), (Decimal('420'), 1, Decimal('10.00'))])
+        # A new fill moves avg_price; matched exits keep their P&L
+        append_fills(trade, 0, [{'lots': 2, 'price': 500}])
+        first.refresh_from_db()
+        self.assertEqual((first.version, first.profit_loss), (version, Decimal('80.00')))
+
+        # Lots taken back are released from the newest slice and can be matched again
+        second = self.fill_exit(second, 1)
+        self.assertEqual((self.slices(second), second.profit_loss), ([(Decimal('410'), 1, Decimal('20.00'))], Decimal('20.00')))
+        self.assertEqual(list(Fill.objects.filter(trade=trade).order_by('pk').values_list('open_lots', flat=True)),
+                         [0, 0, 2, 2])
+
+        response = self.client.patch(f'/api/trades/exits/{second.id}/update/',
+                                     {'exit_status': 'filled', 'recieved_lots': 3}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.slices(second)[-1], (Decimal('420'), 2, Decimal('20.00')))
+        third = Exit.objects.create(trade=trade, requested_exit_lots=3, exit_price=Decimal('430'),
+                                    exit_initiated_by=self.user, exit_status='order_placed')
+        response = self.client.patch(f'/api/trades/exits/{third.id}/update/',
+                                     {'exit_status': 'filled', 'recieved_lots': 3}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], f'Trade {trade.id} has 2 open lots; cannot close 3 more.')
+
+    def test_batch_exits_match_fills_of_the_same_batch(self):
+        trade = self.create_trade('fifo')
+        exit_obj = Exit.objects.create(trade=trade, requested_exit_lots=8, exit_price=Decimal('430'),
+                                       exit_initiated_by=self.user, exit_status='order_placed')
+        response = self.client.post('/api/trades/fills/batch/', {
+            'trades': [{'trade': trade.id, 'entry': 0, 'fills': [{'lots': 2, 'price': 425}]}],
+            'exits': [{'exit': exit_obj.id, 'recieved_lots': 7}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['exits'][0]['profit_loss'], '125.00')  # 60 + 40 + 20 + 5
+        self.assertEqual(self.slices(exit_obj)[-1], (Decimal('425'), 1, Decimal('5.00')))
+
+        response = self.client.post('/api/trades/fills/batch/', {'exits': [{'exit': exit_obj.id, 'recieved_lots': 8, 'exit_price': 431}]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        response = self.client.post('/api/trades/fills/batch/', {'exits': [{'exit': exit_obj.id, 'recieved_lots': 9}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        exit_obj.refresh_from_db()
+        self.assertEqual((exit_obj.recieved_lots, exit_obj.profit_loss), (8, Decimal('138.00')))  # every slice repriced at 431
+
+    def test_add_lots_cannot_undercut_matched_exits(self):
+        trade = self.create_trade('fifo')
+        Exit.objects.create(trade=trade, requested_exit_lots=5, recieved_lots=5,
+                            exit_price=Decimal('430'), exit_initiated_by=self.user)
+        # Drops the 410 and 420 fills the exit closed, adding a new entry
+        response = self.client.patch(f'/api/trades/trade/{trade.id}/add-lots/', {
+            'lots_and_price': [entry(8, 400, [(2, 400)]), entry(2, 415, [])],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('open lots', response.data['error'])
+        trade.refresh_from_db()
+        self.assertEqual((trade.total_lots, Fill.objects.filter(trade=trade).count()), (6, 3))
+
+    def test_changing_the_method_rematches(self):
+        trade = self.create_trade('fifo')
+        exit_obj = Exit.objects.create(trade=trade, requested_exit_lots=3, recieved_lots=3,
+                                       exit_price=Decimal('430'), exit_initiated_by=self.user)
+        trade.lot_matching = 'lifo'
+        trade.save_changes()
+        rematch(trade)
+        exit_obj.refresh_from_db()
+        self.assertEqual(exit_obj.profit_loss, Decimal('40.00'))
+        self.assertEqual(sum(Fill.objects.filter(trade=trade).values_list('open_lots', flat=True)), 3)
+
+        trade.lot_matching = 'average'
+        trade.save_changes()
+        rematch(trade)
+        exit_obj.refresh_from_db()
+        self.assertEqual((exit_obj.profit_loss, LotMatch.objects.count()), (Decimal('60.00'), 0))
+
+
+class ExitCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw', is_staff=True)
+        cls.availability = Availability.objects.spreads().get()
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        catalogue_cache.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.trade = Trade.objects.create(name=self.availability, trade_type='long', trader=self.user,
+                                          avg_price=400, total_lots=10)
+
+    def counters(self):
+        self.trade.refresh_from_db()
+        return self.trade.exit_requested_lots, self.trade.exit_received_lots, self.trade.remaining_lots
+
+    def create_exits(self, *lots):
+        return self.client.post('/api/trades/exits/', {
+            'trade': self.trade.id, 'exits': [{'requested_exit_lots': n} for n in lots],
+        }, format='json')
+
+    def test_create_exit_caps_on_the_remaining_lots(self):
+        self.assertEqual(self.create_exits(4, 4).status_code, 201)
+        self.assertEqual(self.counters(), (8, 0, 2))
+        response = self.create_exits(1, 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], "Requested exits (3 lots) exceed the trade's remaining lots (2).")
+        response = self.create_exits(3)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("remaining lots (2)", str(response.data))
+        self.assertEqual(Exit.objects.filter(trade=self.trade).count(), 2)
+
+    def test_create_exit_cost_does_not_grow_with_the_batch(self):
+        queries = {}
+        for size in (1, 50):
+            with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as captured:
+                response = self.create_exits(*[0] * size)
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(len(response.data['created']), size)
+            self.assertEqual(len(callbacks), 1)
+            queries[size] = len(captured)
+        self.assertEqual(queries[1], queries[50])
+
+        self.assertEqual(self.create_exits(3, 4).status_code, 201)
+        self.assertEqual(self.counters(), (7, 0, 3))
+        created = Exit.objects.filter(trade=self.trade, requested_exit_lots__gt=0).order_by('pk')
+        self.assertEqual([(e.requested_exit_lots, e.exit_status, e.is_closed) for e in created],
+                         [(3, 'pending', False), (4, 'pending', False)])
+
+    def test_reactivating_an_exit_respects_the_cap(self):
+        self.create_exits(5)
+        first = Exit.objects.get(trade=self.trade)
+        url = f'/api/trades/exits/{first.id}/update/'
+        self.client.patch(url, {'exit_status': 'rejected'}, format='json')
+        self.assertEqual(self.create_exits(10).status_code, 201)
+        response = self.client.patch(url, {'exit_status': 'approved'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], "Requested exits (5 lots) exceed the trade's remaining lots (0).")
+        first.refresh_from_db()
+        self.assertEqual((first.exit_status, self.counters()), ('rejected', (10, 0, 0)))
+
+        second = Exit.objects.filter(trade=self.trade).latest('pk')
+        self.client.patch(f'/api/trades/exits/{second.id}/update/', {'exit_status': 'cancelled'}, format='json')
+        self.assertEqual(self.client.patch(url, {'exit_status': 'approved'}, format='json').status_code, 200)
+        self.assertEqual(self.counters(), (5, 0, 5))
+
+    def test_batch_fills_cannot_reactivate_beyond_the_cap(self):
+        self.create_exits(5)
+        rejected = Exit.objects.get(trade=self.trade)
+        self.client.patch(f'/api/trades/exits/{rejected.id}/update/', {'exit_status': 'rejected'}, format='json')
+        self.assertEqual(self.create_exits(10).status_code, 201)
+        response = self.client.post('/api/trades/fills/batch/', {'exits': [{'exit': rejected.id, 'recieved_lots': 5}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['exits'][0]['error'],
+                         "Requested exits (5 lots) exceed the trade's remaining lots (0).")
+        rejected.refresh_from_db()
+        self.assertEqual((rejected.exit_status, rejected.recieved_lots, self.counters()), ('rejected', 0, (10, 0, 0)))
+
+    def test_counters_follow_exit_writes(self):
+        self.create_exits(4, 4)
+        first, second = Exit.objects.filter(trade=self.trade).order_by('pk')
+        url = f'/api/trades/exits/{first.id}/update/'
+        Exit.objects.filter(pk=first.pk).update(exit_price=410)
+        self.assertEqual(self.client.patch(url, {'exit_status': 'partial_filled', 'recieved_lots': 3}, format='json').status_code, 200)
+        self.assertEqual(self.counters(), (8, 3, 2))
+        # A cancelled exit gives back the lots it requested
+        self.client.patch(f'/api/trades/exits/{second.id}/update/', {'exit_status': 'cancelled'}, format='json')
+        self.assertEqual(self.counters(), (4, 3, 6))
+        self.assertEqual(self.create_exits(6).status_code, 201)
+
+        response = self.client.post('/api/trades/fills/batch/', {'exits': [{'exit': first.id, 'recieved_lots': 4}]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.counters(), (10, 4, 0))
+        Exit.objects.get(pk=first.pk).delete()
+        self.assertEqual(self.counters(), (6, 0, 4))
+
+        response = self.client.get('/api/trades/exits/all/')
+        self.assertEqual(response.data[0]['recieved_lots_total_lots'], '0/10')
+
+
+class ListQueryCountTests(TestCase):
+    """Every trade list endpoint costs a fixed number of queries, whatever the number of rows it returns."""
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw', is_staff=True)
+        cls.availability = Availability.objects.spreads().get()
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        catalogue_cache.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.rows = 0
+
+    def add_rows(self, count):
+        """Per row: an open trade with two exits, a closed one awaiting acceptance and an accepted one, each with its own approver."""
+        for _ in range(count):
+            self.rows += 1
+            approver = get_user_model().objects.create_user(username=f'manager{get_user_model().objects.count()}')
+            for is_closed, close_accepted in ((False, False), (True, False), (True, True)):
+                trade = Trade.objects.create(name=self.availability, trade_type='long', trader=self.user,
+                                             approved_by=approver, total_lots=4, is_closed=is_closed,
+                                             close_accepted=close_accepted, close_requested_at=timezone.now(),
+                                             fills_received_at=timezone.now())
+            trade = Trade.objects.filter(is_closed=False).latest('pk')
+            for _ in range(2):
+                Exit.objects.create(trade=trade, requested_exit_lots=1, exit_initiated_by=approver, exit_approved_by=approver)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        # The paginated manager list counts, then reads the page; exit lists add their prefetch
+        for url, queries in [
+            ('/api/trades/manager/?page_size=100', 2),
+            ('/api/trades/my/', 1),
+            ('/api/trades/trades/my/', 1),
+            ('/api/trades/trades/close-requests/', 1),
+            ('/api/trades/trades/closed/', 1),
+            ('/api/trades/exits/my/', 2),
+            ('/api/trades/exits/all/', 2),
+        ]:
+            for rows in (1, 5):
+                self.add_rows(rows - self.rows)
+                with self.subTest(url=url, rows=rows), self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data)
+            self.rows = 0
+            Trade.objects.all().delete()
+
+
+class ListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw', is_staff=True)
+        availability = Availability.objects.spreads().get()
+        for i in range(7):
+            Trade.objects.create(name=availability, trade_type='long', trader=cls.user, is_closed=True,
+                                 close_accepted=True, fills_received_at=None if i == 3 else timezone.now())
+        # Ties on the sort key are broken by id
+        Trade.objects.filter(pk__in=Trade.objects.order_by('pk').values('pk')[:4]).update(created_at=timezone.now())
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, page_size):
+        ids, url = [], f'{url}?page_size={page_size}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), page_size)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def stream(self, url):
+        response = self.client.get(f'{url}?stream=1')
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_cursor_pages_and_stream_cover_every_row_once(self):
+        newest_first = list(Trade.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/trades/trades/my/', 3), newest_first)
+        # Trades never filled come last
+        closed = self.walk('/api/trades/trades/closed/', 2)
+        self.assertEqual(sorted(closed), sorted(newest_first))
+        self.assertEqual(closed[-1], Trade.objects.get(fills_received_at=None).id)
+
+        streamed = self.stream('/api/trades/trades/my/')
+        self.assertEqual([row['id'] for row in streamed], newest_first)
+        self.assertEqual(streamed[0], self.client.get(f'/api/trades/trades/my/?page_size=1').data['results'][0])
+        self.assertEqual(self.stream('/api/trades/trades/close-requests/'), [])
+
+        # Without the opt-in parameters the endpoints list every row as before, in the same order
+        self.assertEqual([row['id'] for row in self.client.get('/api/trades/trades/my/').data], newest_first)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual([row['id'] for row in self.client.get('/api/trades/trades/closed/').data], closed)
+        self.assertIn('NULLS LAST', captured[0]['sql'])  # PostgreSQL sorts NULLs first in DESC otherwise
+        self.assertEqual([row['id'] for row in self.stream('/api/trades/trades/closed/')], closed)
+        self.assertEqual(self.client.get('/api/trades/trades/my/?cursor=nonsense').status_code, 400)
+        self.assertEqual(self.client.get('/api/trades/trades/my/?page_size=x').status_code, 400)
+
+    def test_mistyped_cursor_values_are_rejected(self):
+        now = timezone.now().isoformat()
+        for values in [['yesterday', 1], [now, 'x'], [None, 1], [{}, 1], [now, True], [now]]:
+            for mode in ('page_size=2', 'stream=1'):
+                response = self.client.get(f'/api/trades/trades/my/?{mode}&cursor={encode_cursor(values)}')
+                self.assertEqual((response.status_code, response.data), (400, {'cursor': 'Invalid cursor.'}))
+        # NULL is a valid key for a nullable ordering field
+        response = self.client.get(f'/api/trades/trades/closed/?page_size=2&cursor={encode_cursor([None, 10 ** 6])}')
+        self.assertEqual([row['id'] for row in response.data['results']], [Trade.objects.get(fills_received_at=None).id])
+
+    def test_fields_projection_matches_the_serializer(self):
+        Trade.objects.filter(pk=Trade.objects.order_by('pk').first().pk).update(approved_by=self.user, status='approved')
+        catalogue_cache.get()
+        fields = ['id', 'name', 'status', 'avg_price', 'created_at', 'fills_received_at', 'lots_and_price',
+                  'trader_username', 'approved_by_username', 'display_name', 'contract_month']
+        full = self.client.get('/api/trades/trades/closed/').data
+        with self.assertNumQueries(1):
+            projected = self.client.get(f'/api/trades/trades/closed/?fields={",".join(fields)}').data
+        # The serializer leaves approved_by_username out when there is no approver; so does the projection
+        self.assertEqual(projected, [{k: row[k] for k in fields if k in row} for row in full])
+        self.assertEqual(sum('approved_by_username' in row for row in projected), 1)
+
+        page = self.client.get('/api/trades/trades/closed/?fields=id,display_name&page_size=4').data
+        self.assertEqual(page['results'], [{'id': row['id'], 'display_name': row['display_name']} for row in full[:4]])
+        streamed = self.client.get('/api/trades/trades/closed/?fields=id&stream=1').streaming_content
+        self.assertEqual([row['id'] for row in json.loads(b''.join(streamed))], self.walk('/api/trades/trades/closed/', 3))
+        # Fields the projection cannot build fall back to the serializer, trimmed
+        trade = Trade.objects.create(name=Availability.objects.spreads().get(), trade_type='long', trader=self.user)
+        Exit.objects.create(trade=trade, requested_exit_lots=0, exit_initiated_by=self.user)
+        rows = self.client.get('/api/trades/exits/my/?fields=id,applied_exits').data
+        self.assertEqual([list(row) for row in rows], [['id', 'applied_exits']])
+        self.assertEqual(len(rows[0]['applied_exits']), 1)
+        self.assertEqual(self.client.get('/api/trades/trades/my/?fields=id,nope').status_code, 400)
+
+
+class LifecycleQueryTests(TestCase):
+    """Each lifecycle transition writes only what it touched and skips receivers that have nothing to redo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw', is_staff=True)
+        availability = Availability.objects.spreads().get()
+        cls.trade = Trade.objects.create(name=availability, trade_type='long', trader=cls.user)
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        catalogue_cache.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def patch(self, url, data, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.patch(url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def test_changed_fields(self):
+        trade = Trade.objects.get(pk=self.trade.pk)
+        self.assertEqual(trade.changed_fields(), set())
+        trade.status = 'approved'
+        trade.approved_by = self.user
+        self.assertEqual(trade.changed_fields(), {'status', 'approved_by'})
+        self.assertEqual(trade.changed_fields(['status', 'ratio']), {'status'})
+        trade.save_changes()
+        self.assertEqual(trade.changed_fields(), set())
+        self.assertEqual(Trade(trader=self.user).changed_fields() >= {'status', 'avg_price'}, True)
+
+    def test_trade_transitions(self):
+        Exit.objects.create(trade=self.trade, requested_exit_lots=1, exit_initiated_by=self.user)
+        base = f'/api/trades/trades/{self.trade.id}'
+        self.patch(f'{base}/update-status/', {'status': 'approved'}, 3)
+        self.patch(f'{base}/update-status/', {'status': 'order_placed'}, 4)
+        self.patch(f'{base}/update-fills/', {'lots_and_price': [entry(5, 410, [(2, 410)])]}, 13)
+        self.patch(f'{base}/close/', {}, 4)
+        self.patch(f'{base}/accept-close/', {}, 4)
+
+    def test_exit_transitions(self):
+        Trade.objects.filter(pk=self.trade.pk).update(avg_price=400, total_lots=5)
+        exit_obj = Exit.objects.create(trade=self.trade, requested_exit_lots=4, exit_initiated_by=self.user)
+        url = f'/api/trades/exits/{exit_obj.id}/update/'
+        self.patch(url, {'exit_status': 'approved'}, 5)
+        self.patch(url, {'exit_status': 'order_placed'}, 6)
+        Exit.objects.filter(pk=exit_obj.pk).update(exit_price=410)
+        # + moving the trade's exit_received_lots counter
+        response = self.patch(url, {'exit_status': 'filled', 'recieved_lots': 4}, 7)
+        self.assertEqual(response.data['status_display'], 'fills recieved')
+        exit_obj.refresh_from_db()
+        self.assertEqual((exit_obj.profit_loss, exit_obj.is_closed), (Decimal('40'), True))
+
+    def test_exit_status_machine(self):
+        cases = [
+            # (status before, requested, received, was closed) -> (status after, is_closed)
+            (('approved', 4, 0, False), ('approved', False)),
+            (('pending', 4, 0, False), ('pending', False)),
+            (('cancelled', 4, 0, False), ('cancelled', False)),
+            (('filled', 4, 0, True), ('order_placed', False)),
+            (('partial_filled', 4, 0, False), ('order_placed', False)),
+            (('order_placed', 4, 2, False), ('partial_filled', False)),
+            (('partial_filled', 4, 4, False), ('filled', True)),
+            (('filled', 4, 3, True), ('partial_filled', False)),
+        ]
+        for (before, requested, received, closed), expected in cases:
+            exit_obj = Exit(trade=self.trade, exit_status=before, requested_exit_lots=requested,
+                            recieved_lots=received, is_closed=closed)
+            exit_obj.derive_exit_state()
+            self.assertEqual((exit_obj.exit_status, exit_obj.is_closed), expected, before)
+
+    def test_avg_price_change_reprices_exits_in_one_update(self):
+        Exit.objects.bulk_create([
+            Exit(trade=self.trade, requested_exit_lots=4, recieved_lots=lots, exit_price=410, exit_initiated_by=self.user)
+            for lots in (1, 2, 3, 0)
+        ])
+        trade = Trade.objects.get(pk=self.trade.pk)
+        trade.avg_price = Decimal('402.50')
+        with self.assertNumQueries(2):
+            trade.save_changes()
+        self.assertEqual(
+            sorted(Exit.objects.filter(trade=trade).values_list('recieved_lots', 'profit_loss')),
+            [(0, None), (1, Decimal('7.50')), (2, Decimal('15.00')), (3, Decimal('22.50'))],
+        )
+        # Unchanged avg_price: the trade row is written, the exits are not touched
+        with self.assertNumQueries(1):
+            trade.save(update_fields=['avg_price'])
+
+
+class VersionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw', is_staff=True)
+        cls.trade = Trade.objects.create(name=Availability.objects.spreads().get(), trade_type='long', trader=cls.user)
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_save_is_compare_and_swap(self):
+        first, second = Trade.objects.get(pk=self.trade.pk), Trade.objects.get(pk=self.trade.pk)
+        first.ratio = Decimal('50')
+        first.save_changes()
+        self.assertEqual(first.version, 2)
+        second.status = 'approved'
+        with self.assertRaises(VersionConflict) as conflict:
+            second.save_changes()
+        self.assertEqual((conflict.exception.current_version, second.version), (2, 1))
+        self.assertEqual(Trade.objects.values_list('status', 'ratio').get(pk=self.trade.pk), ('pending', Decimal('50')))
+
+    def test_stale_client_version_gets_409(self):
+        url = f'/api/trades/trades/{self.trade.id}/update-status/'
+        response = self.client.patch(url, {'status': 'approved', 'version': 1}, format='json')
+        self.assertEqual((response.status_code, response.data['version']), (200, 2))
+        response = self.client.patch(url, {'status': 'order_placed', 'version': 1}, format='json')
+        self.assertEqual((response.status_code, response.data['version']), (409, 2))
+        self.assertEqual(Trade.objects.get(pk=self.trade.pk).status, 'approved')
+        response = self.client.patch(url, {'status': 'order_placed', 'version': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Exits carry their own version
+        exit_obj = Exit.objects.create(trade=self.trade, requested_exit_lots=2, exit_initiated_by=self.user)
+        Exit.objects.filter(pk=exit_obj.pk).update(version=5)
+        url = f'/api/trades/exits/{exit_obj.id}/update/'
+        response = self.client.patch(url, {'exit_status': 'approved', 'version': 4}, format='json')
+        self.assertEqual((response.status_code, response.data['version']), (409, 5))
+        response = self.client.patch(url, {'exit_status': 'approved', 'version': 5}, format='json')
+        self.assertEqual((response.status_code, response.data['version']), (200, 6))
+
+    def test_stale_fills_update_is_rolled_back(self):
+        Trade.objects.filter(pk=self.trade.pk).update(status='order_placed', version=3)
+        response = self.client.patch(
+            f'/api/trades/trades/{self.trade.id}/update-fills/',
+            {'lots_and_price': [entry(5, 410, [(2, 410)])], 'version': 2}, format='json',
+        )
+        self.assertEqual((response.status_code, response.data['version']), (409, 3))
+        self.assertFalse(Fill.objects.filter(trade=self.trade).exists())
+
+
+class ConcurrentUpdateTests(TransactionTestCase):
+    """Many writers on one trade: every increment lands once a conflicting writer retries."""
+
+    THREADS = 8
+    UPDATES = 15
+
+    def test_no_lost_updates(self):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        user = get_user_model().objects.create_user(username='trader')
+        trade = Trade.objects.create(name=Availability.objects.spreads().get(), trade_type='long', trader=user)
+        start = threading.Barrier(self.THREADS)
+        conflicts = []
+
+        def writer():
+            try:
+                start.wait()
+                for _ in range(self.UPDATES):
+                    while True:
+                        current = Trade.objects.get(pk=trade.pk)
+                        current.total_lots += 1
+                        try:
+                            current.save_changes()
+                            break
+                        except VersionConflict:
+                            conflicts.append(1)
+                        except OperationalError:
+                            # SQLite's shared in-memory test database refuses concurrent writers
+                            pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        total = self.THREADS * self.UPDATES
+        self.assertEqual(Trade.objects.values_list('total_lots', 'version').get(pk=trade.pk), (total, total + 1))
+
+
+class BatchFillsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.manager = get_user_model().objects.create_user(username='manager', password='pw', is_staff=True)
+        cls.availability = Availability.objects.spreads().get()
+
+    def setUp(self):
+        catalogue_cache.invalidate()
+        catalogue_cache.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def create_trade(self, entries, status='order_placed'):
+        trade = save_entries(Trade(name=self.availability, trade_type='long', trader=self.manager), entries)
+        Trade.objects.filter(pk=trade.pk).update(status=status)
+        return trade
+
+    def post(self, data):
+        return self.client.post('/api/trades/fills/batch/', data, format='json')
+
+    def test_batch_applies_trade_and_exit_fills(self):
+        first = self.create_trade([entry(10, 400, [(4, 400)])])
+        second = self.create_trade([entry(5, 410, []), entry(5, 420, [])])
+        exit_obj = Exit.objects.create(trade=first, requested_exit_lots=4, recieved_lots=1, exit_price=405,
+                                       exit_initiated_by=self.manager, exit_status='partial_filled')
+        untouched = Exit.objects.create(trade=first, requested_exit_lots=2, recieved_lots=2, exit_price=405,
+                                        exit_initiated_by=self.manager, exit_status='filled')
+        self.assertEqual(exit_obj.profit_loss, Decimal('5'))
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.post({
+                'trades': [
+                    {'trade': first.id, 'entry': 0, 'fills': [{'lots': 6, 'price': 410}]},
+                    {'trade': second.id, 'entry': 1, 'fills': [{'lots': 2, 'price': 421}]},
+                    {'trade': second.id, 'entry': 1, 'fills': [{'lots': 3, 'price': 419}]},
+                ],
+                'exits': [{'exit': exit_obj.id, 'recieved_lots': 4}],
+            })
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(
+            [(r['total_lots'], r['avg_price'], r['status']) for r in response.data['trades']],
+            [(10, '406.00', 'fills_received'), (5, '419.80', 'partial_fills_received'),
+             (5, '419.80', 'partial_fills_received')],
+        )
+        self.assertEqual(
+            {k: response.data['exits'][0][k] for k in ('exit_status', 'profit_loss', 'is_closed')},
+            {'exit_status': 'filled', 'profit_loss': '-4.00', 'is_closed': True},
+        )
+        # Exits outside the batch are repriced against the new avg_price too
+        untouched.refresh_from_db()
+        self.assertEqual(untouched.profit_loss, Decimal('-2.00'))
+        for trade in (first, second):
+            trade.refresh_from_db()
+            self.assertEqual(verify_totals(trade), {})
+            self.assertEqual(entries_json(trade), trade.lots_and_price)
+
+    def test_one_bad_item_rejects_the_batch(self):
+        trade = self.create_trade([entry(5, 400, [(4, 400)])])
+        pending = self.create_trade([entry(5, 400, [])], status='pending')
+        response = self.post({'trades': [
+            {'trade': trade.id, 'entry': 0, 'fills': [{'lots': 1, 'price': 401}]},
+            {'trade': trade.id, 'entry': 0, 'fills': [{'lots': 1, 'price': 402}]},
+            {'trade': pending.id, 'entry': 0, 'fills': [{'lots': 1, 'price': 402}]},
+            {'trade': 999999, 'entry': 0, 'fills': [{'lots': 1, 'price': 402}]},
+        ], 'exits': [{'exit': 999999, 'recieved_lots': 1}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.data['applied'])
+        self.assertEqual([r['ok'] for r in response.data['trades']], [True, False, False, False])
+        self.assertIn('cannot exceed', response.data['trades'][1]['error'])
+        self.assertEqual(response.data['exits'][0]['error'], 'Exit not found.')
+        trade.refresh_from_db()
+        self.assertEqual((trade.total_lots, Fill.objects.filter(trade=trade).count()), (4, 1))
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        trades = [self.create_trade([entry(10, 400, [])]) for _ in range(6)]
+        items = [{'trade': t.id, 'entry': 0, 'fills': [{'lots': 2, 'price': 401}]} for t in trades]
+        with self.assertNumQueries(7):
+            self.assertEqual(self.post({'trades': items[:2]}).status_code, 200)
+        with self.assertNumQueries(7):
+            self.assertEqual(self.post({'trades': items}).status_code, 200)
+
+
+class ImportFillsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        bulk_load_catalogue({'CL': ['Jan', 'Jun']}, start_year=2026, end_year=2026)
+        cls.user = get_user_model().objects.create_user(username='trader', password='pw')
+        availability = Availability.objects.spreads().get()
+        cls.trades = []
+        for _ in range(3):
+            trade = save_entries(Trade(name=availability, trade_type='long', trader=cls.user), [entry(10, 400, [])])
+            Trade.objects.filter(pk=trade.pk).update(status='order_placed')
+            cls.trades.append(trade)
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, lines):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as handle:
+            handle.write('\n'.join(lines) + '\n')
+        return path
+
+    def run_import(self, path, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_fills', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_skips_bad_lines_and_resumes(self):
+        a, b, c = (t.id for t in self.trades)
+        path = self.write('drop.csv', [
+            'trade,entry,lots,price',
+            f'{a},0,2,401',
+            f'{b},0,x,401',          # bad lots
+            f'{c},0,11,401',         # overfill
+            f'{b},0,3,402.5',
+            '999999,0,1,400',        # unknown trade
+            f'{a},0,1,403',
+        ])
+        out, err = self.run_import(path, '--chunk-size', '2')
+        self.assertIn('3 fills applied, 3 lines rejected', out)
+        self.assertIn("line 3: 'lots' must be an integer", err)
+        self.assertEqual(
+            [Trade.objects.get(pk=pk).total_lots for pk in (a, b, c)], [3, 3, 0],
+        )
+        self.assertEqual(entries_json(Trade.objects.get(pk=a))[0]['fills_received'],
+                         [{'lots': 2, 'price': 401}, {'lots': 1, 'price': 403}])
+
+        # The checkpoint sits at the end of the file: a second run needs --resume and applies nothing
+        with self.assertRaises(CommandError):
+            self.run_import(path)
+        with open(path, 'a') as handle:
+            handle.write(f'{c},0,4,399\n')
+        out, _ = self.run_import(path, '--resume')
+        self.assertIn('1 fills applied, 0 lines rejected', out)
+        self.assertEqual(Trade.objects.get(pk=a).total_lots, 3)
+        self.assertEqual(Trade.objects.get(pk=c).total_lots, 4)
+
+    def test_jsonl_exit_fills(self):
+        trade = self.trades[0]
+        Trade.objects.filter(pk=trade.pk).update(avg_price=400)
+        exit_obj = Exit.objects.create(trade=trade, requested_exit_lots=4, exit_initiated_by=self.user,
+                                       exit_status='order_placed')
+        path = self.write('drop.jsonl', [
+            json.dumps({'exit': exit_obj.id, 'lots': 4, 'price': '410.5'}),
+            json.dumps({'trade': trade.id, 'entry': 0, 'lots': 4, 'price': 400}),
+            'not json',
+        ])
+        out, err = self.run_import(path)
+        self.assertIn('2 fills applied, 1 lines rejected', out)
+        exit_obj.refresh_from_db()
+        self.assertEqual((exit_obj.exit_status, exit_obj.profit_loss), ('filled', Decimal('42.00')))
@@ -0,0 +1,60 @@
+"""
+Fixed-point prices for fill and P&L arithmetic.
+
+Inside the aggregation paths a price is an int count of PRICE_TICK, the resolution the
+TradeEntry / Fill price columns store, so sums of lots x price are exact integer arithmetic
+with no Decimal built per fill. Decimal appears where a value enters (to_ticks) or leaves
+(from_ticks) those paths.
+
+Each Commodity carries its contract specs: `tick_size`, the minimum price increment prices
+are checked against at the API boundary, and `point_value`, the money value of one point
+of price per lot, which exit P&L is multiplied by.
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_EVEN, Decimal
+
+PRICE_PLACES = 4
+PRICE_TICK = Decimal(1).scaleb(-PRICE_PLACES)
+SCALE = 10 ** PRICE_PLACES
+
+ContractSpec = namedtuple("ContractSpec", "tick_size point_value")
+DEFAULT_SPEC = ContractSpec(PRICE_TICK, Decimal(1))
+
+
+def to_ticks(price):
+    """Price (int, float, str or Decimal) -> int count of PRICE_TICK, rounded half-even."""
+    if isinstance(price, int):
+        return price * SCALE
+    if isinstance(price, float):
+        return round(price * SCALE)
+    return int((Decimal(str(price)) * SCALE).to_integral_value(ROUND_HALF_EVEN))
+
+
+def from_ticks(ticks):
+    return Decimal(ticks).scaleb(-PRICE_PLACES)
+
+
+def notional_ticks(fills):
+    """Sum of lots x price over {lots, price} dicts, in ticks."""
+    return sum(int(fill.get("lots", 0) or 0) * to_ticks(fill.get("price") or 0) for fill in fills)
+
+
+def check_tick(price, tick_size):
+    """ValueError unless `price` is a whole number of `tick_size` increments."""
+    step = to_ticks(tick_size)
+    if step > 1 and to_ticks(price) % step:
+        raise ValueError(f"Price {price} is not a multiple of the tick size {tick_size.normalize()}.")
+
+
+def contract_spec(availability_id):
+    """Tick size and point value of an availability's commodity, from the catalogue cache."""
+    # Imported here because models.py imports this module
+    from .cache import catalogue_cache
+    from .models import Commodity
+
+    spec = catalogue_cache.get().contract_spec(availability_id)
+    if spec is None:
+        catalogue_cache.record_fallback()
+        row = Commodity.objects.filter(availability=availability_id).values_list("tick_size", "point_value").first()
+        spec = ContractSpec(*row) if row else DEFAULT_SPEC
+    return spec
@@ -1,7 +1,8 @@
 from django.urls import path
-from .views import (create_trade, ManagerTradeListView, UserTradeListView, update_trade_status, update_trade_fills, get_availabilities, update_close, my_trades,
+from .views import (create_trade, ManagerTradeListView, UserTradeListView, update_trade_status, update_trade_fills, append_trade_fills, batch_fills, get_availabilities, search_availabilities, get_spread_matrix, update_close, my_trades,
                     pending_close_requests, accept_close, closed_trades,
-                    create_exit, update_exit_status, my_exit_requests, all_exit_requests, add_lots_to_trade, exit_request_detail)
+                    create_exit, update_exit_status, my_exit_requests, all_exit_requests, add_lots_to_trade, exit_request_detail,
+                    catalogue_cache_stats)
 
 urlpatterns = [
     path('apply/', create_trade, name='apply-trade'), # working fine one 2308
@@ -9,7 +10,12 @@ urlpatterns = [
     path('my/', UserTradeListView.as_view(), name='user-trades'), # working fine on 2308
     path("trades/<int:trade_id>/update-status/", update_trade_status, name="update-trade-status"), # working fine on 2308
     path("trades/<int:trade_id>/update-fills/", update_trade_fills, name="update-fills-received"), # not working fine on 2308
+    path("trades/<int:trade_id>/append-fills/", append_trade_fills, name="append-trade-fills"),
+    path("fills/batch/", batch_fills, name="batch-fills"),
     path("availabilities/", get_availabilities, name="get_availabilities"), # working fine on 2308
+    path("availabilities/search/", search_availabilities, name="search-availabilities"),
+    path("availabilities/matrix/", get_spread_matrix, name="spread-matrix"),
+    path("catalogue/stats/", catalogue_cache_stats, name="catalogue-cache-stats"),
     path("trades/<int:trade_id>/close/", update_close, name="update-close"),
     path("trades/my/", my_trades, name="my-trades"),
     path("trades/close-requests/", pending_close_requests, name="pending-close-requests"),
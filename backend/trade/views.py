@@ -1,11 +1,13 @@
+import itertools
 from decimal import Decimal
 from django.db import transaction
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from django.db.models import Prefetch, Sum
+from django.db.models import Sum
 from django.shortcuts import get_object_or_404
 from django.utils.timezone import now
 from django.utils import timezone
@@ -13,10 +15,18 @@ from django.utils import timezone
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
-from .models import Trade, Availability, Exit
+from .models import Trade, Availability, Exit, VersionConflict, contract_key, parse_contract
+from .batch import BatchRejected, apply_fill_batch
+from .availability import SEARCH_ORDERING, availability_row, search_queryset, virtual_spreads_enabled
+from .cache import catalogue_cache
+from .fills import append_entries, append_fills, save_entries
+from .pagination import decode_cursor, encode_cursor, estimate_count, keyset_filter, list_response, order_by_keyset
 from .serializers import (
+    AppendFillsSerializer,
+    BatchFillsSerializer,
     TradeSerializer,
     ExitSerializer,
+    ExitRequestSerializer,
     NestedExitSerializer,
     TradeWithExitsSerializer,
     TradeExitDetailSerializer
@@ -51,6 +61,62 @@ def notify_exit_update(exit_obj: Exit):
         print(f"WebSocket notification failed for exit {exit_obj.id}: {e}")
 
 
+def notify_exits_created(trade_id, exits_data):
+    """
+    One exits_created message listing every exit a create_exit request added to a trade, sent
+    to the 'trades' group TradeConsumer listens on.
+    """
+    try:
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            'trades',
+            {
+                'type': 'exits_created',
+                'trade': trade_id,
+                'exits': exits_data,
+            }
+        )
+    except Exception as e:
+        print(f"WebSocket notification failed for exits of trade {trade_id}: {e}")
+
+
+def notify_fill_batch(trade_ids, exit_ids):
+    """One trade_update per affected trade, carrying its updated exits, instead of one message per item."""
+    try:
+        exits_by_trade = {}
+        exits = Exit.objects.filter(pk__in=exit_ids).for_listing()
+        for exit_obj in exits:
+            exits_by_trade.setdefault(exit_obj.trade_id, []).append(ExitSerializer(exit_obj).data)
+        channel_layer = get_channel_layer()
+        for trade in Trade.objects.filter(pk__in=trade_ids).for_listing():
+            async_to_sync(channel_layer.group_send)(
+                'trades',
+                {
+                    'type': 'trade_update',
+                    'trade': TradeSerializer(trade).data,
+                    'exits': exits_by_trade.get(trade.id, []),
+                }
+            )
+    except Exception as e:
+        print(f"WebSocket notification failed for fill batch: {e}")
+
+
+def expect_client_version(obj, request):
+    """
+    Take the `version` a client sent (if any) as the one its edit is based on, so the save
+    fails with 409 if the row changed since the client read it. Returns a 400 when malformed.
+    """
+    try:
+        obj.expect_version(request.data.get("version"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return None
+
+
+def version_conflict(e):
+    return Response({"error": str(e), "version": e.current_version}, status=status.HTTP_409_CONFLICT)
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def create_trade(request):
@@ -69,8 +135,14 @@ class TradePagination(PageNumberPagination):
     max_page_size = 100
 
 
+# Keyset orderings of the list endpoints (see list_response): the order they list in, id breaking ties
+NEWEST_FIRST = [('created_at', True, False), ('id', True, False)]
+CLOSE_REQUESTED_FIRST = [('close_requested_at', True, True), ('id', True, False)]
+FILLED_FIRST = [('fills_received_at', True, True), ('id', True, False)]
+
+
 class ManagerTradeListView(generics.ListAPIView):
-    queryset = Trade.objects.all().order_by('-created_at')
+    queryset = Trade.objects.for_listing().order_by('-created_at')
     serializer_class = TradeSerializer
     permission_classes = [permissions.IsAdminUser]
     pagination_class = TradePagination
@@ -81,7 +153,7 @@ class UserTradeListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Trade.objects.filter(trader=self.request.user).order_by('-created_at')
+        return Trade.objects.filter(trader=self.request.user).for_listing().order_by('-created_at')
 
 
 @api_view(['PATCH'])
@@ -92,6 +164,9 @@ def update_trade_status(request, trade_id):
     """
     trade = get_object_or_404(Trade, id=trade_id)
     new_status = request.data.get("status")
+    error = expect_client_version(trade, request)
+    if error:
+        return error
 
     valid_statuses = ['pending', 'approved', 'order_placed', 'fills_received', 'partial_fills_received']
     if new_status not in valid_statuses:
@@ -133,7 +208,10 @@ def update_trade_status(request, trade_id):
         trade.order_placed_at = None
         trade.fills_received_at = None
 
-    trade.save()
+    try:
+        trade.save_changes()
+    except VersionConflict as e:
+        return version_conflict(e)
     notify_trade_update(trade)
     return Response(TradeSerializer(trade).data)
 
@@ -144,10 +222,14 @@ def update_trade_fills(request, trade_id):
     """
     Replace lots_and_price entries.
     Each entry must contain: lots, price, added_at, fills_received, stop_loss.
-    This triggers pre_save to recompute avg_price and total_lots.
+    avg_price and total_lots are re-aggregated from the trade's Fill rows.
     Also updates status to partial_fills_received or fills_received depending on totals if order placed.
+    Send the trade's `version` to have the update refused with 409 if someone changed it meanwhile.
     """
     trade = get_object_or_404(Trade, id=trade_id)
+    error = expect_client_version(trade, request)
+    if error:
+        return error
 
     if trade.status not in ['approved', 'order_placed', 'partial_fills_received']:
         return Response({"error": "Cannot update fills for this trade status."}, status=status.HTTP_400_BAD_REQUEST)
@@ -161,9 +243,6 @@ def update_trade_fills(request, trade_id):
     if not s.is_valid():
         return Response(s.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    trade.lots_and_price = new_entries
-    trade.save()  # triggers pre_save to compute avg_price/total_lots
-
     # If order placed, update status based on fills
     if trade.status in ['order_placed', 'partial_fills_received']:
         total_requested_lots = sum(
@@ -195,14 +274,72 @@ def update_trade_fills(request, trade_id):
             trade.status = 'fills_received'
             if trade.fills_received_at is None:
                 trade.fills_received_at = timezone.now()
-        
-        trade.save()
+
+    # Rewrites the trade's entries / fills and saves avg_price and total_lots aggregated from them
+    try:
+        save_entries(trade, new_entries, update_fields=['status', 'fills_received_at'])
+    except VersionConflict as e:
+        return version_conflict(e)
+    except ValueError as e:
+        # The new fills no longer cover what the trade's FIFO / LIFO exits closed
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     notify_trade_update(trade)
     return Response(TradeSerializer(trade).data)
 
 
 
+@api_view(['PATCH'])
+@permission_classes([permissions.IsAuthenticated])
+def append_trade_fills(request, trade_id):
+    """
+    Record new fills against one lots_and_price entry without resending the whole list.
+    Body: {"entry": <index>, "fills": [{"lots": int, "price": number}, ...]}
+    avg_price / total_lots are moved by the new fills only and the stored JSON is appended to.
+    Status moves to partial_fills_received or fills_received as with update-fills.
+    """
+    trade = get_object_or_404(Trade, id=trade_id)
+
+    if trade.status not in ['approved', 'order_placed', 'partial_fills_received']:
+        return Response({"error": "Cannot update fills for this trade status."}, status=status.HTTP_400_BAD_REQUEST)
+
+    s = AppendFillsSerializer(data=request.data)
+    if not s.is_valid():
+        return Response(s.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        trade = append_fills(trade, s.validated_data['entry'], s.validated_data['fills'])
+    except (IndexError, ValueError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    notify_trade_update(trade)
+    return Response(TradeSerializer(trade).data)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def batch_fills(request):
+    """
+    Apply a broker fill drop for many trades and exits in one transaction.
+    Body: {"trades": [{"trade": id, "entry": index, "fills": [{"lots", "price"}, ...]}, ...],
+           "exits": [{"exit": id, "recieved_lots": int, "exit_price": optional}, ...]}
+    Every item is checked against the locked rows first; if any is invalid nothing is applied
+    and the 400 response reports each item. Otherwise the response reports the new totals and
+    statuses, and one WebSocket message goes out per affected trade after commit.
+    """
+    s = BatchFillsSerializer(data=request.data)
+    if not s.is_valid():
+        return Response(s.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        report, trade_ids, exit_ids = apply_fill_batch(s.validated_data['trades'], s.validated_data['exits'])
+    except BatchRejected as e:
+        return Response({"applied": False, "error": str(e), **e.report}, status=status.HTTP_400_BAD_REQUEST)
+
+    transaction.on_commit(lambda: notify_fill_batch(trade_ids, exit_ids))
+    return Response({"applied": True, **report})
+
+
 @api_view(['GET'])
 def get_availabilities(request):
     """
@@ -212,6 +349,8 @@ def get_availabilities(request):
     - end_month, end_year
     If no params: return up to 20 results.
     If any param provided: return up to 1 result for specific match behavior (as per your original view).
+    With VIRTUAL_SPREADS on, spreads that have not been traded yet come back with a virtual id.
+    Answered from the per-worker catalogue cache.
     """
     start_month = request.GET.get('start_month')
     end_month = request.GET.get('end_month')
@@ -219,50 +358,146 @@ def get_availabilities(request):
     end_year = request.GET.get('end_year')
     code = request.GET.get('code')
 
-    qs = Availability.objects.filter(is_available=True).select_related('commodity', 'start_month', 'end_month')
+    try:
+        start = (start_month, int(start_year)) if start_month and start_year else None
+    except ValueError:
+        return Response({"error": "Invalid start year format"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        end = (end_month, int(end_year)) if end_month and end_year else None
+    except ValueError:
+        return Response({"error": "Invalid end year format"}, status=status.HTTP_400_BAD_REQUEST)
 
-    if code:
-        qs = qs.filter(commodity__code__iexact=code)
-    if start_month and start_year:
-        try:
-            qs = qs.filter(start_month__month__iexact=start_month, start_month__year=int(start_year))
-        except ValueError:
-            return Response({"error": "Invalid start year format"}, status=status.HTTP_400_BAD_REQUEST)
-    if end_month and end_year:
-        try:
-            qs = qs.filter(end_month__month__iexact=end_month, end_month__year=int(end_year))
-        except ValueError:
-            return Response({"error": "Invalid end year format"}, status=status.HTTP_400_BAD_REQUEST)
+    limit = 1 if any([start_month, end_month, start_year, end_year, code]) else 20
+
+    start_key = contract_key(*start) if start else None
+    end_key = contract_key(*end) if end else None
+    if (start and start_key is None) or (end and end_key is None):
+        return Response([])
 
-    if not any([start_month, end_month, start_year, end_year, code]):
-        qs = qs[:20]
+    catalogue = catalogue_cache.get()
+    if virtual_spreads_enabled():
+        rows = catalogue.iter_virtual_availabilities(code=code, start_key=start_key, end_key=end_key)
     else:
-        qs = qs[:1]
-
-    data = [{
-        "id": a.id,
-        "commodity_name": a.commodity.name,
-        "commodity_code": a.commodity.code,
-        "start_month": a.start_month.month if a.start_month else "N/A",
-        "start_year": a.start_month.year if a.start_month else "N/A",
-        "end_month": a.end_month.month if a.end_month else "N/A",
-        "end_year": a.end_month.year if a.end_month else "N/A",
-        "period_display": f"{a.start_month.month}{a.start_month.year} to {a.end_month.month}{a.end_month.year}" if a.start_month and a.end_month else "N/A",
-        "settlement_price": a.settlement_price,
-        "is_available": a.is_available,
-    } for a in qs]
-    return Response(data)
+        rows = catalogue.iter_availabilities(code=code, start_key=start_key, end_key=end_key)
+    return Response(list(itertools.islice(rows, limit)))
+
+
+@api_view(['GET'])
+def get_spread_matrix(request):
+    """
+    Settlement curve and full calendar spread matrix for one commodity (?commodity=ZC).
+    Response: {commodity_code, commodity_name, months, settlement_ids, curve, matrix} where
+    matrix[i][j] = curve[i] - curve[j] is the months[i] to months[j] spread for i < j.
+    Computed once per catalogue load, so it is recomputed after the next settlement update.
+    """
+    code = (request.GET.get('commodity') or '').strip().lower()
+    if not code:
+        return Response({"error": "commodity is required."}, status=status.HTTP_400_BAD_REQUEST)
+    catalogue = catalogue_cache.get()
+    commodity = catalogue.commodities_by_code.get(code)
+    if commodity is None:
+        return Response({"error": "Commodity not found."}, status=status.HTTP_404_NOT_FOUND)
+    return Response(catalogue.spread_matrix(commodity.id))
+
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 200
+
+
+@api_view(['GET'])
+def search_availabilities(request):
+    """
+    Browse the availability catalogue with keyset pagination.
+    Query params (all optional):
+    - commodity: comma separated commodity codes
+    - start_from, start_to, end_from, end_to: contract months like "Mar26" (inclusive)
+    - min_width, max_width: spread width in months
+    - kind: "single" or "spread"
+    - page_size (default 50, max 200), cursor (from the previous page's "next")
+    Results are ordered by commodity, start month, end month (singles after spreads).
+    count_estimate is computed for the first page only (no cursor) and is null on later pages,
+    so a deep page costs what the first does.
+    """
+    params = request.GET
+    catalogue = catalogue_cache.get()
+
+    commodity_ids = None
+    if params.get('commodity'):
+        codes = [c.strip().lower() for c in params['commodity'].split(',') if c.strip()]
+        commodity_ids = [catalogue.commodities_by_code[c].id for c in codes if c in catalogue.commodities_by_code]
+
+    ranges = {}
+    for name in ['start_from', 'start_to', 'end_from', 'end_to']:
+        ranges[name] = parse_contract(params[name]) if params.get(name) else None
+        if params.get(name) and ranges[name] is None:
+            return Response({"error": f"Invalid {name}, expected a contract month like Mar26."},
+                            status=status.HTTP_400_BAD_REQUEST)
+    try:
+        width_range = tuple(int(params[name]) if params.get(name) else None for name in ['min_width', 'max_width'])
+        page_size = min(int(params.get('page_size', SEARCH_PAGE_SIZE)), SEARCH_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({"error": "min_width, max_width and page_size must be integers."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if page_size < 1:
+        return Response({"error": "page_size must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+    kind = params.get('kind')
+    if kind not in [None, 'single', 'spread']:
+        return Response({"error": "kind must be 'single' or 'spread'."}, status=status.HTTP_400_BAD_REQUEST)
+
+    filters = {
+        'commodity_ids': commodity_ids,
+        'start_range': (ranges['start_from'], ranges['start_to']),
+        'end_range': (ranges['end_from'], ranges['end_to']),
+        'width_range': width_range,
+        'kind': kind,
+    }
+    after = decode_cursor(params['cursor'], SEARCH_ORDERING, Availability) if params.get('cursor') else None
+
+    if virtual_spreads_enabled():
+        page = list(itertools.islice(catalogue.search(after=after, **filters), page_size + 1))
+        keys = [key for key, _ in page]
+        results = [row for _, row in page[:page_size]]
+        count_estimate = None if after else catalogue.count(**filters)
+    else:
+        qs = search_queryset(**filters)
+        count_estimate = None if after else estimate_count(qs)
+        if after:
+            qs = qs.filter(keyset_filter(SEARCH_ORDERING, after))
+        rows = list(order_by_keyset(qs, SEARCH_ORDERING).select_related(
+            'commodity', 'start_month', 'end_month'
+        )[:page_size + 1])
+        keys = [(a.commodity_id, a.start_key, a.end_key) for a in rows]
+        results = [
+            availability_row(a.id, a.commodity, a.start_month, a.end_month, a.settlement_price, a.is_available)
+            for a in rows[:page_size]
+        ]
+
+    next_url = None
+    if len(keys) > page_size:
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(keys[page_size - 1]))
+
+    return Response({
+        "count_estimate": count_estimate,
+        "next": next_url,
+        "results": results,
+    })
 
 
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAuthenticated])
 def update_close(request, trade_id):
     trade = get_object_or_404(Trade, id=trade_id, trader=request.user)
+    error = expect_client_version(trade, request)
+    if error:
+        return error
     if trade.is_closed:
         return Response({"error": "Request already sent."}, status=status.HTTP_400_BAD_REQUEST)
     trade.close_requested_at = now()
     trade.is_closed = True
-    trade.save()
+    try:
+        trade.save_changes()
+    except VersionConflict as e:
+        return version_conflict(e)
     notify_trade_update(trade)
     return Response(TradeSerializer(trade).data)
 
@@ -270,27 +505,31 @@ def update_close(request, trade_id):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def my_trades(request):
-    trades = Trade.objects.filter(trader=request.user).order_by('-created_at')
-    serializer = TradeSerializer(trades, many=True, context={'request': request})
-    return Response(serializer.data)
+    trades = Trade.objects.filter(trader=request.user).for_listing().order_by('-created_at')
+    return list_response(request, trades, TradeSerializer, NEWEST_FIRST)
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def pending_close_requests(request):
-    trades = Trade.objects.filter(is_closed=True, close_accepted=False).order_by('-close_requested_at')
-    serializer = TradeSerializer(trades, many=True)
-    return Response(serializer.data)
+    trades = Trade.objects.filter(is_closed=True, close_accepted=False).for_listing().order_by('-close_requested_at')
+    return list_response(request, trades, TradeSerializer, CLOSE_REQUESTED_FIRST)
 
 
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAdminUser])
 def accept_close(request, trade_id):
     trade = get_object_or_404(Trade, id=trade_id)
+    error = expect_client_version(trade, request)
+    if error:
+        return error
     if not trade.is_closed or trade.close_accepted:
         return Response({"error": "Invalid close request."}, status=status.HTTP_400_BAD_REQUEST)
     trade.close_accepted = True
-    trade.save()
+    try:
+        trade.save_changes()
+    except VersionConflict as e:
+        return version_conflict(e)
     notify_trade_update(trade)
     return Response(TradeSerializer(trade).data)
 
@@ -298,16 +537,17 @@ def accept_close(request, trade_id):
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def closed_trades(request):
-    trades = Trade.objects.filter(is_closed=True, close_accepted=True).order_by('-fills_received_at')
-    serializer = TradeSerializer(trades, many=True)
-    return Response(serializer.data)
+    trades = Trade.objects.filter(is_closed=True, close_accepted=True).for_listing().order_by('-fills_received_at')
+    return list_response(request, trades, TradeSerializer, FILLED_FIRST)
 
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def create_exit(request):
     """
-    Create multiple exits in one request.
+    Create multiple exits in one request: the items are validated together, inserted with one
+    bulk_create and announced with one exits_created message, so the cost barely grows with
+    the number of exits.
     """
     trade_id = request.data.get("trade")
     exits = request.data.get("exits")
@@ -326,27 +566,26 @@ def create_exit(request):
     if trade.trader != request.user and not request.user.is_staff:
         return Response({"error": "Not allowed to exit this trade."}, status=status.HTTP_403_FORBIDDEN)
 
-    # Optional: enforce a simple cap (comment out if not needed)
-    # available = sum(int(leg.get("fills_received", 0) or 0) for leg in (trade.lots_and_price or []))
-    # if sum(int(x.get("requested_exit_lots", 0) or 0) for x in exits) > available:
-    #     return Response({"error": "Requested exits exceed available lots."}, status=status.HTTP_400_BAD_REQUEST)
+    items = ExitRequestSerializer(data=exits, many=True)
+    items.is_valid(raise_exception=True)
 
-    created = []
     with transaction.atomic():
-        for item in exits:
-            payload = {
-                "trade": trade.id,
-                "requested_exit_lots": item.get("requested_exit_lots"),
-                "exit_price": item.get("exit_price"),
-                "exit_initiated_by": request.user.id,
-            }
-            s = ExitSerializer(data=payload, context={"request": request})
-            s.is_valid(raise_exception=True)
-            obj = s.save(exit_initiated_by=request.user)
-            notify_exit_update(obj)
-            created.append(ExitSerializer(obj).data)
-
-    return Response({"trade": trade.id, "created": created}, status=status.HTTP_201_CREATED)
+        # Cap the whole request on the trade's exit counters: one locked read, so concurrent
+        # requests cannot both claim the same lots
+        trade = Trade.objects.select_for_update().get(pk=trade.pk)
+        requested = sum(item["requested_exit_lots"] for item in items.validated_data)
+        if requested > trade.remaining_lots:
+            return Response(
+                {"error": f"Requested exits ({requested} lots) exceed the trade's remaining lots ({trade.remaining_lots})."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        created = Exit.objects.create_requests([
+            Exit(trade=trade, exit_initiated_by=request.user, **item) for item in items.validated_data
+        ])
+        data = ExitSerializer(created, many=True).data
+        transaction.on_commit(lambda: notify_exits_created(trade.id, data))
+
+    return Response({"trade": trade.id, "created": data}, status=status.HTTP_201_CREATED)
 
 
 @api_view(['GET'])
@@ -355,12 +594,8 @@ def my_exit_requests(request):
     trades = Trade.objects.filter(
         trader=request.user,
         is_closed=False
-    ).prefetch_related(
-        Prefetch('exits', queryset=Exit.objects.order_by('-requested_at'))
-    ).order_by('-created_at')
-
-    serializer = TradeWithExitsSerializer(trades, many=True)
-    return Response(serializer.data)
+    ).with_exits().order_by('-created_at')
+    return list_response(request, trades, TradeWithExitsSerializer, NEWEST_FIRST)
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -379,12 +614,8 @@ def exit_request_detail(request, id):
 def all_exit_requests(request):
     trades = Trade.objects.filter(
         is_closed=False, exits__isnull=False
-    ).prefetch_related(
-        Prefetch('exits', queryset=Exit.objects.order_by('-requested_at'))
-    ).distinct().order_by('-created_at')
-    
-    serializer = TradeWithExitsSerializer(trades, many=True)
-    return Response(serializer.data)
+    ).with_exits().distinct().order_by('-created_at')
+    return list_response(request, trades, TradeWithExitsSerializer, NEWEST_FIRST)
 
 
 @api_view(['PATCH'])
@@ -398,6 +629,9 @@ def update_exit_status(request, exit_id):
 
     new_status = request.data.get("exit_status")
     received_lots = request.data.get("recieved_lots", None)
+    error = expect_client_version(exit_obj, request)
+    if error:
+        return error
 
     if new_status == 'approved':
         exit_obj.exit_status = 'approved'
@@ -428,7 +662,13 @@ def update_exit_status(request, exit_id):
     else:
         return Response({"error": "Invalid exit_status."}, status=status.HTTP_400_BAD_REQUEST)
 
-    exit_obj.save()
+    try:
+        exit_obj.save_changes()
+    except VersionConflict as e:
+        return version_conflict(e)
+    except ValueError as e:
+        # More lots received than the FIFO / LIFO trade has open
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     notify_exit_update(exit_obj)
     serializer = NestedExitSerializer(exit_obj)
     return Response(serializer.data)
@@ -440,10 +680,13 @@ def add_lots_to_trade(request, trade_id):
     """
     Append a new entry to lots_and_price with fields:
       lots (int), price (number), added_at (ISO string), fills_received (int), stop_loss (number)
-    Does not recompute avg/total manually; model signals handle it.
+    avg_price and total_lots are re-aggregated from the trade's Fill rows.
     """
     trade = get_object_or_404(Trade, id=trade_id, trader=request.user)
     payload = request.data or {}
+    error = expect_client_version(trade, request)
+    if error:
+        return error
     required = ['lots', 'price', 'added_at', 'fills_received', 'stop_loss']
     for entry in payload["lots_and_price"]:
         for key in required:
@@ -456,9 +699,25 @@ def add_lots_to_trade(request, trade_id):
     if not s.is_valid():
         return Response(s.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    trade.lots_and_price = new_list
     if trade.status == "fills_received":
         trade.status = "partial_fills_received"
-    trade.save()
+    existing = trade.lots_and_price or []
+    try:
+        if new_list[:len(existing)] == existing:
+            # Clients send the existing entries followed by the new ones; only the new ones are written
+            trade = append_entries(trade, new_list[len(existing):], update_fields=['status'])
+        else:
+            save_entries(trade, new_list, update_fields=['status'])
+    except VersionConflict as e:
+        return version_conflict(e)
+    except ValueError as e:
+        # The rewritten fills no longer cover what the trade's FIFO / LIFO exits closed
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     notify_trade_update(trade)
     return Response(TradeSerializer(trade).data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def catalogue_cache_stats(request):
+    return Response(catalogue_cache.stats())
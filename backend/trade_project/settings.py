@@ -162,6 +162,9 @@ CORS_ALLOWED_ORIGINS = [
     "http://192.168.0.241:3000", # React dev server on local network
     ]  
 
+# Derive calendar spread availabilities from the Settlement list instead of storing every pair
+VIRTUAL_SPREADS = config('VIRTUAL_SPREADS', default=False, cast=bool)
+
 ASGI_APPLICATION = 'trade_project.asgi.application'
 
 UPSTASH_REDIS_URL = f"rediss://{config('UPSTASH_REDIS_USER')}:{config('UPSTASH_REDIS_PASSWORD')}@{config('UPSTASH_REDIS_HOST')}:{config('UPSTASH_REDIS_PORT')}"
@@ -174,3 +177,11 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Shared by every worker: the catalogue cache's version stamp (trade/cache.py) lives here
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": UPSTASH_REDIS_URL,
+    },
+}